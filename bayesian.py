@@ -1,7 +1,74 @@
 from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.throughput import ThroughputReporter
+from naivebayesian.instrumentation import formatStats
 import configargparse
 import unicodecsv as csv
-import io
+import multiprocessing
+import collections
+import itertools
+import sys
+
+# the classifier used by each worker process
+worker_nb = None
+
+def init_worker( database, options ):
+    ''' open the model in a worker process '''
+    global worker_nb
+    worker_nb = NaiveBayesian( database, **options )
+
+def classify_chunk( texts, threshold ):
+    ''' get the best match of a chunk of strings in a worker process
+        @return tuple (list of best matches, number of tokens, counters of the instrumentation or None)
+    '''
+    counter = ThroughputReporter( interval=None )
+    results = list( worker_nb.classify_stream( texts, threshold, chunk_size=len(texts), reporter=counter ) )
+    return results, counter.tokens, worker_nb.instruments.take()
+
+def classify_parallel( rows, workers, chunk_size, threshold, database, options, reporter, instruments ):
+    ''' classify rows in a pool of worker processes.
+    Rows are sent to the workers in chunks, and no more than two chunks per
+    worker are in flight at a time, so memory use doesn't depend on the size
+    of the input.
+
+        @return iterator of ((row, text), best match) in the order of the rows
+        @param iterator of (row, text to classify)
+    '''
+    pool = multiprocessing.Pool( workers, init_worker, (database, options) )
+    pending = collections.deque()
+    try:
+        for chunk in chunks( rows, chunk_size ):
+            texts = [text for row, text in chunk]
+            pending.append( (chunk, pool.apply_async( classify_chunk, (texts, threshold) )) )
+            while pending and (len(pending) >= workers*2 or pending[0][1].ready()):
+                for item in finish_chunk( pending.popleft(), reporter, instruments ):
+                    yield item
+        while pending:
+            for item in finish_chunk( pending.popleft(), reporter, instruments ):
+                yield item
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def finish_chunk( pending, reporter, instruments ):
+    ''' wait for the results of a chunk sent to a worker '''
+    chunk, results = pending
+    results, tokens, stats = results.get()
+    reporter.update( len(chunk), tokens )
+    if stats:
+        instruments.merge( stats )
+    return zip( chunk, results )
+
+def chunks( iterable, size ):
+    ''' split an iterable into lists of size items '''
+    chunk = []
+    for item in iterable:
+        chunk.append( item )
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 def main():
 
@@ -11,8 +78,8 @@ def main():
         ignore_unknown_config_file_keys=True)
     
     # key files
-    parser.add_argument("input", help='A csv file with rows to be classified')
-    parser.add_argument("output", help='The name of a file to write to')
+    parser.add_argument("input", help='A csv file with rows to be classified (- for stdin)')
+    parser.add_argument("output", nargs='?', default='-', help='The name of a file to write to (default - for stdout)')
     parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
     
     # database variables
@@ -24,6 +91,19 @@ def main():
     parser.add_argument('--test', dest='test', action='store_true', help='Whether to do a test run (only 10 rows)')
     parser.add_argument('-l', '--limit', type=int, default=0, help='Put a limit on the number of rows run')
     parser.add_argument("-t", "--threshold", type=float, default=-0.01, help='The threshold (out of 100) for accepting a match on (default -0.01 ie no threshold)')
+    parser.add_argument('--bloom-filter', dest='bloom_filter', action='store_true', help='Whether to keep a bloom filter of the vocabulary next to the database')
+    parser.add_argument('--bloom-error-rate', type=float, default=0.01, help='The false positive rate the bloom filter is sized for (default 0.01)')
+    parser.add_argument('--bloom-max-bytes', type=int, default=None, help='Put a limit on the size of the bloom filter')
+    parser.add_argument('--cache-size', type=int, default=100000, help='The number of words kept in the word cache (0 for no limit)')
+    parser.add_argument('--result-cache', type=int, default=0, help='The number of best matches kept for rows with the same words (0 for none)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='The number of processes used to classify rows (default 1)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='The number of rows classified (or sent to a worker process) at a time')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between progress reports (0 for none)')
+    parser.add_argument('--read-write', dest='read_only', action='store_false', help='Whether to open the database for writing, and update the probabilities before classifying')
+    parser.add_argument('--mmap-size', type=int, default=None, help='Bytes of the database sqlite maps into memory (default 256MB when read only)')
+    parser.add_argument('--storage', choices=['sql', 'memory'], default='sql', help='Whether to read the model from the database as needed, or load it all into memory first')
+    parser.add_argument('--vectorized', dest='vectorized', action='store_true', help='Whether to score with the numpy engine')
+    parser.add_argument('--stats', dest='stats', action='store_true', help='Whether to time each stage and SQL statement and print where the time went')
     
     # CSV file options
     parser.add_argument("--column", default=0, help='The column name or number of the content to be classified')
@@ -32,7 +112,7 @@ def main():
     parser.add_argument('--result-col', default='result', help='Header used for the results column')
     parser.add_argument('--score-col', default='score', help='Header used for the result score column')
     parser.add_argument("-d", "--delimiter", default=",", help='Delimiter used in the CSV file')
-    parser.set_defaults( header=True, test=False, sqlite=True )
+    parser.set_defaults( header=True, test=False, sqlite=True, vectorized=False, bloom_filter=False, read_only=True, stats=False )
     
     args = parser.parse_args()
     
@@ -40,39 +120,51 @@ def main():
     if args.test:
         args.limit = 10
         
-    # set up the output if none given
-    if( args.output is None):
-        args.output = io.StringIO()
+    # messages go to stderr if the results are going to stdout
+    log = sys.stderr if args.output == '-' else sys.stdout
     
     # stats used to track progress
     rows = 0
     attempted_rows = 0    # the number of rows that have been attempted
     classified = 0        # the number of items we've classified
     not_classified = 0    # the number of items that haven't been classified
+    reporter = ThroughputReporter( "rows", args.report_interval )
     
     # set up the bayesian classifiers
-    nb = NaiveBayesian( args.database )
+    options = dict( vectorized=args.vectorized, cache_size=args.cache_size, result_cache_size=args.result_cache, bloom_filter=args.bloom_filter,
+                    bloom_error_rate=args.bloom_error_rate, bloom_max_bytes=args.bloom_max_bytes,
+                    read_only=args.read_only, storage=args.storage, instrument=args.stats )
+    if args.mmap_size is not None:
+        options['profile'] = { 'mmap_size': args.mmap_size }
+    try:
+        nb = NaiveBayesian( args.database, **options )
+    except IOError as e:
+        print >>log, e
+        sys.exit(1)
     
     # open our file and load as CSV
-    with open(args.input, 'rb') as csvfile:
+    csvfile = sys.stdin if args.input == '-' else open(args.input, 'rb')
+    csvoutput = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
         
         if(args.header):
             datarows = csv.DictReader(csvfile, delimiter=args.delimiter)
         else:
             datarows = csv.reader(csvfile, delimiter=args.delimiter)
             args.column = int(args.column)
-        key = 0
         
-        nb.updateProbabilities()
+        if not args.read_only:
+            nb.updateProbabilities()
         
-        with open(args.output, 'w') as csvoutput:
-            headers = datarows.fieldnames
-            headers.append(args.result_col)
-            headers.append(args.score_col)
-            writer  = csv.DictWriter(csvoutput, fieldnames=headers, lineterminator='\n', delimiter=args.delimiter)
-            writer.writeheader()
-            
-            # go through each row
+        headers = datarows.fieldnames
+        headers.append(args.result_col)
+        headers.append(args.score_col)
+        writer  = csv.DictWriter(csvoutput, fieldnames=headers, lineterminator='\n', delimiter=args.delimiter)
+        writer.writeheader()
+        
+        def to_classify():
+            ''' the rows, with the item we're categorising '''
+            key = 0
             for row in datarows:
             
                 # check if we're doing a header row
@@ -86,41 +178,71 @@ def main():
                 to_cat = None
                 if(args.header == False or args.column in row):
                     to_cat = row[args.column]
-                    
-                row_result_category = None
-                row_result_score = None
-            
-                # our result
-                if to_cat:
-                    row_result = nb.bestMatch( to_cat, args.threshold )
-                    if row_result:
-                        classified += 1
-                        row_result_category = row_result[0]
-                        row_result_score = row_result[1]
-                    else:
-                        not_classified += 1
-                    attempted_rows += 1
-                    #writer.writerow( row ) # this will write out the FrID and description and an extra column called 'result' but with nothing in
-                    if key % 100 == 0:
-						print key
-						
-                
-                row[args.result_col] = row_result_category
-                row[args.score_col] = row_result_score
-                writer.writerow( row ) # this row will write out the category as well as the FrID and description if 'row[args.score_col] = row_result_score' is commented out - they cannot be used together
-                
-                if args.test:
-                    print row
+                yield row, to_cat
                 
                 # maintain the loop
                 key += 1
                 if(args.limit > 0 and key >= args.limit): 
                     break # if we're testing or limited then break the loop
+        
+        if args.workers > 1:
+            results = classify_parallel( to_classify(), args.workers, args.chunk_size, args.threshold,
+                                         args.database, options, reporter, nb.instruments )
+        else:
+            # the rows are read ahead of the results by at most one chunk
+            rows, texts = itertools.tee( to_classify() )
+            texts = ( to_cat for row, to_cat in texts )
+            results = itertools.izip( rows, nb.classify_stream( texts, args.threshold, args.chunk_size, reporter ) )
+        
+        # go through each row
+        for (row, to_cat), row_result in results:
+        
+            row_result_category = None
+            row_result_score = None
+        
+            # our result
+            if to_cat:
+                if row_result:
+                    classified += 1
+                    row_result_category = row_result[0]
+                    row_result_score = row_result[1]
+                else:
+                    not_classified += 1
+                attempted_rows += 1
+            
+            row[args.result_col] = row_result_category
+            row[args.score_col] = row_result_score
+            writer.writerow( row ) # this row will write out the category as well as the FrID and description if 'row[args.score_col] = row_result_score' is commented out - they cannot be used together
+            
+            if args.test:
+                print >>log, row
+    finally:
+        if csvfile is not sys.stdin:
+            csvfile.close()
+        if csvoutput is not sys.stdout:
+            csvoutput.close()
 
-    print attempted_rows, "rows attempted"
-    print classified, "rows classified"
-    print not_classified, "rows not classified"
+    if args.report_interval:
+        reporter.report()
+    print >>log, attempted_rows, "rows attempted"
+    print >>log, classified, "rows classified"
+    print >>log, not_classified, "rows not classified"
+    if args.stats:
+        for line in formatStats( nb.stats() ):
+            print >>log, line
+    if args.workers > 1:
+        return
+    cache = nb.cacheStats()
+    if cache:
+        print >>log, "word cache: %(hits)d hits, %(misses)d misses, %(evictions)d evictions (%(size)d words cached)" % cache
+    results = nb.resultCacheStats()
+    if results:
+        results['percent'] = 100 * results['hit_rate']
+        print >>log, "result cache: %(hits)d hits, %(misses)d misses, %(percent).1f%% hit rate (%(size)d results cached)" % results
+    bloom = nb.bloomStats()
+    if bloom:
+        print >>log, "bloom filter: %(words)d words in %(bytes)d bytes, %(hashes)d hashes, expected false positive rate %(error_rate).4f" % bloom
                     
                     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
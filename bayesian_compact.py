@@ -0,0 +1,109 @@
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.inmemorynaivebayesianstorage import InMemoryNaiveBayesianStorage
+import configargparse
+import sqlite3
+import os
+import sys
+
+def heldOut( nbs, every ):
+    ''' split a model into the references held out to test it, and a copy of
+    the model trained without them.
+
+        @return tuple (InMemoryNaiveBayesianStorage, list of (category id, content))
+        @param  InMemoryNaiveBayesianStorage model
+        @param  int one reference in this many is held out
+    '''
+    model = nbs.copy()
+    nb = NaiveBayesian( None, storage=model )
+    held_ids = sorted( model.references )[::every]
+    held = [model.references[doc_id][:2] for doc_id in held_ids]
+    nb.untrain_many( held_ids )
+    nb.updateProbabilities()
+    return model, held
+
+def accuracy( model, held, remove = () ):
+    ''' classify the references held out, with some words removed from the model.
+        @return float share of the references given their own category
+    '''
+    if remove:
+        model = model.copy()
+        model.removeWords( remove )
+        model.updateProbabilities()
+    nb = NaiveBayesian( None, storage=model )
+    right = 0
+    for category_id, content in held:
+        match = nb.bestMatch( content )
+        if match and match[0] == category_id:
+            right += 1
+    return float(right) / len(held) if held else 0.0
+
+def main():
+
+    # get the arguments we need
+    parser = configargparse.ArgumentParser(description='Make a bayesian filter database smaller by removing rare and uninformative words.',
+        default_config_files=['config.cfg'],
+        ignore_unknown_config_file_keys=True)
+
+    # key files
+    parser.add_argument("-db", "--database", default="bayesian.db", help='The sqlite database holding the trained model')
+    parser.add_argument("output", nargs='?', default=None, help='The compacted database to write (default the database itself)')
+    parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
+
+    # configuration variables
+    parser.add_argument('--min-count', type=int, default=2, help='Remove words counted fewer times than this in all the categories (default 2)')
+    parser.add_argument('--min-docs', type=int, default=0, help='Remove words found in fewer references than this (default 0 ie none)')
+    parser.add_argument('--min-chi2', type=float, default=None, help='Remove words whose chi-square score is below this')
+    parser.add_argument('--max-words', type=int, default=None, help='Keep at most this many words, the ones with the best chi-square score')
+    parser.add_argument('--holdout', type=int, default=10, help='Hold out one reference in this many to measure the accuracy before and after (0 for none, default 10)')
+    parser.add_argument('--layout', choices=['v1', 'v2'], default=None, help='The layout of the tables of the compacted database (default the layout of the database)')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true', help='Only report what would be removed')
+    parser.set_defaults( dry_run=False )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print "No database found at", args.database
+        sys.exit(1)
+    output = args.output or args.database
+
+    print "Loading", args.database
+    nbs = InMemoryNaiveBayesianStorage( args.database )
+    nb = NaiveBayesian( None, storage=nbs )
+    options = {
+        'min_count': args.min_count,
+        'min_docs': args.min_docs,
+        'min_score': args.min_chi2,
+        'max_words': args.max_words
+    }
+    remove = nb.selectWords( **options )
+    print "%d of %d words removed" % ( len(remove), len(nbs.words) )
+
+    if args.holdout > 0 and nbs.references:
+        # the words are chosen again without the references held out, so they don't judge themselves
+        model, held = heldOut( nbs, args.holdout )
+        before = accuracy( model, held )
+        after = accuracy( model, held, NaiveBayesian( None, storage=model ).selectWords( **options ) )
+        print "accuracy on %d held out references: %.1f%% before, %.1f%% after" % ( len(held), 100*before, 100*after )
+
+    if args.dry_run:
+        return
+
+    size = os.path.getsize( args.database )
+    nbs.removeWords( remove )
+    nbs.updateProbabilities()
+
+    # write to a new file first, so the model is never left half written
+    target = output + ".compacting"
+    if os.path.exists( target ):
+        os.remove( target )
+    nbs.saveDatabase( target, args.layout )
+    con = sqlite3.connect( target )
+    con.execute( "VACUUM" )
+    con.close()
+    os.rename( target, output )
+
+    print "%d bytes compacted to %d bytes in %s" % ( size, os.path.getsize( output ), output )
+
+
+if __name__ == '__main__':
+    main()
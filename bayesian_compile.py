@@ -0,0 +1,36 @@
+from naivebayesian.naivebayesianstorage import NaiveBayesianStorage
+from naivebayesian.compiledstorage import CompiledStorage
+import configargparse
+import os
+import sys
+
+def main():
+
+    # get the arguments we need
+    parser = configargparse.ArgumentParser(description='Compile a bayesian filter database into a single read only file.',
+        default_config_files=['config.cfg'],
+        ignore_unknown_config_file_keys=True)
+
+    # key files
+    parser.add_argument("-db", "--database", default="bayesian.db", help='The sqlite database holding the trained model')
+    parser.add_argument("output", nargs='?', default=None, help='The compiled model file to write (default the database name with .nbm)')
+    parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = os.path.splitext(args.database)[0] + ".nbm"
+
+    try:
+        nbs = NaiveBayesianStorage( args.database, read_only=True )
+    except IOError as e:
+        print e
+        sys.exit(1)
+
+    print "Compiling", args.database, "to", args.output
+    stats = CompiledStorage.compile( nbs, args.output )
+    print "%(categories)d categories, %(words)d words, %(postings)d word counts in %(bytes)d bytes" % stats
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.throughput import ThroughputReporter
+import configargparse
+import unicodecsv as csv
+import os
+import sys
+
+def writeConfusion( filename, confusion ):
+    ''' write a confusion matrix to a csv file, a row for each category and a
+    column for each best match (empty for no match).
+        @param string file name
+        @param array keys = (category id, best match or None), values = number of references
+    '''
+    categories = sorted( set( [category_id for category_id, matched in confusion] ) )
+    matches = sorted( set( [matched for category_id, matched in confusion if matched is not None] ) )
+    columns = matches + [None] if [matched for category_id, matched in confusion if matched is None] else matches
+    with open(filename, 'wb') as f:
+        writer = csv.writer( f, encoding='utf-8' )
+        writer.writerow( ['category'] + [matched or '' for matched in columns] )
+        for category_id in categories:
+            writer.writerow( [category_id] + [confusion.get( (category_id, matched), 0 ) for matched in columns] )
+
+def main():
+
+    # get the arguments we need
+    parser = configargparse.ArgumentParser(description='Measure the accuracy of a bayesian filter database by cross-validation on its references.',
+        default_config_files=['config.cfg'],
+        ignore_unknown_config_file_keys=True)
+
+    # key files
+    parser.add_argument("-db", "--database", default="bayesian.db", help='The sqlite database holding the trained model')
+    parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
+
+    # configuration variables
+    parser.add_argument('-k', '--folds', type=int, default=5, help='The number of folds the references are split into (default 5)')
+    parser.add_argument("-t", "--threshold", type=float, default=-0.01, help='The threshold (out of 100) for accepting a match on (default -0.01 ie no threshold)')
+    parser.add_argument('--retokenize', dest='retokenize', action='store_true', help='Tokenize every reference again instead of using the tokens saved with them, to try another ignore list or token lengths')
+    parser.add_argument('--vectorized', dest='vectorized', action='store_true', help='Whether to score with the numpy engine')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='The number of references read and classified at a time (default 1000)')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between progress reports (0 for none)')
+    parser.add_argument('--confusions', type=int, default=10, help='The number of most common confusions to print (default 10)')
+    parser.add_argument('--confusion-csv', default=None, help='A csv file to write the whole confusion matrix to')
+    parser.set_defaults( retokenize=False, vectorized=False )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print "No database found at", args.database
+        sys.exit(1)
+    if args.folds < 2:
+        parser.error( "cross-validation needs at least 2 folds" )
+
+    print "Evaluating", args.database, "with", args.folds, "folds"
+    nb = NaiveBayesian( args.database, read_only=True, vectorized=args.vectorized )
+    reporter = ThroughputReporter( "references", args.report_interval )
+    results = nb.evaluate_folds( args.folds, args.threshold, retokenize=args.retokenize, chunk_size=args.chunk_size, reporter=reporter )
+    if args.report_interval:
+        reporter.report()
+    if not results['documents']:
+        print "No references to evaluate in", args.database
+        sys.exit(1)
+
+    for i, fold in enumerate( results['folds'] ):
+        accuracy = float(fold['correct']) / fold['documents'] if fold['documents'] else 0.0
+        print "fold %d: %d references, %.1f%% right in %.1f seconds" % ( i + 1, fold['documents'], 100*accuracy, fold['seconds'] )
+    print "accuracy: %.2f%% of %d references (%d without a match)" % ( 100*results['accuracy'], results['documents'], results['unmatched'] )
+    print "%.1f seconds, %.0f references/s" % ( results['seconds'], results['documents'] / max( results['seconds'], 1e-9 ) )
+
+    confusion = results['confusion']
+    mistakes = sorted( [(count, category_id, matched) for (category_id, matched), count in confusion.iteritems() if matched != category_id], reverse=True )
+    if mistakes and args.confusions > 0:
+        print "most common confusions (category -> best match):"
+        for count, category_id, matched in mistakes[:args.confusions]:
+            print "  %s -> %s: %d" % ( category_id, matched if matched is not None else "(no match)", count )
+    if args.confusion_csv:
+        writeConfusion( args.confusion_csv, confusion )
+        print "confusion matrix written to", args.confusion_csv
+
+
+if __name__ == '__main__':
+    main()
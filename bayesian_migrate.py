@@ -0,0 +1,49 @@
+from naivebayesian.naivebayesianstorage import NaiveBayesianStorage
+import configargparse
+import os
+import sys
+
+def main():
+
+    # get the arguments we need
+    parser = configargparse.ArgumentParser(description='Copy a bayesian filter database into a new file using another table layout.',
+        default_config_files=['config.cfg'],
+        ignore_unknown_config_file_keys=True)
+
+    # key files
+    parser.add_argument("source", help='The sqlite database to be migrated')
+    parser.add_argument("target", help='The new sqlite database file to create')
+    parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
+
+    # configuration variables
+    parser.add_argument('--layout', choices=['v1', 'v2'], default='v2', help='The layout of the tables of the new database (default v2)')
+    parser.add_argument('--no-vacuum', dest='vacuum', action='store_false', help='Whether to skip compacting the new database at the end')
+    parser.set_defaults( vacuum=True )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print "No database found at", args.source
+        sys.exit(1)
+    if os.path.exists(args.target):
+        print "The target database", args.target, "already exists"
+        sys.exit(1)
+
+    source = NaiveBayesianStorage( args.source, read_only=True )
+    source.close()
+    if source.layout == args.layout:
+        print args.source, "already uses the", args.layout, "layout"
+        sys.exit(1)
+
+    print "Migrating", args.source, "from the", source.layout, "layout to", args.target, "using the", args.layout, "layout"
+    target = NaiveBayesianStorage( args.target, layout=args.layout )
+    target.copyModel( args.source, source.layout )
+    if args.vacuum:
+        target.con.execute( "VACUUM" )
+    target.close()
+
+    print "%d bytes migrated to %d bytes" % ( os.path.getsize(args.source), os.path.getsize(args.target) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.throughput import ThroughputReporter
+import configargparse
+import time
+import os
+import sys
+
+def main():
+
+    # get the arguments we need
+    parser = configargparse.ArgumentParser(description='Make the word counts of a bayesian filter database again from its references.',
+        default_config_files=['config.cfg'],
+        ignore_unknown_config_file_keys=True)
+
+    # key files
+    parser.add_argument("-db", "--database", default="bayesian.db", help='The sqlite database holding the trained model')
+    parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
+
+    # configuration variables
+    parser.add_argument('--retokenize', dest='retokenize', action='store_true', help='Tokenize every reference again instead of using the tokens saved with them, after the ignore list or token lengths have changed')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Tokenize references in this many processes (default 1)')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='The number of references read, or sent to a worker process, at a time (default 10000)')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between progress reports (0 for none)')
+    parser.set_defaults( retokenize=False )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print "No database found at", args.database
+        sys.exit(1)
+
+    print "Rebuilding", args.database
+    start = time.time()
+    nb = NaiveBayesian( args.database )
+    reporter = ThroughputReporter( "references", args.report_interval )
+    references = nb.rebuild_model( retokenize=args.retokenize, workers=args.workers, chunk_size=args.chunk_size, reporter=reporter )
+    if args.report_interval:
+        reporter.report()
+    print "%d references in %d categories rebuilt in %.1f seconds" % ( references, len(nb.getCategories()), time.time() - start )
+
+
+if __name__ == '__main__':
+    main()
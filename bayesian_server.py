@@ -0,0 +1,66 @@
+from naivebayesian.server import Batcher, makeServer
+import configargparse
+import sys
+
+def main():
+
+    # get the arguments we need
+    parser = configargparse.ArgumentParser(description='Keep bayesian filter models open and classify the texts sent to them over a socket.',
+        default_config_files=['config.cfg'],
+        ignore_unknown_config_file_keys=True)
+
+    # key files
+    parser.add_argument("-db", "--database", default="bayesian.db", help='The sqlite database (or compiled model or snapshot) of the default model')
+    parser.add_argument("--model", action='append', default=[], metavar='NAME=DATABASE', help='Another model to keep open, asked for by its name')
+    parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
+
+    # configuration variables
+    parser.add_argument('--address', default="127.0.0.1:8642", help='host:port to listen on, or the path of a Unix socket (default 127.0.0.1:8642)')
+    parser.add_argument('--max-batch', type=int, default=64, help='The most texts classified in one batch (default 64)')
+    parser.add_argument('--max-wait', type=float, default=2.0, help='The most milliseconds a request waits for others to join its batch (default 2)')
+    parser.add_argument('--cache-size', type=int, default=100000, help='The number of words kept in the word cache (0 for no limit)')
+    parser.add_argument('--result-cache', type=int, default=0, help='The number of best matches kept for texts with the same words (0 for none)')
+    parser.add_argument('--storage', choices=['sql', 'memory'], default='sql', help='Read the words from the database as needed (sql), or load the whole model into memory first (memory)')
+    parser.add_argument('--vectorized', dest='vectorized', action='store_true', help='Whether to score with the numpy engine')
+    parser.add_argument('--mmap-size', type=int, default=None, help='The number of bytes of the database sqlite maps into memory')
+    parser.set_defaults( vectorized=False )
+
+    args = parser.parse_args()
+
+    options = dict( vectorized=args.vectorized, cache_size=args.cache_size, result_cache_size=args.result_cache,
+                    read_only=True, storage=args.storage )
+    if args.mmap_size is not None:
+        options['profile'] = { 'mmap_size': args.mmap_size }
+
+    databases = { 'default': args.database }
+    for option in args.model:
+        name, sep, database = option.partition( '=' )
+        if not sep or not name or not database:
+            parser.error( "a model is given as NAME=DATABASE" )
+        databases[name] = database
+
+    # each model is opened by its own thread, which classifies its batches
+    batchers = {}
+    for name, database in sorted( databases.iteritems() ):
+        try:
+            batchers[name] = Batcher( database, options, args.max_batch, args.max_wait / 1000.0 ).open()
+        except IOError as e:
+            print >>sys.stderr, e
+            sys.exit(1)
+        print >>sys.stderr, "model", name, "opened from", database
+
+    server = makeServer( args.address, batchers, 'default' )
+    print >>sys.stderr, "listening on", args.address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        for name, batcher in sorted( batchers.iteritems() ):
+            stats = batcher.stats()
+            print >>sys.stderr, "model %s: %d requests in %d batches, %d texts" % ( name, stats['requests'], stats['batches'], stats['texts'] )
+
+
+if __name__ == '__main__':
+    main()
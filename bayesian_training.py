@@ -1,7 +1,9 @@
 from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.throughput import ThroughputReporter
+from naivebayesian.instrumentation import formatStats
 import configargparse
 import unicodecsv as csv
-import io
+import sys
 
 def main():
 
@@ -11,18 +13,30 @@ def main():
         ignore_unknown_config_file_keys=True)
     
     # key files
-    parser.add_argument("data_input", help='A csv file with rows to be classified')
+    parser.add_argument("data_input", help='A csv file with rows to be classified (- for stdin)')
     parser.add_argument("-c", "--config", default=None, is_config_file=True, help='Address of a config file')
     
     # database variables
     parser.add_argument("-db", "--database", default="bayesian.db", help='The database used to store the bayesian classification data. For sqlite this will be used as the database file.')
     parser.add_argument('--sqlite', dest='sqlite', action='store_true', help='Whether to use SQlite to store the data')
     parser.add_argument('--mysql', dest='sqlite', action='store_false', help='User a MySQL database')
+    parser.add_argument('--storage', choices=['sql', 'memory'], default='sql', help='Whether to train the model in the database, or in memory and write it back at the end')
+    parser.add_argument('--snapshot', default=None, help='Also save a snapshot of the model trained in memory to this file')
+    parser.add_argument('--layout', choices=['v1', 'v2'], default=None, help='The layout of the tables of a new database (default v1, an existing database keeps its own)')
+    parser.add_argument('--hash-buckets', type=int, default=None, help='Hash the tokens of a new database into this many buckets, which limits the size of the model (an existing database keeps its own)')
     
     # configuration variables
     parser.add_argument('--test', dest='test', action='store_true', help='Whether to do a test run (only 10 rows)')
     parser.add_argument('--reset', dest='reset', action='store_true', help='Whether to reset the database before it\'s run')
     parser.add_argument('-l', '--limit', type=int, default=0, help='Put a limit on the number of rows run')
+    parser.add_argument('--bloom-filter', dest='bloom_filter', action='store_true', help='Whether to keep a bloom filter of the vocabulary next to the database')
+    parser.add_argument('--bloom-error-rate', type=float, default=0.01, help='The false positive rate the bloom filter is sized for (default 0.01)')
+    parser.add_argument('--bloom-max-bytes', type=int, default=None, help='Put a limit on the size of the bloom filter')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Tokenize rows in this many processes and write the model in one go (default 1)')
+    parser.add_argument('--report-interval', type=float, default=10, help='Seconds between progress reports (0 for none)')
+    parser.add_argument('--verify', dest='verify', action='store_true', help='Whether to count the category totals again from the word frequencies at the end')
+    parser.add_argument('--stats', dest='stats', action='store_true', help='Whether to time each stage and SQL statement and print where the time went')
+    parser.add_argument('-b', '--batch-size', type=int, default=0, help='Train in transactions of this many rows (default 0 ie one row at a time)')
     
     # CSV file options
     parser.add_argument("-desc", "--desc-column", default=1, help='The column name containing the description we are training on')
@@ -31,7 +45,7 @@ def main():
     parser.add_argument('--header', dest='header', action='store_true', help='Whether the CSV file has a header row')
     parser.add_argument('--no-header', dest='header', action='store_false', help='Whether the CSV file has a header row')
     parser.add_argument("-d", "--delimiter", default=",", help='Delimiter used in the CSV file')
-    parser.set_defaults( header=True, test=False, reset=False, sqlite=True )
+    parser.set_defaults( header=True, test=False, reset=False, sqlite=True, bloom_filter=False, verify=False, stats=False )
     
     args = parser.parse_args()
     
@@ -42,12 +56,16 @@ def main():
     # stats used to track progress
     rows = 0
     success_trained = 0        # the number of items we've trained with
+    reporter = ThroughputReporter( "rows", args.report_interval )
     
     # set up the bayesian classifiers
-    nb = NaiveBayesian( args.database, reset=args.reset )
+    nb = NaiveBayesian( args.database, reset=args.reset,
+                        bloom_filter=args.bloom_filter, bloom_error_rate=args.bloom_error_rate, bloom_max_bytes=args.bloom_max_bytes,
+                        layout=args.layout, storage=args.storage, hash_buckets=args.hash_buckets, instrument=args.stats )
     
     # open our file and load as CSV
-    with open(args.data_input, 'rb') as csvfile:
+    csvfile = sys.stdin if args.data_input == '-' else open(args.data_input, 'rb')
+    try:
         
         if(args.header):
             datarows = csv.DictReader(csvfile, delimiter=args.delimiter, encoding='utf-8')
@@ -55,50 +73,83 @@ def main():
         else:
             datarows = csv.reader(csvfile, delimiter=args.delimiter, encoding='utf-8')
             args.desc_column = int(args.desc_column)
-        key = 0
         
         print "Starting training", args.data_input
         
-        # go through each row
-        for row in datarows:
-        
-            # check if we're doing a header row
-            if(args.header==False):
-                new_row = {}
-                for k, v in enumerate(row):
-                    new_row[k] = v
-                row = new_row
-        
-            # get the item we're categorising
-            to_cat = None
-            if(args.header == False or args.desc_column in row):
-                to_train = row[args.desc_column]
-                
-            # if we're testing then print the row
-            if args.test:
-                print row
+        def documents():
+            ''' the rows to be trained on, as (docid, category, content) '''
+            key = 0
+            for row in datarows:
+            
+                # check if we're doing a header row
+                if(args.header==False):
+                    new_row = {}
+                    for k, v in enumerate(row):
+                        new_row[k] = v
+                    row = new_row
+            
+                # get the item we're categorising
+                to_train = None
+                if(args.header == False or args.desc_column in row):
+                    to_train = row[args.desc_column]
+                    
+                # if we're testing then print the row
+                if args.test:
+                    print row
+            
+                if to_train:
+                    yield ( row[args.id_column], row[args.category_column], to_train.strip() )
+                    
+                # maintain the loop
+                key += 1
+                if(args.limit > 0 and key >= args.limit):
+                    break # if we're testing or limited then break the loop
         
-            # our result
-            if to_train:
-                to_train = to_train.strip()
-                row_result = None
-                options = 0
+        if args.workers > 1:
+            # tokenize in worker processes and write everything at the end
+            success_trained = nb.train_parallel( documents(), args.workers, reporter=reporter )
+        elif args.batch_size > 0:
+            # use the Naive Bayesian filter to train with batches of records
+            for trained in nb.train_stream( documents(), batch_size=args.batch_size, reporter=reporter ):
+                success_trained += trained
+        else:
+            for docid, category_id, to_train in documents():
                 # use the Naive Bayesian filter to train with this record
-                train_result = nb.train( docid = row[args.id_column], 
-                                         category_id = row[args.category_column], 
+                train_result = nb.train( docid = docid, 
+                                         category_id = category_id, 
                                          content=to_train ) 
-            if train_result:
-                success_trained += 1
-                print '\r', success_trained, " rows trained",
-                
-            # maintain the loop
-            key += 1
-            if(args.limit > 0 and key >= args.limit):
-                break # if we're testing or limited then break the loop
+                if train_result:
+                    success_trained += 1
+                reporter.update( 1 )
+    finally:
+        if csvfile is not sys.stdin:
+            csvfile.close()
                 
-    print             
+    if args.report_interval:
+        reporter.report()
     print success_trained, "rows used for training"
+    if args.verify:
+        drift = nb.verifyCategories()
+        for category_id, totals in sorted(drift.iteritems()):
+            print "category %s had drifted: %d words (counted %d), %d documents (counted %d)" % ( 
+                category_id, totals['word_count'][0], totals['word_count'][1], totals['doc_count'][0], totals['doc_count'][1] )
+        print len(drift), "categories had drifted"
     nb.updateProbabilities()
+    if args.storage == 'memory':
+        print "Saving the model to", args.database
+        nb.nbs.save()
+        if args.snapshot:
+            print "Saving a snapshot to", args.snapshot
+            nb.nbs.saveSnapshot( args.snapshot )
+    collisions = nb.hashCollisions()
+    if collisions:
+        print "hashing: %(used)d of %(buckets)d buckets used, %(collisions)d shared by more than one token" % collisions
+    if args.stats:
+        for line in formatStats( nb.stats() ):
+            print line
+    bloom = nb.bloomStats()
+    if bloom:
+        print "bloom filter: %(words)d words in %(bytes)d bytes, %(hashes)d hashes, expected false positive rate %(error_rate).4f" % bloom
                     
                     
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+''' Deterministic synthetic corpus for the benchmarks.
+
+    > python -m benchmarks.corpus output.csv [--documents 10000] [--vocabulary 50000] [--skew 1.1] [--categories 20] [--length 12]
+
+Words are drawn from a Zipf distribution over the vocabulary. Each category
+ranks the vocabulary in its own order past the most common words, so the
+common words are shared by every category and the rarer ones tell them
+apart. The same settings and seed always give the same corpus.
+'''
+import bisect
+import random
+import argparse
+import unicodecsv as csv
+
+class ZipfCorpus:
+    ''' Generator of labelled documents.
+
+        @param int number of different words
+        @param float Zipf exponent, higher gives fewer common words more often
+        @param int number of categories
+        @param int mean number of words in a document
+        @param int seed
+        @param int number of most common words shared by every category
+    '''
+
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+
+    def __init__(self, vocabulary = 50000, skew = 1.1, categories = 20, length = 12, seed = 0, shared = 100):
+        self.vocabulary = vocabulary
+        self.skew = skew
+        self.categories = categories
+        self.length = length
+        self.seed = seed
+        self.shared = min( shared, vocabulary )
+
+        rand = random.Random( seed )
+        self.words = self.makeWords( rand, vocabulary )
+        # cumulative weights of the ranks
+        self.cumulative = []
+        total = 0.0
+        for rank in xrange(1, vocabulary+1):
+            total += 1.0 / rank**skew
+            self.cumulative.append( total )
+        # the word at each rank, for each category
+        self.rankings = []
+        for category in xrange(categories):
+            ranking = range( vocabulary )
+            tail = ranking[self.shared:]
+            rand.shuffle( tail )
+            self.rankings.append( ranking[:self.shared] + tail )
+
+    def makeWords( self, rand, count ):
+        ''' make distinct words that the tokenizer keeps.
+            @return list of strings
+        '''
+        words = []
+        seen = set()
+        while len(words) < count:
+            word = "".join( [rand.choice(self.letters) for i in xrange(rand.randint(4, 10))] )
+            if word not in seen:
+                seen.add( word )
+                words.append( word )
+        return words
+
+    def parameters( self ):
+        ''' the settings of the corpus, to record with results.
+            @return array
+        '''
+        return {
+            'vocabulary': self.vocabulary,
+            'skew': self.skew,
+            'categories': self.categories,
+            'length': self.length,
+            'seed': self.seed,
+            'shared': self.shared
+        }
+
+    def documents( self, count, start = 0 ):
+        ''' generate documents. Document i is the same whichever range it is generated in.
+            @return iterator of (document id, category id, content)
+            @param int number of documents
+            @param int number of the first document
+        '''
+        total = self.cumulative[-1]
+        for i in xrange(start, start+count):
+            rand = random.Random( (self.seed << 32) + i )
+            category = rand.randrange( self.categories )
+            ranking = self.rankings[category]
+            length = max( 1, int( rand.gauss( self.length, self.length / 3.0 ) ) )
+            words = []
+            for j in xrange(length):
+                rank = bisect.bisect_left( self.cumulative, rand.random() * total )
+                words.append( self.words[ranking[min( rank, self.vocabulary-1 )]] )
+            yield ( u"doc%d" % i, u"cat%02d" % category, u" ".join( words ) )
+
+    def writeCsv( self, filename, count, start = 0 ):
+        ''' write documents to a csv file with the columns id, class and desc,
+        which are the defaults of the training script.
+
+            @return int number of documents written
+        '''
+        with open(filename, 'wb') as f:
+            writer = csv.writer( f, encoding='utf-8' )
+            writer.writerow( ['id', 'class', 'desc'] )
+            written = 0
+            for document in self.documents( count, start ):
+                writer.writerow( document )
+                written += 1
+        return written
+
+def main():
+    parser = argparse.ArgumentParser( description='Write a synthetic corpus to a csv file' )
+    parser.add_argument( "output", help='The csv file to write' )
+    parser.add_argument( "--documents", type=int, default=10000, help='The number of documents' )
+    parser.add_argument( "--vocabulary", type=int, default=50000, help='The number of different words' )
+    parser.add_argument( "--skew", type=float, default=1.1, help='The Zipf exponent of the word frequencies' )
+    parser.add_argument( "--categories", type=int, default=20, help='The number of categories' )
+    parser.add_argument( "--length", type=int, default=12, help='The mean number of words in a document' )
+    parser.add_argument( "--seed", type=int, default=0, help='The seed of the generator' )
+    args = parser.parse_args()
+
+    corpus = ZipfCorpus( args.vocabulary, args.skew, args.categories, args.length, args.seed )
+    print corpus.writeCsv( args.output, args.documents ), "documents written to", args.output
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+''' Benchmark of feature hashing against the exact vocabulary.
+
+    > python -m benchmarks.hashing_benchmark [--rows 20000] [--buckets 1024 4096 16384 65536] [csv file --column name --category-column name]
+
+Trains a model in memory on four rows in five, with the words kept and with
+the tokens hashed into each number of buckets, then classifies the other
+rows. Prints the size of each model, the share of test rows given their own
+category and the share given the same category as the exact model.
+'''
+import time
+import random
+import argparse
+import unicodecsv as csv
+from naivebayesian.naivebayesian import NaiveBayesian
+
+def synthetic_rows( rows, categories = 20, seed = 0 ):
+    ''' labelled strings with a vocabulary that keeps growing: each category
+    has its own words, and rows are padded with ids, part numbers and typos '''
+    rand = random.Random( seed )
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    topics = []
+    for i in xrange(categories):
+        topics.append( ["".join( rand.choice(letters) for k in xrange(rand.randint(4, 9)) ) for j in xrange(30)] )
+    labelled = []
+    for i in xrange(rows):
+        category = rand.randrange( categories )
+        parts = []
+        for j in xrange(rand.randint( 4, 10 )):
+            word = rand.choice( topics[category] )
+            if rand.random() < 0.1:
+                # a typo
+                k = rand.randrange( len(word) )
+                word = word[:k] + rand.choice(letters) + word[k+1:]
+            parts.append( word )
+        parts.append( "ref%d" % rand.randint(1, 10**7) )
+        if rand.random() < 0.5:
+            parts.append( "%s-%d" % ( rand.choice(letters).upper()*2, rand.randint(100, 99999) ) )
+        rand.shuffle( parts )
+        labelled.append( ( u"cat%02d" % category, u" ".join(parts) ) )
+    return labelled
+
+def read_rows( filename, column, category_column, rows ):
+    labelled = []
+    with open(filename, 'rb') as csvfile:
+        for row in csv.DictReader( csvfile ):
+            if row.get( column ) and row.get( category_column ):
+                labelled.append( ( row[category_column], row[column] ) )
+            if len(labelled) >= rows:
+                break
+    return labelled
+
+def run( name, hash_buckets, train, test ):
+    ''' train and test one model.
+        @return list of the best match of each test row
+    '''
+    nb = NaiveBayesian( None, storage="memory", hash_buckets=hash_buckets )
+    start = time.time()
+    nb.train_many( train )
+    nb.updateProbabilities()
+    trained = time.time() - start
+
+    start = time.time()
+    matches = [nb.bestMatch( content ) for category_id, content in test]
+    classified = time.time() - start
+
+    words = len( nb.nbs.words )
+    counts = sum( [len(counts) for counts in nb.nbs.words.itervalues()] )
+    right = len( [1 for match, (category_id, content) in zip(matches, test) if match and match[0] == category_id] )
+    collisions = nb.hashCollisions()
+    shared = "%d" % collisions['collisions'] if collisions else "-"
+    print "%-14s %10d %12d %10s %9.1f%% %9.1fs %9.1fs" % ( name, words, counts, shared,
+                                                      100.0*right/len(test), trained, classified ),
+    return matches
+
+def main():
+    parser = argparse.ArgumentParser( description='Compare the accuracy of hashed tokens with the exact vocabulary' )
+    parser.add_argument( "input", nargs='?', default=None, help='A csv file with labelled rows (default synthetic rows)' )
+    parser.add_argument( "--column", default='desc', help='The column name holding the text' )
+    parser.add_argument( "--category-column", default='class', help='The column name holding the category' )
+    parser.add_argument( "--rows", type=int, default=20000, help='The number of rows used' )
+    parser.add_argument( "--buckets", type=int, nargs='+', default=[1024, 4096, 16384, 65536], help='The numbers of buckets to try' )
+    args = parser.parse_args()
+
+    if args.input:
+        labelled = read_rows( args.input, args.column, args.category_column, args.rows )
+    else:
+        labelled = synthetic_rows( args.rows )
+    train = [(unicode(i), category_id, content) for i, (category_id, content) in enumerate(labelled) if i % 5]
+    test = [row for i, row in enumerate(labelled) if not i % 5]
+
+    print "%d rows trained, %d classified" % ( len(train), len(test) )
+    print "%-14s %10s %12s %10s %10s %10s %10s %10s" % ( "model", "words", "word counts", "collisions",
+                                                        "accuracy", "training", "classify", "agreement" )
+    exact = run( "exact", None, train, test )
+    print
+    for buckets in args.buckets:
+        matches = run( "%d buckets" % buckets, buckets, train, test )
+        same = len( [1 for a, b in zip(exact, matches) if (a and a[0]) == (b and b[0])] )
+        print "%9.1f%%" % ( 100.0*same/len(test) )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+''' Load test of a classifier server.
+
+    > python bayesian_server.py -db training-data.db --address /tmp/bayesian.sock &
+    > python -m benchmarks.server_load --address /tmp/bayesian.sock [--clients 8] [--requests 2000]
+                                       [--input data.csv --column desc] [--scores]
+
+Each client connects to the server and sends requests one after another,
+one text each, as an online caller would. The texts are read from a csv
+file or made by benchmarks.corpus. Prints the throughput, and the p50, p90,
+p99 and max latency of the requests as seen by the clients.
+'''
+import sys
+import threading
+import argparse
+import unicodecsv as csv
+from timeit import default_timer
+from naivebayesian.client import ClassifierClient
+from benchmarks.corpus import ZipfCorpus
+from benchmarks.suite import percentile
+
+def readTexts( filename, column, count ):
+    ''' read up to count texts from a column of a csv file '''
+    texts = []
+    with open(filename, 'rb') as f:
+        reader = csv.DictReader( f, encoding='utf-8' )
+        for row in reader:
+            if row[column]:
+                texts.append( row[column] )
+            if len(texts) >= count:
+                break
+    return texts
+
+def runClient( address, texts, scores, model, latencies, errors ):
+    ''' send each text to the server, adding the seconds each took to latencies '''
+    try:
+        client = ClassifierClient( address )
+    except IOError as e:
+        errors.append( e )
+        return
+    try:
+        for text in texts:
+            start = default_timer()
+            if scores:
+                client.categorize( text, model )
+            else:
+                client.bestMatch( text, model=model )
+            latencies.append( default_timer() - start )
+    except Exception as e:
+        errors.append( e )
+    finally:
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser( description='Time the requests to a classifier server' )
+    parser.add_argument( "--address", default="127.0.0.1:8642", help='The address of the server, host:port or the path of a Unix socket' )
+    parser.add_argument( "--clients", type=int, default=8, help='The number of clients sending requests at once' )
+    parser.add_argument( "--requests", type=int, default=2000, help='The number of requests sent by all the clients' )
+    parser.add_argument( "--input", default=None, help='A csv file to read the texts from (default texts from benchmarks.corpus)' )
+    parser.add_argument( "--column", default="desc", help='The column of the csv file holding the texts' )
+    parser.add_argument( "--model", default=None, help='The name of the model to ask (default the default model of the server)' )
+    parser.add_argument( "--scores", action='store_true', help='Ask for the score in each category instead of the best match' )
+    args = parser.parse_args()
+
+    if args.input:
+        texts = readTexts( args.input, args.column, args.requests )
+    else:
+        texts = [content for docid, category_id, content in ZipfCorpus().documents( args.requests )]
+    if not texts:
+        parser.error( "no texts to send" )
+    # repeat the texts if there are fewer than the requests
+    texts = [texts[i % len(texts)] for i in xrange(args.requests)]
+
+    latencies = []
+    errors = []
+    threads = [threading.Thread( target=runClient, args=( args.address, texts[i::args.clients], args.scores, args.model, latencies, errors ) )
+               for i in xrange(args.clients)]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = default_timer() - start
+
+    for error in errors[:5]:
+        print "error:", error
+    if not latencies:
+        sys.exit(1)
+    print "%d requests from %d clients in %.3f seconds, %.1f requests/s" % ( len(latencies), args.clients, elapsed, len(latencies) / elapsed )
+    print "latency ms: p50 %.3f  p90 %.3f  p99 %.3f  max %.3f" % ( 1000 * percentile( latencies, 0.5 ), 1000 * percentile( latencies, 0.9 ),
+                                                                  1000 * percentile( latencies, 0.99 ), 1000 * max( latencies ) )
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
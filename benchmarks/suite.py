@@ -0,0 +1,255 @@
+''' Benchmark suite of the classifier on a synthetic corpus.
+
+    > python -m benchmarks.suite [--train 2000] [--test 500] [--backends sql-v1 sql-v2 memory compiled]
+                                 [--output results.json] [--baseline baseline.json --threshold 0.2]
+
+Times tokenizing, train, updateProbabilities, categorize and bestMatch with
+each storage backend, and the training and classifying scripts end to end,
+on a corpus from benchmarks.corpus. Prints the throughput and the p50 and
+p99 latency of each, and can write them to a JSON file.
+
+Given a baseline (a JSON file written by an earlier run), each result is
+compared with it and the run fails if the throughput has dropped, or the
+p50 latency has grown, by more than the threshold. --threshold-for sets
+another threshold for some benchmarks, and --p99-threshold also checks the
+p99 latency, which is noisier.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+from timeit import default_timer
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.compiledstorage import CompiledStorage
+from naivebayesian.naivebayesianstorage import NaiveBayesianStorage
+from benchmarks.corpus import ZipfCorpus
+
+backends = ['sql-v1', 'sql-v2', 'memory', 'compiled']
+root = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+def percentile( values, share ):
+    ''' the value below which a share of the values fall (nearest rank) '''
+    values = sorted( values )
+    if not values:
+        return 0.0
+    rank = int( round( share * (len(values)-1) ) )
+    return values[rank]
+
+def result( benchmark, backend, latencies, unit, total = None ):
+    ''' summarise the timings of a benchmark.
+        @return array of the results
+        @param string name of the benchmark
+        @param string storage backend
+        @param list seconds taken by each operation
+        @param string what an operation is
+        @param float total seconds, the sum of the latencies by default
+    '''
+    if total is None:
+        total = sum( latencies )
+    return {
+        'benchmark': benchmark,
+        'backend': backend,
+        'unit': unit,
+        'count': len(latencies),
+        'seconds': total,
+        'throughput': len(latencies) / total if total > 0 else 0.0,
+        'p50_ms': 1000 * percentile( latencies, 0.5 ),
+        'p99_ms': 1000 * percentile( latencies, 0.99 ),
+    }
+
+def timed( function, items ):
+    ''' call a function on each item.
+        @return list of the seconds each call took
+    '''
+    latencies = []
+    for item in items:
+        start = default_timer()
+        function( item )
+        latencies.append( default_timer() - start )
+    return latencies
+
+def openModel( backend, directory, create = False ):
+    ''' open the model of a backend, a new one if create is set '''
+    if backend == 'memory':
+        return NaiveBayesian( None, storage="memory" )
+    if backend == 'compiled':
+        return NaiveBayesian( os.path.join( directory, "sql-v2.nbm" ) )
+    layout = backend.split('-')[1]
+    return NaiveBayesian( os.path.join( directory, backend + ".db" ), reset=create, layout=layout )
+
+def runLibrary( backend, train, test, directory, repeat ):
+    ''' time the library calls with one backend.
+        @return list of results
+    '''
+    results = []
+    if backend == 'compiled':
+        # a compiled model is made from the v2 database, and can only classify
+        nbs = NaiveBayesianStorage( os.path.join( directory, "sql-v2.db" ), read_only=True )
+        CompiledStorage.compile( nbs, os.path.join( directory, "sql-v2.nbm" ) )
+        nbs.close()
+        nb = openModel( backend, directory )
+    else:
+        nb = openModel( backend, directory, create=True )
+        latencies = timed( lambda document: nb.train( *document ), train )
+        results.append( result( "train", backend, latencies, "documents" ) )
+        latencies = timed( lambda i: nb.updateProbabilities(), range(repeat) )
+        results.append( result( "updateProbabilities", backend, latencies, "calls" ) )
+
+    texts = [content for docid, category_id, content in test]
+    categorize = []
+    best = []
+    for i in range(repeat):
+        categorize.extend( timed( nb.categorize, texts ) )
+        best.extend( timed( nb.bestMatch, texts ) )
+    results.append( result( "categorize", backend, categorize, "documents" ) )
+    results.append( result( "bestMatch", backend, best, "documents" ) )
+    return results
+
+def runScripts( backend, directory, train_csv, test_csv, repeat ):
+    ''' time the training and classifying scripts end to end with one backend.
+        @return list of results
+    '''
+    results = []
+    database = os.path.join( directory, "cli-%s.db" % backend )
+    training = [sys.executable, os.path.join( root, "bayesian_training.py" ), train_csv, "-db", database,
+                "-desc", "desc", "--reset", "--report-interval", "0", "-b", "1000"]
+    classifying = [sys.executable, os.path.join( root, "bayesian.py" ), test_csv, os.path.join( directory, "out.csv" ),
+                   "-db", database, "--column", "desc", "--report-interval", "0"]
+    if backend == 'memory':
+        training += ["--storage", "memory"]
+        classifying += ["--storage", "memory"]
+    elif backend == 'compiled':
+        training += ["--layout", "v2"]
+        classifying[classifying.index( database )] = database + ".nbm"
+    else:
+        training += ["--layout", backend.split('-')[1]]
+
+    def run( command ):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call( command, stdout=devnull, cwd=root )
+
+    latencies = []
+    for i in range(repeat):
+        if os.path.exists( database ):
+            os.remove( database )
+        latencies.append( timed( run, [training] )[0] )
+    results.append( result( "bayesian_training.py", backend, latencies, "runs" ) )
+
+    if backend == 'compiled':
+        run( [sys.executable, os.path.join( root, "bayesian_compile.py" ), "-db", database, database + ".nbm"] )
+    latencies = timed( run, [classifying] * repeat )
+    results.append( result( "bayesian.py", backend, latencies, "runs" ) )
+    return results
+
+def compare( results, baseline, threshold, thresholds, p99_threshold ):
+    ''' compare results with a baseline.
+        @return list of strings describing the regressions
+    '''
+    before = dict( [((r['backend'], r['benchmark']), r) for r in baseline['results']] )
+    regressions = []
+    print
+    print "%-10s %-22s %12s %12s %9s %9s" % ( "backend", "benchmark", "baseline/s", "now/s", "change", "p50" )
+    for r in results:
+        old = before.get( (r['backend'], r['benchmark']) )
+        if old is None:
+            continue
+        allowed = thresholds.get( r['benchmark'], threshold )
+        change = r['throughput'] / old['throughput'] - 1 if old['throughput'] else 0.0
+        latency = r['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0.0
+        print "%-10s %-22s %12.1f %12.1f %+8.1f%% %+8.1f%%" % ( r['backend'], r['benchmark'], old['throughput'],
+                                                             r['throughput'], 100*change, 100*latency )
+        if change < -allowed:
+            regressions.append( "%s %s throughput fell by %.1f%%" % (r['backend'], r['benchmark'], -100*change) )
+        if latency > allowed:
+            regressions.append( "%s %s p50 latency grew by %.1f%%" % (r['backend'], r['benchmark'], 100*latency) )
+        if p99_threshold is not None and old['p99_ms'] and r['p99_ms'] / old['p99_ms'] - 1 > p99_threshold:
+            regressions.append( "%s %s p99 latency grew by %.1f%%" % (r['backend'], r['benchmark'], 100*(r['p99_ms'] / old['p99_ms'] - 1)) )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser( description='Time the classifier on a synthetic corpus' )
+    parser.add_argument( "--train", type=int, default=2000, help='The number of documents trained' )
+    parser.add_argument( "--test", type=int, default=500, help='The number of documents classified' )
+    parser.add_argument( "--vocabulary", type=int, default=50000, help='The number of different words of the corpus' )
+    parser.add_argument( "--skew", type=float, default=1.1, help='The Zipf exponent of the word frequencies' )
+    parser.add_argument( "--categories", type=int, default=20, help='The number of categories' )
+    parser.add_argument( "--length", type=int, default=12, help='The mean number of words in a document' )
+    parser.add_argument( "--seed", type=int, default=0, help='The seed of the corpus' )
+    parser.add_argument( "--backends", nargs='+', choices=backends, default=backends, help='The storage backends to time' )
+    parser.add_argument( "--repeat", type=int, default=3, help='Runs of the classifying and script benchmarks' )
+    parser.add_argument( "--no-scripts", dest='scripts', action='store_false', help='Skip timing the scripts end to end' )
+    parser.add_argument( "--output", default=None, help='Write the results to this JSON file' )
+    parser.add_argument( "--baseline", default=None, help='Compare the results with this JSON file from an earlier run' )
+    parser.add_argument( "--threshold", type=float, default=0.2, help='The slowdown allowed before a benchmark fails (default 0.2 ie 20%%)' )
+    parser.add_argument( "--threshold-for", action='append', default=[], metavar='BENCHMARK=THRESHOLD', help='Another threshold for one benchmark' )
+    parser.add_argument( "--p99-threshold", type=float, default=None, help='Also fail if the p99 latency grows by more than this' )
+    parser.set_defaults( scripts=True )
+    args = parser.parse_args()
+
+    thresholds = {}
+    for option in args.threshold_for:
+        benchmark, value = option.rsplit( '=', 1 )
+        thresholds[benchmark] = float( value )
+    if 'compiled' in args.backends and 'sql-v2' not in args.backends:
+        parser.error( "the compiled backend is made from the sql-v2 one" )
+
+    corpus = ZipfCorpus( args.vocabulary, args.skew, args.categories, args.length, args.seed )
+    train = list( corpus.documents( args.train ) )
+    test = list( corpus.documents( args.test, args.train ) )
+
+    directory = tempfile.mkdtemp( prefix="nb-benchmark-" )
+    results = []
+    try:
+        nb = NaiveBayesian( None, storage="memory" )
+        latencies = timed( nb._getTokens, [content for docid, category_id, content in train] )
+        results.append( result( "_getTokens", "-", latencies, "documents" ) )
+        # the v2 database is needed by the compiled backend
+        for backend in sorted( args.backends, key=lambda backend: backend == 'compiled' ):
+            results.extend( runLibrary( backend, train, test, directory, args.repeat ) )
+
+        if args.scripts:
+            train_csv = os.path.join( directory, "train.csv" )
+            test_csv = os.path.join( directory, "test.csv" )
+            corpus.writeCsv( train_csv, args.train )
+            corpus.writeCsv( test_csv, args.test, args.train )
+            for backend in args.backends:
+                results.extend( runScripts( backend, directory, train_csv, test_csv, args.repeat ) )
+    finally:
+        shutil.rmtree( directory )
+
+    print "%-10s %-22s %8s %12s %10s %10s" % ( "backend", "benchmark", "count", "throughput", "p50 ms", "p99 ms" )
+    for r in results:
+        print "%-10s %-22s %8d %10.1f/s %10.3f %10.3f" % ( r['backend'], r['benchmark'], r['count'],
+                                                          r['throughput'], r['p50_ms'], r['p99_ms'] )
+
+    report = {
+        'time': time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': corpus.parameters(),
+        'train': args.train,
+        'test': args.test,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump( report, f, indent=2, sort_keys=True )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load( f )
+        if baseline.get( 'corpus' ) != report['corpus'] or baseline.get( 'train' ) != args.train or baseline.get( 'test' ) != args.test:
+            print "warning: the baseline was run on another corpus"
+        regressions = compare( results, baseline, args.threshold, thresholds, args.p99_threshold )
+        for regression in regressions:
+            print "REGRESSION:", regression
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
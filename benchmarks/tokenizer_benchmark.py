@@ -0,0 +1,104 @@
+''' Micro-benchmark of the tokenizer against the original _getTokens.
+
+    > python -m benchmarks.tokenizer_benchmark [--rows 20000] [--repeat 3] [csv file --column name]
+
+Prints the tokens per second of each implementation and checks that they
+give the same tokens.
+'''
+import re
+import time
+import random
+import argparse
+import unicodecsv as csv
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.tokenizer import Tokenizer
+
+def legacy_tokens( nb, string ):
+    ''' the implementation of NaiveBayesian._getTokens that Tokenizer replaced '''
+    rawtokens = []
+    tokens = {}
+    string = nb._cleanString( string )
+    ignore_list = nb.getIgnoreList()
+    include_list = nb.getIncludeList()
+
+    rawtokens = re.split("[^-_A-Za-z0-9]+", string)
+    for token in rawtokens:
+        token = token.strip()
+        if (not(('' == token)                        or
+              (len(token) < nb.min_token_length) or
+              (len(token) > nb.max_token_length) or
+              (re.match('[0-9]+$', token))   or
+              (token in ignore_list)
+            )                                      or
+              (token in include_list)
+            ):
+            if( tokens.has_key(token) ):
+                tokens[token] += 1
+            else:
+                tokens[token] = 1
+    return tokens
+
+def synthetic_rows( rows, seed = 0 ):
+    ''' strings that look like the descriptions we classify '''
+    rand = random.Random( seed )
+    words = ['charity', 'trust', 'foundation', 'the', 'of', 'and', 'mr', 'ltd', 'school',
+             'church', 'association', 'fund', 'income', 'total', 'costs', 'club', 'society',
+             'st', 'saint', 'community', 'village', 'hall', 'friends', 'education']
+    strings = []
+    for i in xrange(rows):
+        length = rand.randint( 3, 12 )
+        parts = []
+        for j in xrange(length):
+            if rand.random() < 0.15:
+                parts.append( str( rand.randint(1, 99999) ) )
+            else:
+                parts.append( rand.choice(words).capitalize() )
+        strings.append( u" ".join(parts) + u", " + unicode( rand.randint(1000, 9999) ) )
+    return strings
+
+def run( name, function, strings, repeat ):
+    best = None
+    tokens = 0
+    for i in range(repeat):
+        start = time.time()
+        tokens = 0
+        for string in strings:
+            tokens += len( function( string ) )
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-12s %10.0f tokens/s %10.0f rows/s" % ( name, tokens / best, len(strings) / best )
+
+def main():
+    parser = argparse.ArgumentParser( description='Compare the tokenizer with the original _getTokens' )
+    parser.add_argument( "input", nargs='?', default=None, help='A csv file with rows to tokenize (default synthetic rows)' )
+    parser.add_argument( "--column", default=0, help='The column name or number holding the text' )
+    parser.add_argument( "--rows", type=int, default=20000, help='The number of rows to tokenize' )
+    parser.add_argument( "--repeat", type=int, default=3, help='Runs of each implementation, the best is reported' )
+    args = parser.parse_args()
+
+    if args.input:
+        strings = []
+        with open(args.input, 'rb') as csvfile:
+            if str(args.column).isdigit():
+                datarows = csv.reader( csvfile )
+                args.column = int(args.column)
+            else:
+                datarows = csv.DictReader( csvfile )
+            for row in datarows:
+                strings.append( row[args.column] )
+                if len(strings) >= args.rows:
+                    break
+    else:
+        strings = synthetic_rows( args.rows )
+
+    nb = NaiveBayesian( ":memory:" )
+    tokenizer = Tokenizer( nb.getIgnoreList(), nb.getIncludeList(), nb.min_token_length, nb.max_token_length )
+    for string in strings:
+        assert legacy_tokens( nb, string ) == nb._getTokens( string ), string
+
+    run( "_getTokens", lambda string: legacy_tokens( nb, string ), strings, args.repeat )
+    run( "Tokenizer", lambda string: tokenizer.tokenize( nb._cleanString( string ) ), strings, args.repeat )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+import os
+import re
+import urllib
+import time
+import sqlite3
+import threading
+
+class Backend:
+    ''' The parts of a database that differ from one to another.
+
+    NaiveBayesianStorage writes its statements once, with ? placeholders and
+    the layouts of its tables, and leaves connecting, the placeholders of
+    the database's paramstyle, upserts and bulk loads to a backend. Backends
+    are registered by name (see registerBackend()) and chosen with the
+    `backend` option of the storage.
+
+        @param string database name (the file name for sqlite)
+        @param string user
+        @param string password
+        @param string server
+        @param bool   whether the model is only read
+        @param bool   whether connections may be used by other threads than the one that opened them
+    '''
+
+    name = None
+    # placeholders of the database's DB-API module: qmark (?) or format (%s)
+    paramstyle = 'qmark'
+    # start of a statement adding a row unless its key is already there
+    insert_ignore = "INSERT OR IGNORE"
+    # layouts of the tables the database can hold (see NaiveBayesianStorage)
+    layouts = ( "v1", )
+    # errors of a statement the model can't run, such as one on a missing table
+    errors = ()
+
+    def __init__(self, dbname, user = None, pwd = None, server = None, read_only = False, shared = False):
+        self.dbname = dbname
+        self.user = user
+        self.pwd = pwd
+        self.server = server
+        self.read_only = read_only
+        self.shared = shared
+        # statements translated for the database (see translate())
+        self.statements = {}
+
+    def connect( self ):
+        ''' open a connection whose cursors give rows that can be read by column name.
+            @return DB-API connection
+        '''
+        raise NotImplementedError
+
+    def configure( self, con, profile ):
+        ''' set performance options on a new connection.
+            @return bool whether the options were set
+            @param  DB-API connection
+            @param  array keys = option names, values = values
+        '''
+        return False
+
+    def cursor( self, con ):
+        ''' get a cursor of a connection taking the statements of the storage.
+            @return DB-API cursor
+        '''
+        if self.paramstyle == 'qmark' and self.insert_ignore == Backend.insert_ignore:
+            return con.cursor()
+        return TranslatingCursor( con.cursor(), self.translate )
+
+    def translate( self, sql ):
+        ''' write a statement of the storage, which has ? placeholders and
+        INSERT OR IGNORE, for the database. The statements hold no ? or % in
+        their literals. Statements are translated once and kept.
+
+            @return string statement
+        '''
+        translated = self.statements.get( sql )
+        if translated is None:
+            translated = sql.replace( Backend.insert_ignore, self.insert_ignore )
+            if self.paramstyle == 'format':
+                translated = translated.replace( "?", "%s" )
+            self.statements[sql] = translated
+        return translated
+
+    def tables( self, cur ):
+        ''' get the names of the tables of the model.
+            @return set of names
+        '''
+        raise NotImplementedError
+
+    def upsert( self, sql, key, column ):
+        ''' make an insert statement add to a column of the row when its key is
+        already there, instead of failing.
+            @return string statement, None if the database can't
+            @param  string insert statement
+            @param  string columns of the key, separated by commas
+            @param  string column added to
+        '''
+        return None
+
+    def binary( self, data ):
+        ''' wrap a string of bytes to be saved in a blob '''
+        return data
+
+    def bulkLoad( self, cur, sql, rows ):
+        ''' run an insert statement for many rows, such as when the word
+        frequencies of a model are written again.
+            @param  DB-API cursor
+            @param  string insert statement
+            @param  list of the values of each row
+        '''
+        cur.executemany( sql, rows )
+
+
+class SqliteBackend( Backend ):
+    ''' sqlite models, held in a file, which can use both layouts of the tables '''
+
+    name = "sqlite"
+    layouts = ( "v1", "v2" )
+    errors = ( sqlite3.OperationalError, )
+    # number of prepared statements kept by each connection
+    cached_statements = 256
+
+    def __init__(self, dbname, user = None, pwd = None, server = None, read_only = False, shared = False):
+        # each connection to :memory: opens a database of its own
+        if shared and dbname==":memory:":
+            raise ValueError( "an sqlite :memory: model can't be shared by a pool of connections" )
+        Backend.__init__( self, dbname, user=user, pwd=pwd, server=server, read_only=read_only, shared=shared )
+
+    def connect( self ):
+        ''' open the model, for reading only if the backend is read only.
+        If sqlite understands URI file names a read only model is opened with
+        mode=ro, so nothing is ever locked for writing and any number of
+        processes can share it. Otherwise it is opened as usual and the
+        query_only pragma of the profile stops any writes.
+
+            @return sqlite3 connection
+        '''
+        dbname = self.dbname
+        options = { 'cached_statements': self.cached_statements, 'check_same_thread': not self.shared }
+        if self.read_only and dbname!=":memory:":
+            if not os.path.exists( dbname ):
+                raise IOError( "no model found at %s" % dbname )
+            probe = sqlite3.connect( ":memory:" )
+            compiled = [row[0] for row in probe.execute( "PRAGMA compile_options" )]
+            probe.close()
+            if "USE_URI" in compiled:
+                dbname = "file:%s?mode=ro" % urllib.quote( os.path.abspath( dbname ) )
+        con = sqlite3.connect( dbname, **options )
+        con.row_factory = sqlite3.Row
+        return con
+
+    def configure( self, con, profile ):
+        ''' set performance pragmas, such as mmap_size, cache_size, temp_store or query_only.
+            @return bool success
+            @param  sqlite3 connection
+            @param  array keys = pragma names, values = values
+        '''
+        for pragma, value in sorted( profile.iteritems() ):
+            if not re.match( r"^\w+$", pragma ) or not re.match( r"^-?\w+$", str(value) ):
+                raise ValueError( "invalid pragma %s = %s" % (pragma, value) )
+            con.execute( "PRAGMA %s = %s" % (pragma, value) )
+        return True
+
+    def tables( self, cur ):
+        cur.execute( "SELECT name FROM sqlite_master WHERE type = 'table'" )
+        return set( [row['name'] for row in cur.fetchall()] )
+
+    def upsert( self, sql, key, column ):
+        # upserts came with sqlite 3.24
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            return None
+        return "%s ON CONFLICT (%s) DO UPDATE SET %s = %s + excluded.%s" % ( sql, key, column, column, column )
+
+    def binary( self, data ):
+        return sqlite3.Binary( data )
+
+
+class MySQLBackend( Backend ):
+    ''' MySQL models, which can only use the v1 layout of the tables.
+    MySQLdb is imported when the first connection is opened.
+    '''
+
+    name = "mysql"
+    paramstyle = 'format'
+    insert_ignore = "INSERT IGNORE"
+    # most rows sent in each bulk insert, to keep under max_allowed_packet
+    bulk_rows = 1000
+
+    def connect( self ):
+        import MySQLdb
+        import MySQLdb.cursors
+        self.errors = ( MySQLdb.OperationalError, MySQLdb.ProgrammingError )
+        return MySQLdb.connect( self.server, self.user, self.pwd, self.dbname,
+                                cursorclass=MySQLdb.cursors.DictCursor, charset='utf8', use_unicode=True )
+
+    def tables( self, cur ):
+        cur.execute( "SHOW TABLES" )
+        return set( [row.values()[0] for row in cur.fetchall()] )
+
+    def upsert( self, sql, key, column ):
+        return "%s ON DUPLICATE KEY UPDATE %s = %s + VALUES(%s)" % ( sql, column, column, column )
+
+    def bulkLoad( self, cur, sql, rows ):
+        ''' MySQLdb sends the rows of an insert ... values statement given to
+        executemany() as one multi-row statement, so they are sent in chunks. '''
+        for i in range(0, len(rows), self.bulk_rows):
+            cur.executemany( sql, rows[i:i+self.bulk_rows] )
+
+
+class TranslatingCursor:
+    ''' A cursor changing the ? placeholders of the statements it runs to
+    the paramstyle of its database. The rest is passed to the cursor.
+    '''
+
+    def __init__(self, cursor, translate):
+        self.cursor = cursor
+        self.translate = translate
+
+    def execute( self, sql, *args ):
+        return self.cursor.execute( self.translate( sql ), *args )
+
+    def executemany( self, sql, *args ):
+        return self.cursor.executemany( self.translate( sql ), *args )
+
+    def __iter__( self ):
+        return iter( self.cursor )
+
+    def __getattr__( self, name ):
+        return getattr( self.cursor, name )
+
+
+class ConnectionPool:
+    ''' Connections to a model shared by threads.
+
+    Each thread is given a connection of its own the first time it asks for
+    one, and keeps it until it calls release(), so many threads can read at
+    once instead of queueing on one connection. At most size connections are
+    opened; a thread asking for one when they are all taken waits up to
+    timeout seconds for another thread to release one. A pool of one
+    connection doesn't wait, as the thread holding it keeps it, and asking
+    for it from another thread fails at once.
+
+        @param Backend backend opening the connections
+        @param int most connections open at once
+        @param array performance options of each connection (see Backend.configure())
+    '''
+
+    # most seconds a thread waits for a connection when they are all taken
+    timeout = 30.0
+
+    def __init__(self, backend, size = 1, profile = None):
+        self.backend = backend
+        self.size = max( size, 1 )
+        self.profile = profile
+        self.idle = []
+        self.opened = []
+        self.local = threading.local()
+        self.available = threading.Condition()
+
+    def connection( self ):
+        ''' get the connection of this thread, opening one if needed.
+            @return DB-API connection
+        '''
+        con = getattr( self.local, 'con', None )
+        if con is not None:
+            return con
+        with self.available:
+            deadline = time.time() + (self.timeout if self.size > 1 else 0)
+            while not self.idle and len(self.opened) >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError( "connection pool exhausted: the %d connection(s) to %s are held by other threads "
+                                        "(open the model with a larger pool_size, or release() it in the threads done with it)"
+                                        % (self.size, self.backend.dbname) )
+                self.available.wait( remaining )
+            if self.idle:
+                con = self.idle.pop()
+            else:
+                con = self.backend.connect()
+                if self.profile:
+                    self.backend.configure( con, self.profile )
+                self.opened.append( con )
+        self.local.con = con
+        return con
+
+    def release( self ):
+        ''' give the connection of this thread back to the pool '''
+        con = getattr( self.local, 'con', None )
+        if con is None:
+            return
+        self.local.con = None
+        with self.available:
+            self.idle.append( con )
+            self.available.notify()
+
+    def close( self ):
+        ''' close every connection '''
+        with self.available:
+            for con in self.opened:
+                con.close()
+            self.opened = []
+            self.idle = []
+        self.local = threading.local()
+
+
+backends = {
+    'sqlite': SqliteBackend,
+    'mysql': MySQLBackend,
+}
+
+def registerBackend( name, backend ):
+    ''' make a backend available to the storage by name.
+        @param string name
+        @param class  Backend subclass
+    '''
+    backends[name] = backend
+
+def getBackend( name ):
+    ''' find a registered backend.
+        @return class Backend subclass
+        @param  string name
+    '''
+    if name not in backends:
+        raise ValueError( "unknown storage backend %s (known: %s)" % (name, ", ".join( sorted( backends ) )) )
+    return backends[name]
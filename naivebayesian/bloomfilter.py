@@ -0,0 +1,115 @@
+import os
+import math
+import struct
+import hashlib
+
+class BloomFilter:
+    ''' A compact probabilistic set of words.
+
+    A word that was added is always found. A word that wasn't added is found
+    with a small probability (the false positive rate), which depends on the
+    number of bits per word and the number of hashes.
+    '''
+
+    magic = 'NBBF'
+    header = struct.Struct( '<4sQQQId' )
+
+    def __init__(self, capacity, error_rate = 0.01, max_bytes = None):
+        ''' @param int   number of words the filter is sized for
+            @param float target false positive rate at that capacity
+            @param int   limit on the size of the bit array
+        '''
+        capacity = max( int(capacity), 1 )
+        num_bits = int( math.ceil( -capacity * math.log(error_rate) / (math.log(2)**2) ) )
+        if max_bytes:
+            num_bits = min( num_bits, int(max_bytes)*8 )
+        num_bits = max( num_bits, 8 )
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = num_bits
+        self.num_hashes = max( int( round( float(num_bits) / capacity * math.log(2) ) ), 1 )
+        self.count = 0
+        self.bits = bytearray( (num_bits+7) // 8 )
+
+    def _positions( self, word ):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        h1, h2 = struct.unpack( '<QQ', hashlib.md5(word).digest() )
+        for i in xrange(self.num_hashes):
+            yield (h1 + i*h2) % self.num_bits
+
+    def add( self, word ):
+        ''' add a word to the set.
+            @return bool whether the word was new to the filter
+            @param string word
+        '''
+        new = False
+        for pos in self._positions( word ):
+            mask = 1 << (pos & 7)
+            if not( self.bits[pos >> 3] & mask ):
+                self.bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__( self, word ):
+        for pos in self._positions( word ):
+            if not( self.bits[pos >> 3] & (1 << (pos & 7)) ):
+                return False
+        return True
+
+    def falsePositiveRate( self ):
+        ''' the expected false positive rate for the words added so far.
+            @return float
+        '''
+        return ( 1 - math.exp( -float(self.num_hashes) * self.count / self.num_bits ) ) ** self.num_hashes
+
+    def stats( self ):
+        ''' get the size and accuracy of the filter.
+            @return array keys = 'words', 'capacity', 'bytes', 'hashes', 'target_error_rate', 'error_rate'
+        '''
+        return {
+            'words': self.count,
+            'capacity': self.capacity,
+            'bytes': len(self.bits),
+            'hashes': self.num_hashes,
+            'target_error_rate': self.error_rate,
+            'error_rate': self.falsePositiveRate()
+        }
+
+    def save( self, filename ):
+        ''' write the filter to a file.
+        It is written to a new file next to it first, which then takes its
+        place, so a process loading the filter never reads it half written.
+
+            @param string file name
+        '''
+        target = "%s.%d.saving" % (filename, os.getpid())
+        try:
+            with open(target, 'wb') as f:
+                f.write( self.header.pack( self.magic, self.capacity, self.num_bits, self.count, self.num_hashes, self.error_rate ) )
+                f.write( self.bits )
+            os.rename( target, filename )
+        except:
+            if os.path.exists( target ):
+                os.remove( target )
+            raise
+
+    @classmethod
+    def load( cls, filename ):
+        ''' read a filter written by save().
+            @return BloomFilter
+            @param  string file name
+        '''
+        with open(filename, 'rb') as f:
+            magic, capacity, num_bits, count, num_hashes, error_rate = cls.header.unpack( f.read( cls.header.size ) )
+            if magic != cls.magic:
+                raise ValueError( "%s is not a bloom filter file" % filename )
+            bloom = cls( capacity, error_rate )
+            bloom.num_bits = num_bits
+            bloom.num_hashes = num_hashes
+            bloom.count = count
+            bloom.bits = bytearray( f.read() )
+        return bloom
@@ -0,0 +1,84 @@
+import json
+import socket
+
+def parseAddress( address ):
+    ''' read the address of a classifier server.
+        @return tuple (host, port) for TCP or string path of a Unix socket
+        @param string "host:port", ":port" or the path of a Unix socket
+    '''
+    host, sep, port = address.rpartition( ':' )
+    if sep and port.isdigit():
+        return ( host or "127.0.0.1", int(port) )
+    return address
+
+class ClassifierClient:
+    ''' A connection to a classifier server (see bayesian_server.py).
+
+    Each request is a line of JSON and so is each response, in the same
+    order. A request sent with several texts is classified as one batch;
+    requests from several clients at once are batched by the server too.
+
+        @param string address of the server, "host:port" or the path of a Unix socket
+        @param float seconds to wait for a response, None for no limit
+    '''
+
+    def __init__(self, address, timeout = None):
+        address = parseAddress( address )
+        if isinstance( address, tuple ):
+            self.sock = socket.create_connection( address, timeout )
+            self.sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        else:
+            self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+            self.sock.settimeout( timeout )
+            self.sock.connect( address )
+        self.rfile = self.sock.makefile( 'rb' )
+
+    def request( self, request ):
+        ''' send a request and wait for its response.
+            @return array response
+            @param array request
+        '''
+        self.sock.sendall( json.dumps( request ) + "\n" )
+        line = self.rfile.readline()
+        if not line:
+            raise IOError( "the classifier server closed the connection" )
+        response = json.loads( line )
+        if 'error' in response:
+            raise ValueError( response['error'] )
+        return response
+
+    def bestMatch( self, text, threshold = -0.01, model = None ):
+        ''' get the best match of a text.
+            @see NaiveBayesian.bestMatch()
+            @return tuple (category, score) or False if no score reaches the threshold
+        '''
+        return self.bestMatches( [text], threshold, model )[0]
+
+    def bestMatches( self, texts, threshold = -0.01, model = None ):
+        ''' get the best match of each of a list of texts.
+            @return list of (category, score) or False
+        '''
+        request = { 'texts': texts, 'threshold': threshold }
+        if model is not None:
+            request['model'] = model
+        return [tuple( match ) if match else False for match in self.request( request )['matches']]
+
+    def categorize( self, text, model = None ):
+        ''' get the score of a text in each category.
+            @see NaiveBayesian.categorize()
+            @return list of (category, score), best first
+        '''
+        request = { 'texts': [text], 'scores': True }
+        if model is not None:
+            request['model'] = model
+        return [tuple( score ) for score in self.request( request )['scores'][0]]
+
+    def stats( self ):
+        ''' get the number of requests, batches and texts classified by each model of the server.
+            @return array keys = model names, values = array(keys = 'requests', 'batches', 'texts')
+        '''
+        return self.request( { 'stats': True } )['stats']
+
+    def close( self ):
+        self.rfile.close()
+        self.sock.close()
@@ -0,0 +1,292 @@
+import os
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+from lrucache import LRUCache
+
+class CompiledStorage:
+    ''' Read only access to a model compiled into a single binary file.
+
+    The file holds the categories, the vocabulary sorted as utf-8 strings and,
+    for every word, its counts in each category. It is mapped into memory
+    rather than read, so opening it only reads the categories, and processes
+    using the same file share the same pages. Words are found by a binary
+    search of the vocabulary.
+
+    It has the read methods of NaiveBayesianStorage, so it can be used in its
+    place to classify documents. Use compile() to write a model.
+
+    layout of the file (little endian):
+        - header (see header below)
+        - settings (version 2): the length of the settings followed by the
+          settings as utf-8 json
+        - categories: probability, word count, doc count (-1 if not known)
+          and the lengths of the id and description, followed by the utf-8
+          id and description
+        - word index: nwords+1 offsets of the words in the words section
+        - words: the utf-8 words, sorted
+        - postings index: nwords+1 offsets of the counts of each word in
+          the postings section
+        - postings: (category index, count) for each word
+    '''
+
+    magic = 'NBCM'
+    version = 2
+    # versions that can still be read
+    versions = (1, 2)
+    # magic, version, categories, words, offsets of the five sections
+    header = struct.Struct( '<4sIIQQQQQQ' )
+    category = struct.Struct( '<dqqHH' )
+    offset = struct.Struct( '<QQ' )
+    posting = struct.Struct( '<Iq' )
+
+    def __init__(self, filename, cache_size = 100000):
+        self.dbname = filename
+        self.layout = "compiled"
+        self.read_only = True
+        self.file = open( filename, 'rb' )
+        self.data = mmap.mmap( self.file.fileno(), 0, access=mmap.ACCESS_READ )
+
+        ( magic, version, ncat, self.nwords, categories, self.word_index,
+          self.words, self.postings_index, self.postings ) = self.header.unpack_from( self.data, 0 )
+        if magic != self.magic:
+            raise ValueError( "%s is not a compiled model" % filename )
+        if version not in self.versions:
+            raise ValueError( "%s is a version %d compiled model, version %d expected" % (filename, version, self.version) )
+
+        self.settings = {}
+        if version >= 2:
+            length, = struct.unpack_from( '<Q', self.data, self.header.size )
+            start = self.header.size + 8
+            self.settings = json.loads( self.data[start:start+length].decode('utf-8') )
+
+        self.categories = []
+        self.category_cache = {}
+        position = categories
+        for i in xrange(ncat):
+            probability, word_count, doc_count, id_length, description_length = self.category.unpack_from( self.data, position )
+            position += self.category.size
+            category_id = self.data[position:position+id_length].decode('utf-8')
+            position += id_length
+            description = self.data[position:position+description_length].decode('utf-8')
+            position += description_length
+            self.categories.append( category_id )
+            self.category_cache[category_id] = {
+                    'probability': probability,
+                    'word_count': word_count,
+                    'doc_count': doc_count if doc_count >= 0 else None,
+                    'description': description
+                }
+
+        # counts of the most recently used words, {} for unknown words
+        self.word_cache = LRUCache( cache_size )
+        self.bloom = None
+
+    @classmethod
+    def isCompiled( cls, filename ):
+        ''' see if a file is a compiled model.
+            @return bool
+            @param  string file name
+        '''
+        if not filename or not os.path.isfile( filename ):
+            return False
+        with open(filename, 'rb') as f:
+            return f.read( len(cls.magic) ) == cls.magic
+
+    @classmethod
+    def compile( cls, nbs, filename ):
+        ''' write the model held by a storage object to a compiled file.
+        The words are read in order and each section is written to a temporary
+        file as they come, so the model is never held in memory.
+
+            @return array keys = 'categories', 'words', 'postings', 'bytes'
+            @param  NaiveBayesianStorage storage holding the model
+            @param  string file name of the compiled model
+        '''
+        categories = nbs.getCategories()
+        cat_ids = sorted( categories )
+        cat_index = dict( (cat, i) for i, cat in enumerate(cat_ids) )
+
+        category_data = []
+        for cat in cat_ids:
+            data = categories[cat]
+            category_id = cat.encode('utf-8')
+            description = (data['description'] or u"").encode('utf-8')
+            doc_count = data.get( 'doc_count' )
+            category_data.append( cls.category.pack( data['probability'], data['word_count'],
+                                                     -1 if doc_count is None else doc_count,
+                                                     len(category_id), len(description) ) )
+            category_data.append( category_id )
+            category_data.append( description )
+        category_data = "".join( category_data )
+        settings = json.dumps( nbs.getSettings(), sort_keys=True ).encode('utf-8')
+
+        # the four sections after the categories, in the order they are written
+        word_index, words, postings_index, postings = sections = [tempfile.TemporaryFile() for i in range(4)]
+        try:
+            previous = None
+            nwords = 0
+            words_size = 0
+            npostings = 0
+            word_index.write( struct.pack( '<Q', 0 ) )
+            postings_index.write( struct.pack( '<Q', 0 ) )
+            for word, category_id, count in nbs.getWordFreqs( ordered=True ):
+                # rows with no count left are kept, as the word is still in the
+                # vocabulary of the database and changes how documents score
+                cat = cat_index.get( category_id )
+                if cat is None:
+                    continue
+                if isinstance(word, unicode):
+                    word = word.encode('utf-8')
+                if word != previous:
+                    if previous is not None:
+                        if word < previous:
+                            raise ValueError( "the words of the model are not in order" )
+                        postings_index.write( struct.pack( '<Q', npostings ) )
+                    words.write( word )
+                    words_size += len(word)
+                    word_index.write( struct.pack( '<Q', words_size ) )
+                    nwords += 1
+                    previous = word
+                postings.write( cls.posting.pack( cat, count ) )
+                npostings += 1
+            if previous is not None:
+                postings_index.write( struct.pack( '<Q', npostings ) )
+
+            start = cls.header.size + 8 + len(settings)
+            word_index_start = start + len(category_data)
+            words_start = word_index_start + (nwords+1)*8
+            postings_index_start = words_start + words_size
+            postings_start = postings_index_start + (nwords+1)*8
+
+            with open(filename, 'wb') as f:
+                f.write( cls.header.pack( cls.magic, cls.version, len(cat_ids), nwords, start,
+                                          word_index_start, words_start, postings_index_start, postings_start ) )
+                f.write( struct.pack( '<Q', len(settings) ) )
+                f.write( settings )
+                f.write( category_data )
+                for section in sections:
+                    section.seek( 0 )
+                    shutil.copyfileobj( section, f )
+        finally:
+            for section in sections:
+                section.close()
+
+        return {
+            'categories': len(cat_ids),
+            'words': nwords,
+            'postings': npostings,
+            'bytes': os.path.getsize( filename )
+        }
+
+    def close( self ):
+        self.data.close()
+        self.file.close()
+
+    def findWord( self, word ):
+        ''' find a word in the vocabulary.
+            @return int index of the word, -1 if it isn't there
+            @param  string word
+        '''
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        data = self.data
+        lo = 0
+        hi = self.nwords
+        while lo < hi:
+            mid = (lo+hi) // 2
+            start, end = self.offset.unpack_from( data, self.word_index + mid*8 )
+            found = data[self.words+start:self.words+end]
+            if found < word:
+                lo = mid + 1
+            elif found > word:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def wordCounts( self, index ):
+        ''' get the counts of the word at an index of the vocabulary.
+            @return array keys = category ids, values = counts
+            @param  int index of the word
+        '''
+        counts = {}
+        start, end = self.offset.unpack_from( self.data, self.postings_index + index*8 )
+        for position in xrange(self.postings + start*self.posting.size, self.postings + end*self.posting.size, self.posting.size):
+            cat, count = self.posting.unpack_from( self.data, position )
+            counts[self.categories[cat]] = count
+        return counts
+
+    def getSettings( self ):
+        ''' get the settings the model was made with.
+            @return array keys = names, values = values (strings)
+        '''
+        return self.settings
+
+    def getCategories( self ):
+        ''' get the list of categories with basic data.
+            @return array key = category ids, values = array(keys = 'probability', 'word_count', 'doc_count', 'description')
+        '''
+        return self.category_cache
+
+    def wordExists( self, word ):
+        ''' see if the word is an already learnt word.
+            @return bool
+            @param string word
+        '''
+        return word in self.getWordCounts( [word] )
+
+    def getWord( self, word, category_id ):
+        ''' get details of a word in a category.
+            @return array ('count' => count)
+            @param  string word
+            @param  string category id
+        '''
+        counts = self.getWordCounts( [word] )
+        return {'count': counts.get(word, {}).get(category_id, 0)}
+
+    def getWordCounts( self, words ):
+        ''' get the counts of a set of words in every category.
+            @return array keys = known words, values = array(keys = category ids, values = counts)
+            @param  list words
+        '''
+        counts = {}
+        for word in set(words):
+            cached = self.word_cache.get( word )
+            if cached is None:
+                index = self.findWord( word )
+                cached = self.wordCounts( index ) if index >= 0 else {}
+                self.word_cache[word] = cached
+            if cached:
+                counts[word] = cached
+        return counts
+
+    def getWordFreqs( self, ordered = False ):
+        ''' get every row of the word frequencies, in the order of the words.
+            @return iterator of (word, category id, count)
+        '''
+        for index in xrange(self.nwords):
+            start, end = self.offset.unpack_from( self.data, self.word_index + index*8 )
+            word = self.data[self.words+start:self.words+end].decode('utf-8')
+            for category_id, count in sorted( self.wordCounts( index ).iteritems() ):
+                yield ( word, category_id, count )
+
+    def getReferenceIds( self, doc_ids ):
+        ''' no references are kept in a compiled model.
+            @return set
+        '''
+        return set()
+
+    def updateProbabilities( self, verify = False ):
+        ''' the probabilities of a compiled model are fixed when it is compiled.
+            @return bool sucess
+        '''
+        return True
+
+    def cacheStats( self ):
+        return self.word_cache.stats()
+
+    def bloomStats( self ):
+        return None
@@ -0,0 +1,545 @@
+import os
+import re
+import marshal
+from naivebayesianstorage import NaiveBayesianStorage, packTokens, unpackTokens
+
+class InMemoryNaiveBayesianStorage:
+    ''' Storage of the data for the filter held in dicts.
+
+    It has the same methods as NaiveBayesianStorage, but the whole model is
+    held in memory, so training and categorizing never run a query. A model
+    is loaded from an sqlite database with one scan of each table, or from a
+    snapshot written by saveSnapshot(), and is written back with save().
+
+    The token counts saved with each reference are kept packed, as they are
+    in the tokens column of the database (see packTokens()), so references
+    loaded, trained or saved in memory can be untrained or evaluated without
+    being tokenized again.
+
+    Snapshots are written with marshal, so they can only be read by the same
+    version of python that wrote them.
+    '''
+
+    magic = 'NBMS'
+    # number of word counts written to a database in each transaction
+    save_batch_size = 100000
+
+    def __init__(self, dbname = None, reset = False, layout = None):
+        self.dbname = dbname
+        self.layout = layout
+        self.format = "sqlite"
+        self.resetTables()
+        if dbname and not reset and os.path.exists( dbname ):
+            self.load( dbname )
+
+    @classmethod
+    def isSnapshot( cls, filename ):
+        ''' see if a file is a snapshot of a model.
+            @return bool
+            @param  string file name
+        '''
+        if not filename or not os.path.isfile( filename ):
+            return False
+        with open(filename, 'rb') as f:
+            return f.read( len(cls.magic) ) == cls.magic
+
+    def resetTables( self ):
+        ''' Remove existing data.
+            @return bool successs
+        '''
+        # category id => array(keys = 'probability', 'word_count', 'doc_count', 'description')
+        self.categories = {}
+        # word => array(category id => count)
+        self.words = {}
+        # reference id => (category id, content, packed token counts or None)
+        self.references = {}
+        # name => value
+        self.settings = {}
+        return True
+
+    def load( self, filename ):
+        ''' load a model from a snapshot or an sqlite database.
+            @return bool success
+            @param  string file name
+        '''
+        if self.isSnapshot( filename ):
+            return self.loadSnapshot( filename )
+        nbs = NaiveBayesianStorage( filename, read_only=True )
+        try:
+            return self.loadDatabase( nbs )
+        finally:
+            nbs.close()
+
+    def loadDatabase( self, nbs ):
+        ''' load every category, word and reference held by another storage object.
+            @return bool success
+            @param  NaiveBayesianStorage storage holding the model
+        '''
+        self.resetTables()
+        for category_id, data in nbs.getCategories().iteritems():
+            self.categories[category_id] = dict( data )
+        words = self.words
+        for word, category_id, count in nbs.getWordFreqs():
+            counts = words.get( word )
+            if counts is None:
+                counts = words[word] = {}
+            counts[category_id] = count
+        for doc_id, category_id, content, tokens in nbs.getReferenceTokens():
+            self.references[doc_id] = ( category_id, content, packTokens( tokens ) if tokens is not None else None )
+        self.settings = dict( nbs.getSettings() )
+        # models made before the document counts were kept are counted once
+        if [data for data in self.categories.itervalues() if data['doc_count'] is None]:
+            for data in self.categories.itervalues():
+                data['doc_count'] = 0
+            self.verifyCategories()
+        if self.layout is None:
+            self.layout = nbs.layout
+        self.format = "sqlite"
+        return True
+
+    def loadSnapshot( self, filename ):
+        ''' load a model written by saveSnapshot().
+            @return bool success
+            @param  string file name
+        '''
+        with open(filename, 'rb') as f:
+            if f.read( len(self.magic) ) != self.magic:
+                raise ValueError( "%s is not a snapshot of a model" % filename )
+            snapshot = marshal.load( f )
+        if snapshot[0] != marshal.version:
+            raise ValueError( "%s was written by another version of python" % filename )
+        self.categories, self.words, self.references = snapshot[1:4]
+        # snapshots written before settings were kept have none
+        self.settings = snapshot[4] if len(snapshot) > 4 else {}
+        # and their references have no tokens
+        for doc_id, reference in self.references.iteritems():
+            if len(reference) < 3:
+                self.references[doc_id] = reference + (None,)
+        self.format = "snapshot"
+        return True
+
+    def saveSnapshot( self, filename ):
+        ''' write the whole model to a snapshot file.
+            @return bool success
+            @param  string file name
+        '''
+        with open(filename, 'wb') as f:
+            f.write( self.magic )
+            marshal.dump( (marshal.version, self.categories, self.words, self.references, self.settings), f )
+        return True
+
+    def saveDatabase( self, filename, layout = None ):
+        ''' write the whole model to an sqlite database, replacing what it held.
+        The model is written to a new file next to it first, which then takes
+        its place, so the database is never left half written, even when it is
+        the one the model was loaded from.
+
+            @return bool success
+            @param  string file name
+            @param  string layout of the tables (see NaiveBayesianStorage)
+        '''
+        target = filename + ".saving"
+        if os.path.exists( target ):
+            os.remove( target )
+        try:
+            nbs = NaiveBayesianStorage( target, reset=True, layout=layout or self.layout )
+            try:
+                for name, value in sorted( self.settings.iteritems() ):
+                    nbs.saveSetting( name, value )
+                for category_id, data in self.categories.iteritems():
+                    nbs.addcat( category_id, data['description'] )
+                wordcounts = {}
+                for word, counts in self.words.iteritems():
+                    for category_id, count in counts.iteritems():
+                        wordcounts[(word, category_id)] = count
+                    if len(wordcounts) >= self.save_batch_size:
+                        nbs.bulkUpdate( wordcounts, [] )
+                        wordcounts = {}
+                references = [(doc_id, category_id, content, unpackTokens( tokens ) if tokens is not None else None)
+                              for doc_id, (category_id, content, tokens) in self.references.iteritems()]
+                nbs.bulkUpdate( wordcounts, references )
+                nbs.updateProbabilities()
+            finally:
+                nbs.close()
+            os.rename( target, filename )
+        except:
+            if os.path.exists( target ):
+                os.remove( target )
+            raise
+        return True
+
+    def copy( self ):
+        ''' get a copy of the model that can be changed without changing this one.
+            @return InMemoryNaiveBayesianStorage
+        '''
+        copy = InMemoryNaiveBayesianStorage( layout=self.layout )
+        copy.categories, copy.words, copy.references, copy.settings = marshal.loads(
+            marshal.dumps( (self.categories, self.words, self.references, self.settings) ) )
+        return copy
+
+    def save( self, filename = None ):
+        ''' write the model back to the file it was loaded from, in the same format.
+            @return bool success
+            @param  string file name, the one the model was loaded from by default
+        '''
+        filename = filename or self.dbname
+        if self.format == "snapshot":
+            return self.saveSnapshot( filename )
+        return self.saveDatabase( filename )
+
+    def getSettings( self ):
+        ''' get the settings the model was made with.
+            @return array keys = names, values = values (strings)
+        '''
+        return self.settings
+
+    def saveSetting( self, name, value ):
+        ''' save a setting of the model.
+            @return bool success
+            @param  string name
+            @param  string value
+        '''
+        self.settings[name] = value
+        return True
+
+    def getCategories( self ):
+        ''' get the list of categories with basic data.
+            @return array key = category ids, values = array(keys = 'probability', 'word_count', 'doc_count', 'description')
+        '''
+        return self.categories
+
+    def wordExists( self, word ):
+        ''' see if the word is an already learnt word.
+            @return bool
+            @param string word
+        '''
+        return word in self.words
+
+    def getWord( self, word, category_id ):
+        ''' get details of a word in a category.
+            @return array ('count' => count)
+            @param  string word
+            @param  string category id
+        '''
+        return {'count': self.words.get(word, {}).get(category_id, 0)}
+
+    def getWordCounts( self, words ):
+        ''' get the counts of a set of words in every category.
+            @return array keys = known words, values = array(keys = category ids, values = counts)
+            @param  list words
+        '''
+        counts = {}
+        known = self.words
+        for word in words:
+            found = known.get( word )
+            if found:
+                counts[word] = found
+        return counts
+
+    def getWordFreqs( self, ordered = False ):
+        ''' get every row of the word frequencies.
+            @return iterator of (word, category id, count)
+            @param  bool whether to get the rows in the order of the words
+        '''
+        words = sorted( self.words ) if ordered else self.words
+        for word in words:
+            counts = self.words[word]
+            for category_id in (sorted( counts ) if ordered else counts):
+                yield ( word, category_id, counts[category_id] )
+
+    def updateWord( self, word, count, category_id, catname = None ):
+        ''' update a word in a category.
+        If the word is new in this category it is added, else only the count is updated.
+
+            @return bool success
+            @param string word
+            @param int    count
+            @paran string category id
+        '''
+        if word=="":
+            return
+        self.addcat( category_id, catname )
+        counts = self.words.setdefault( word, {} )
+        counts[category_id] = counts.get( category_id, 0 ) + count
+        if category_id in self.categories:
+            self.categories[category_id]['word_count'] += count
+
+    def bulkUpdate( self, wordcounts, references ):
+        ''' update many words and save many references.
+        The bulk version of updateWord() and saveReference().
+
+            @return bool success
+            @param  array keys = (word, category id), values = count to add
+            @param  list of (reference id, category id, content) or (reference id, category id, content, tokens)
+        '''
+        for category_id in set( [category_id for word, category_id in wordcounts] ):
+            self.addcat( category_id )
+
+        words = self.words
+        categories = self.categories
+        for (word, category_id), count in wordcounts.iteritems():
+            if word=="":
+                continue
+            counts = words.get( word )
+            if counts is None:
+                counts = words[word] = {}
+            counts[category_id] = counts.get( category_id, 0 ) + count
+            if category_id in categories:
+                categories[category_id]['word_count'] += count
+        for reference in references:
+            self.saveReference( *reference )
+        return True
+
+    def removeWord( self, word, count, category_id ):
+        ''' remove a word from a category.
+
+            @return bool success
+            @param string word
+            @param int  count
+            @param string category id
+        '''
+        if word=="":
+            return
+        counts = self.words.get( word, {} )
+        old = counts.get( category_id, 0 )
+        if old == 0:
+            return
+        if old - count <= 0:
+            del counts[category_id]
+            if not counts:
+                del self.words[word]
+        else:
+            counts[category_id] = old - count
+        if category_id in self.categories:
+            self.categories[category_id]['word_count'] -= min( count, old )
+
+    def bulkRemove( self, wordcounts, doc_ids ):
+        ''' remove many words and references.
+        The bulk version of removeWord() and removeReference().
+
+            @return bool success
+            @param  array keys = (word, category id), values = count to remove
+            @param  list reference ids
+        '''
+        for (word, category_id), count in wordcounts.iteritems():
+            self.removeWord( word, count, category_id )
+        for doc_id in doc_ids:
+            self.removeReference( doc_id )
+        return True
+
+    def removeWords( self, words ):
+        ''' remove words from every category.
+            @return int number of words removed
+            @param  iterable words
+        '''
+        removed = 0
+        for word in words:
+            counts = self.words.pop( word, None )
+            if counts is None:
+                continue
+            for category_id, count in counts.iteritems():
+                if category_id in self.categories:
+                    self.categories[category_id]['word_count'] -= count
+            removed += 1
+        return removed
+
+    def updateProbabilities( self, verify = False ):
+        ''' update the probabilities of the categories.
+            @return bool sucess
+            @param  bool whether to count the totals again
+        '''
+        if verify:
+            self.verifyCategories()
+        total_words = sum( [data['word_count'] for data in self.categories.itervalues()] )
+        for data in self.categories.itervalues():
+            if total_words == 0:
+                data['probability'] = 0
+            else:
+                data['probability'] = float(data['word_count']) / float(total_words)
+        return True
+
+    def verifyCategories( self ):
+        ''' count the word and document totals of every category from the
+        word frequencies and references, and fix the ones that have drifted.
+
+            @return array keys = category ids, values = array(keys = 'word_count', 'doc_count', values = (kept total, counted total)) for the categories that had drifted
+        '''
+        word_totals = {}
+        for counts in self.words.itervalues():
+            for category_id, count in counts.iteritems():
+                word_totals[category_id] = word_totals.get( category_id, 0 ) + count
+        doc_totals = {}
+        for category_id, content, tokens in self.references.itervalues():
+            doc_totals[category_id] = doc_totals.get( category_id, 0 ) + 1
+
+        drift = {}
+        for category_id, data in self.categories.iteritems():
+            counted = ( word_totals.get( category_id, 0 ), doc_totals.get( category_id, 0 ) )
+            if counted != (data['word_count'], data['doc_count']):
+                drift[category_id] = {
+                        'word_count': (data['word_count'], counted[0]),
+                        'doc_count': (data['doc_count'], counted[1])
+                    }
+                data['word_count'], data['doc_count'] = counted
+        return drift
+
+    def saveReference( self, doc_id, category_id, content, tokens = None ):
+        ''' save a reference.
+
+            @return bool success
+            @param  string reference if, must be unique
+            @param  string category id
+            @param  string content of the reference
+            @param  array token counts of the content
+        '''
+        if doc_id in self.references:
+            raise ValueError( "the reference %s already exists" % doc_id )
+        self.references[doc_id] = ( category_id, content, packTokens( tokens ) if tokens is not None else None )
+        if category_id in self.categories:
+            self.categories[category_id]['doc_count'] += 1
+
+    def getReference( self, doc_id ):
+        ''' get a reference.
+
+            @return array  reference( category_id => ...., content => ....)
+            @param  string id
+        '''
+        if doc_id not in self.references:
+            return None
+        category_id, content, tokens = self.references[doc_id]
+        return {'id': doc_id, 'category_id': category_id, 'content': content}
+
+    def getReferenceIds( self, doc_ids ):
+        ''' find which of a set of reference ids are already saved.
+            @return set of the ids found
+            @param  list reference ids
+        '''
+        return set( [doc_id for doc_id in doc_ids if doc_id in self.references] )
+
+    def getReferences( self ):
+        ''' get every reference.
+            @return iterator of (reference id, category id, content)
+        '''
+        for doc_id, (category_id, content, tokens) in self.references.iteritems():
+            yield ( doc_id, category_id, content )
+
+    def getReferenceTokens( self, doc_ids = None ):
+        ''' get references with the token counts saved with them.
+            @return iterator of (reference id, category id, content, tokens), tokens = array or None if they weren't saved
+            @param  list reference ids, every reference by default
+        '''
+        if doc_ids is None:
+            doc_ids = sorted( self.references )
+        for doc_id in doc_ids:
+            if doc_id in self.references:
+                category_id, content, tokens = self.references[doc_id]
+                yield ( doc_id, category_id, content, unpackTokens( tokens ) if tokens is not None else None )
+
+    def saveReferenceTokens( self, tokens ):
+        ''' save the token counts of references.
+            @return bool success
+            @param  list of (reference id, tokens)
+        '''
+        for doc_id, counts in tokens:
+            if doc_id in self.references:
+                category_id, content, old = self.references[doc_id]
+                self.references[doc_id] = ( category_id, content, packTokens( counts ) if counts is not None else None )
+        return True
+
+    def replaceCounts( self, wordcounts, totals ):
+        ''' replace every word frequency and the totals of the categories.
+            @return bool success
+            @param  array keys = (word, category id), values = count
+            @param  array keys = category ids, values = (word count, document count)
+        '''
+        words = self.words = {}
+        for (word, category_id), count in wordcounts.iteritems():
+            if word!="" and count > 0:
+                counts = words.get( word )
+                if counts is None:
+                    counts = words[word] = {}
+                counts[category_id] = count
+        for data in self.categories.itervalues():
+            data['word_count'] = data['doc_count'] = 0
+        for category_id, (word_count, doc_count) in totals.iteritems():
+            self.addcat( category_id )
+            self.categories[category_id]['word_count'] = word_count
+            self.categories[category_id]['doc_count'] = doc_count
+        return True
+
+    def removeReference( self, doc_id ):
+        ''' remove a reference
+
+            @return bool sucess
+            @param  string reference id
+        '''
+        if doc_id in self.references:
+            category_id, content, tokens = self.references.pop( doc_id )
+            if category_id in self.categories:
+                self.categories[category_id]['doc_count'] -= 1
+
+    def addcat( self, cat = False, catname = False ):
+        ''' add a category
+
+            @return bool sucess
+            @param  string slug for category
+            @param  string name of category
+        '''
+        if(not(cat)):
+            return False
+
+        if(not(catname)):
+            catname = cat
+
+        cat = re.sub('<[^>]*>', '', cat.strip())
+        cat = cat.replace(' ', '')
+
+        catname = re.sub('<[^>]*>', '', catname.strip())
+        catname = catname.replace(' ', '')
+
+        if(len(cat)==0):
+            return False
+
+        if cat not in self.categories:
+            self.categories[cat] = {
+                    'probability': 0,
+                    'word_count': 0,
+                    'doc_count': 0,
+                    'description': catname
+                }
+
+        return True
+
+    def remcat( self, cat = False ):
+        ''' remove a category
+
+            @return bool sucess
+            @param  string slug for category
+        '''
+        if(not(cat)):
+            return False
+
+        cat = re.sub('<[^>]*>', '', cat.strip())
+        cat = cat.replace(' ', '')
+
+        if(len(cat)==0):
+            return False
+
+        for word in self.words.keys():
+            counts = self.words[word]
+            if cat in counts:
+                del counts[cat]
+                if not counts:
+                    del self.words[word]
+        for doc_id in [doc_id for doc_id, reference in self.references.iteritems() if reference[0] == cat]:
+            del self.references[doc_id]
+        self.categories.pop( cat, None )
+        self.updateProbabilities()
+
+        return True
+
+    def cacheStats( self ):
+        return None
+
+    def bloomStats( self ):
+        return None
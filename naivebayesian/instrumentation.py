@@ -0,0 +1,159 @@
+import sys
+from timeit import default_timer
+
+class Instrumentation:
+    ''' Counters of where the time of the classifier goes.
+
+    Stages (such as tokenize, lookup, score and rescale) are timed by the
+    classifier with add(), and the SQL statements run by a storage are
+    counted and timed by the method that ran them (see InstrumentedCursor).
+    Code being timed checks `enabled` first, so when instrumentation is off
+    NullInstrumentation is used and nothing is timed at all.
+    '''
+
+    enabled = True
+    clock = staticmethod( default_timer )
+
+    def __init__(self):
+        # stage => [calls, seconds]
+        self.stages = {}
+        # storage method => [statements, seconds]
+        self.statements = {}
+        self.started = default_timer()
+
+    def add( self, stage, seconds, calls = 1 ):
+        ''' count time spent in a stage.
+            @param string stage
+            @param float seconds
+            @param int number of calls
+        '''
+        totals = self.stages.get( stage )
+        if totals is None:
+            totals = self.stages[stage] = [0, 0.0]
+        totals[0] += calls
+        totals[1] += seconds
+
+    def addStatement( self, method, seconds, statements = 1 ):
+        ''' count an SQL statement.
+            @param string name of the storage method that ran it
+            @param float seconds
+            @param int number of statements
+        '''
+        totals = self.statements.get( method )
+        if totals is None:
+            totals = self.statements[method] = [0, 0.0]
+        totals[0] += statements
+        totals[1] += seconds
+
+    def cursor( self, cursor ):
+        ''' wrap a database cursor so its statements are counted against the
+        storage method that asked for it.
+            @return InstrumentedCursor
+        '''
+        return InstrumentedCursor( cursor, self, sys._getframe(2).f_code.co_name )
+
+    def stats( self ):
+        ''' get the counters.
+            @return array keys = 'seconds' (since started), 'stages', 'sql' (keys = names, values = array(keys = 'calls', 'seconds'))
+        '''
+        return {
+            'seconds': default_timer() - self.started,
+            'stages': dict( [(stage, {'calls': calls, 'seconds': seconds}) for stage, (calls, seconds) in self.stages.iteritems()] ),
+            'sql': dict( [(method, {'calls': calls, 'seconds': seconds}) for method, (calls, seconds) in self.statements.iteritems()] ),
+        }
+
+    def take( self ):
+        ''' get the counters and start again from 0, to send the counters of a
+        worker process to the main one (see merge()).
+            @return array stages and sql counters as from stats()
+        '''
+        stats = self.stats()
+        self.stages = {}
+        self.statements = {}
+        return stats
+
+    def merge( self, stats ):
+        ''' add counters taken from another process.
+            @param array counters from take()
+        '''
+        for stage, totals in stats['stages'].iteritems():
+            self.add( stage, totals['seconds'], totals['calls'] )
+        for method, totals in stats['sql'].iteritems():
+            self.addStatement( method, totals['seconds'], totals['calls'] )
+
+
+class NullInstrumentation:
+    ''' Instrumentation that is switched off: nothing is timed or counted. '''
+
+    enabled = False
+
+    def add( self, stage, seconds, calls = 1 ):
+        pass
+
+    def addStatement( self, method, seconds, statements = 1 ):
+        pass
+
+    def cursor( self, cursor ):
+        return cursor
+
+    def stats( self ):
+        return None
+
+    def take( self ):
+        return None
+
+    def merge( self, stats ):
+        pass
+
+
+class InstrumentedCursor:
+    ''' A database cursor whose statements are timed.
+    Only execute() and executemany() are timed, which for sqlite includes
+    finding the first row; the rest is passed to the cursor.
+    '''
+
+    def __init__(self, cursor, instruments, method):
+        self.cursor = cursor
+        self.instruments = instruments
+        self.method = method
+
+    def execute( self, *args ):
+        start = default_timer()
+        try:
+            return self.cursor.execute( *args )
+        finally:
+            self.instruments.addStatement( self.method, default_timer() - start )
+
+    def executemany( self, *args ):
+        start = default_timer()
+        try:
+            return self.cursor.executemany( *args )
+        finally:
+            self.instruments.addStatement( self.method, default_timer() - start )
+
+    def __iter__( self ):
+        return iter( self.cursor )
+
+    def __getattr__( self, name ):
+        return getattr( self.cursor, name )
+
+
+def formatStats( stats ):
+    ''' lay out the stats of an instrumented classifier to be printed.
+        @see NaiveBayesian.stats()
+        @return list of lines
+        @param array stats
+    '''
+    lines = []
+    elapsed = max( stats['seconds'], 1e-9 )
+    lines.append( "%-24s %10s %10s %10s %7s" % ( "stage", "calls", "seconds", "mean ms", "share" ) )
+    for stage, totals in sorted( stats['stages'].iteritems(), key=lambda t: -t[1]['seconds'] ):
+        lines.append( "%-24s %10d %10.3f %10.3f %6.1f%%" % ( stage, totals['calls'], totals['seconds'],
+                      1000 * totals['seconds'] / max( totals['calls'], 1 ), 100 * totals['seconds'] / elapsed ) )
+    if stats['sql']:
+        lines.append( "%-24s %10s %10s %10s %7s" % ( "sql statements of", "calls", "seconds", "mean ms", "share" ) )
+        for method, totals in sorted( stats['sql'].iteritems(), key=lambda t: -t[1]['seconds'] ):
+            lines.append( "%-24s %10d %10.3f %10.3f %6.1f%%" % ( method, totals['calls'], totals['seconds'],
+                          1000 * totals['seconds'] / max( totals['calls'], 1 ), 100 * totals['seconds'] / elapsed ) )
+    lines.append( "%.3f seconds since the classifier was opened" % stats['seconds'] )
+    return lines
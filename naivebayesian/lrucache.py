@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    ''' A dict-like cache holding a limited number of entries.
+
+    When the cache is full the least recently used entry is evicted. Lookups
+    made through get() refresh the entry and are counted as hits or misses;
+    `in`, [] and peek() don't change the order or the counters. The order is
+    kept under a lock, so threads sharing a model can share its cache.
+    '''
+
+    def __init__(self, maxsize = 100000):
+        # max number of entries, 0 or None for no limit
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get( self, key, default = None ):
+        ''' get an entry, marking it as the most recently used.
+            @return the value or default if the key isn't cached
+            @param  key
+            @param  value returned on a miss
+        '''
+        with self.lock:
+            try:
+                value = self.data.pop( key )
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def peek( self, key, default = None ):
+        ''' get an entry without touching the order or the counters.
+            @return the value or default if the key isn't cached
+            @param  key
+            @param  value returned on a miss
+        '''
+        return self.data.get( key, default )
+
+    def pop( self, key, default = None ):
+        with self.lock:
+            return self.data.pop( key, default )
+
+    def clear( self ):
+        with self.lock:
+            self.data.clear()
+
+    def __setitem__( self, key, value ):
+        with self.lock:
+            if key in self.data:
+                del self.data[key]
+            elif self.maxsize and len(self.data) >= self.maxsize:
+                self.data.popitem( last=False )
+                self.evictions += 1
+            self.data[key] = value
+
+    def __getitem__( self, key ):
+        return self.data[key]
+
+    def __contains__( self, key ):
+        return key in self.data
+
+    def __len__( self ):
+        return len(self.data)
+
+    def stats( self ):
+        ''' get the usage of the cache.
+            @return array keys = 'size', 'maxsize', 'hits', 'misses', 'evictions', 'hit_rate'
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0
+        }
@@ -1,7 +1,68 @@
 import re
 import math
+import time
+import array
+import zlib
+import collections
+import multiprocessing
+import heapq
 from naivebayesianstorage import NaiveBayesianStorage
-from collections import OrderedDict
+from compiledstorage import CompiledStorage
+from inmemorynaivebayesianstorage import InMemoryNaiveBayesianStorage
+from tokenizer import Tokenizer
+from instrumentation import Instrumentation, NullInstrumentation
+from lrucache import LRUCache
+from collections import OrderedDict, Counter
+
+# the classifier used to tokenize documents in a worker process
+_worker = None
+# marks a result that isn't cached
+_missing = object()
+
+def _initTokenWorker( cls, hash_buckets = None ):
+    global _worker
+    _worker = cls( ":memory:", hash_buckets=hash_buckets )
+
+def _countTokens( documents ):
+    ''' count the tokens of documents by category, in a worker process.
+        @return tuple (array keys = category ids, values = Counter of tokens; list of the tokens of each document)
+        @param list of (document id, category id, content)
+    '''
+    counts = {}
+    documents_tokens = []
+    for docid, category_id, content in documents:
+        tokens = _worker._getTokens( content )
+        counts.setdefault( category_id, Counter() ).update( tokens )
+        documents_tokens.append( tokens )
+    return counts, documents_tokens
+
+def _tokenizeReferences( references ):
+    ''' tokenize references, in a worker process.
+        @return list of (reference id, category id, tokens)
+        @param list of (reference id, category id, content)
+    '''
+    return [(doc_id, category_id, _worker._getTokens( content )) for doc_id, category_id, content in references]
+
+def _mergeCounts( counts, shard ):
+    ''' add the token counts of a shard to the totals
+        @return int number of tokens in the shard
+    '''
+    total = 0
+    for category_id, tokens in shard.iteritems():
+        counts.setdefault( category_id, Counter() ).update( tokens )
+        total += sum( tokens.itervalues() )
+    return total
+
+def _chunks( iterable, size ):
+    ''' split an iterable into lists of size items '''
+    chunk = []
+    for item in iterable:
+        chunk.append( item )
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 class NaiveBayesian:
 
@@ -9,13 +70,204 @@ class NaiveBayesian:
     min_token_length = 3
     # max token length for it to be taken into consideration '''
     max_token_length = 15
+    # fewest categories for topMatches() to bound the scores instead of working them all out
+    prune_min_categories = 50
+    # tokens in more categories than this are bound by their best factor in any category
+    prune_max_postings = 100
     
-    def __init__(self, db, login = None, password =None, server =None, use_sqlite = True, reset = False):
+    def __init__(self, db, login = None, password =None, server =None, use_sqlite = True, reset = False, vectorized = False, cache_size = 100000,
+                 bloom_filter = False, bloom_error_rate = 0.01, bloom_max_bytes = None, layout = None,
+                 read_only = False, profile = None, storage = None, hash_buckets = None, instrument = False,
+                 result_cache_size = 0, backend = None, pool_size = 1):
         self.ignore_list = []
         self.include_list = []
+        self.tokenizer = None
+        
+        # a compiled model (see CompiledStorage) is read in place of the database,
+        # and with storage="memory" (or a snapshot) the whole model is held in memory.
+        # A storage object can also be given to use it as it is
+        if storage is not None and not isinstance( storage, basestring ):
+            self.nbs = storage
+        elif use_sqlite and CompiledStorage.isCompiled( db ):
+            self.nbs = CompiledStorage( db, cache_size=cache_size )
+        elif storage == "memory" or (use_sqlite and InMemoryNaiveBayesianStorage.isSnapshot( db )):
+            self.nbs = InMemoryNaiveBayesianStorage( db, reset=reset, layout=layout )
+        else:
+            self.nbs = NaiveBayesianStorage( db, use_sqlite=use_sqlite, user=login, pwd=password, server=server, reset=reset, cache_size=cache_size,
+                                             bloom_filter=bloom_filter, bloom_error_rate=bloom_error_rate, bloom_max_bytes=bloom_max_bytes,
+                                             layout=layout, read_only=read_only, profile=profile, backend=backend, pool_size=pool_size )
         
-        self.nbs = NaiveBayesianStorage( db, use_sqlite=use_sqlite, user=login, pwd=password, server=server, reset=reset )
+        # score with the numpy engine (see VectorizedEngine)
+        self.vectorized = vectorized
+        self.engine = None
         
+        # best matches of documents already classified, keyed on their tokens
+        # and the threshold, forgotten whenever the model changes (see bestMatch())
+        self.results = LRUCache( result_cache_size ) if result_cache_size else None
+        
+        # time spent in each stage and in SQL statements (see stats())
+        self.instruments = Instrumentation() if instrument else NullInstrumentation()
+        self.nbs.instruments = self.instruments
+        
+        # number of buckets tokens are hashed into, None to keep the words
+        self.hash_buckets = self._hashBuckets( hash_buckets )
+        
+    def _hashBuckets( self, hash_buckets ):
+        ''' find the number of buckets tokens are hashed into (see Tokenizer).
+        It is saved with a new model, and a model made with it is always used
+        with the same number, whatever is asked for when it is opened again.
+
+            @return int number of buckets, None if tokens are not hashed
+            @param  int number of buckets asked for, None to use the model's
+        '''
+        saved = self.nbs.getSettings().get( 'hash_buckets' )
+        if saved:
+            saved = int( saved )
+        if hash_buckets is None:
+            return saved or None
+        if hash_buckets <= 0:
+            raise ValueError( "the number of hash buckets must be positive" )
+        if saved:
+            if saved != hash_buckets:
+                raise ValueError( "the model hashes tokens into %d buckets, not %d" % (saved, hash_buckets) )
+            return saved
+
+        for row in self.nbs.getWordFreqs():
+            raise ValueError( "the model holds words that are not hashed, it can't be used with hash buckets" )
+        if not getattr( self.nbs, 'read_only', False ):
+            self.nbs.saveSetting( 'hash_buckets', str(hash_buckets) )
+        return hash_buckets
+
+    def hashCollisions( self ):
+        ''' count the buckets shared by different tokens, in a model whose
+        tokens are hashed. The tokens of every reference are hashed again,
+        and a second checksum of the first token seen in each bucket is
+        kept, so the memory used depends on the number of buckets and not on
+        the number of tokens.
+
+            @return array keys = 'buckets', 'used', 'collisions' (buckets holding more than one token), None if tokens are not hashed
+        '''
+        if not self.hash_buckets:
+            return None
+        tokenizer = self._getTokenizer()
+        raw = Tokenizer( tokenizer.ignore_list, tokenizer.include_list,
+                         tokenizer.min_token_length, tokenizer.max_token_length )
+        checksums = array.array( 'L', [0] ) * self.hash_buckets
+        shared = set()
+        used = 0
+        if hasattr( self.nbs, 'getReferences' ):
+            for doc_id, category_id, content in self.nbs.getReferences():
+                for token in raw.tokenize( self._cleanString( content ) ):
+                    if isinstance(token, unicode):
+                        token = token.encode('utf-8')
+                    bucket = (zlib.crc32( token ) & 0xffffffff) % self.hash_buckets
+                    # never 0, which marks an empty bucket
+                    checksum = (zlib.adler32( token ) & 0xffffffff) | 1
+                    if checksums[bucket] == 0:
+                        checksums[bucket] = checksum
+                        used += 1
+                    elif checksums[bucket] != checksum:
+                        shared.add( bucket )
+        return {
+            'buckets': self.hash_buckets,
+            'used': used,
+            'collisions': len(shared)
+        }
+
+    def docFrequencies( self ):
+        ''' count the references each word of the model is found in.
+            @return array keys = words, values = number of references
+        '''
+        frequencies = {}
+        for doc_id, category_id, content in self.nbs.getReferences():
+            for token in self._getTokens( content ):
+                frequencies[token] = frequencies.get( token, 0 ) + 1
+        return frequencies
+
+    def chiSquare( self ):
+        ''' score how much each word tells the categories apart.
+        The chi-square of the word and each category it is found in is
+        worked out from the word counts, taking the categories as the
+        classes and the words of the model as the observations, and the
+        best of them is the score of the word. Words found as often in every
+        category score 0.
+
+            @return array keys = words, values = scores
+        '''
+        categories = self.nbs.getCategories()
+        totals = dict( [(category, data['word_count']) for category, data in categories.iteritems()] )
+        total = float( sum( totals.itervalues() ) )
+
+        scores = {}
+        word = None
+        counts = []
+        for row in self.nbs.getWordFreqs( ordered=True ):
+            if row[0] != word:
+                if counts:
+                    scores[word] = self._chiSquareOf( counts, totals, total )
+                word = row[0]
+                counts = []
+            counts.append( (row[1], row[2]) )
+        if counts:
+            scores[word] = self._chiSquareOf( counts, totals, total )
+        return scores
+
+    def _chiSquareOf( self, counts, totals, total ):
+        ''' get the chi-square score of a word.
+            @see chiSquare()
+            @return float best chi-square of the word and one of its categories
+            @param list of (category id, count) of the word
+            @param array keys = category ids, values = word counts
+            @param float total word count of the model
+        '''
+        occurrences = sum( [count for category, count in counts] )
+        best = 0.0
+        for category, count in counts:
+            in_category = totals.get( category, 0 )
+            denominator = occurrences * (total - occurrences) * in_category * (total - in_category)
+            if count <= 0 or denominator <= 0:
+                continue
+            # count, and the counts of the word elsewhere, other words in the category and all the others
+            others = occurrences - count
+            rest = in_category - count
+            outside = total - occurrences - rest
+            score = total * (count*outside - others*rest)**2 / denominator
+            if score > best:
+                best = score
+        return best
+
+    def selectWords( self, min_count = 0, min_docs = 0, min_score = None, max_words = None ):
+        ''' choose the words to remove from the model to make it smaller.
+
+            @see chiSquare()
+            @see docFrequencies()
+            @return set of the words to remove
+            @param int words counted fewer times than this in all the categories are removed
+            @param int words found in fewer references than this are removed
+            @param float words whose chi-square is below this are removed
+            @param int at most this many words are kept, the ones with the best chi-square
+        '''
+        remove = set()
+        kept = {}
+        frequencies = self.docFrequencies() if min_docs > 0 else {}
+        scores = self.chiSquare() if min_score is not None or max_words is not None else {}
+
+        counts = {}
+        for word, category_id, count in self.nbs.getWordFreqs():
+            counts[word] = counts.get( word, 0 ) + count
+        for word, count in counts.iteritems():
+            if( count < min_count or
+                (min_docs > 0 and frequencies.get( word, 0 ) < min_docs) or
+                (min_score is not None and scores.get( word, 0.0 ) < min_score) ):
+                remove.add( word )
+            else:
+                kept[word] = scores.get( word, 0.0 )
+
+        if max_words is not None and len(kept) > max_words:
+            ranked = sorted( kept, key=lambda word: (-kept[word], word) )
+            remove.update( ranked[max_words:] )
+        return remove
+
     def categorize( self, document):
         ''' categorize a document.
         Get list of categories in which the document can be categorized
@@ -24,9 +276,19 @@ class NaiveBayesian:
             @return array keys = category ids, values = scores
             @param string document
         '''
+        if self.vectorized:
+            return self.categorize_many( [document] )[0]
+        return self._categorizeTokens( self._getTokens( document ) )
+
+    def _categorizeTokens( self, tokens, words = None ):
+        ''' categorize a document given as tokens.
+            @see categorize()
+            @return array keys = category ids, values = scores
+            @param array tokens (keys = tokens, values = counts)
+            @param array counts of the tokens from getWordCounts(), fetched if not given
+        '''
         scores = {}
         categories = self.nbs.getCategories()
-        tokens = self._getTokens( document )
         
         # calculate the score in each category
         total_words = 0
@@ -37,30 +299,160 @@ class NaiveBayesian:
             total_words += data['word_count']
             ncat += 1
             
-        for category in categories:
-            data = categories[category]
-            scores[category] = data['probability'];
-            # small probability for a word not in the category
-            # maybe putting 1.0 as a 'no effect' word can also be good
-            small_proba = 1.0/((data['word_count']+1)*20000)
+        # fetch the counts of every token in one go
+        instruments = self.instruments
+        if words is None:
+            if instruments.enabled:
+                start = instruments.clock()
+            words = self.nbs.getWordCounts( tokens.keys() )
+            if instruments.enabled:
+                instruments.add( 'lookup', instruments.clock() - start )
             
-            for token in tokens:
-                count = tokens[token]
-                if self.nbs.wordExists( token ):
-                    word = self.nbs.getWord( token, category )
-                    if word['count'] > 0 and data['word_count'] > 0:
-                        proba = float(word['count']) / data['word_count']
-                    else:
-                        proba = small_proba
-                    scores[category] *= pow(proba, count) * pow(total_words/ncat, count)
-                    # pow( total_words/ ncat, count) is here to avoid underflow.
+        if instruments.enabled:
+            start = instruments.clock()
+        for category in categories:
+            scores[category] = self._scoreCategory( category, categories[category], tokens, words, total_words/ncat )
+        if instruments.enabled:
+            instruments.add( 'score', instruments.clock() - start )
         
         return self._rescale(scores);
+
+    def _scoreCategory( self, category, data, tokens, words, scale ):
+        ''' get the score of a document in one category, before rescaling.
+            @see _categorizeTokens()
+            @return float score
+            @param string category id
+            @param array data of the category from getCategories()
+            @param array tokens (keys = tokens, values = counts)
+            @param array counts of the tokens from getWordCounts()
+            @param int total words / number of categories
+        '''
+        score = data['probability'];
+        # small probability for a word not in the category
+        # maybe putting 1.0 as a 'no effect' word can also be good
+        small_proba = 1.0/((data['word_count']+1)*20000)
+        
+        for token in tokens:
+            count = tokens[token]
+            if token in words:
+                word_count = words[token].get( category, 0 )
+                if word_count > 0 and data['word_count'] > 0:
+                    proba = float(word_count) / data['word_count']
+                else:
+                    proba = small_proba
+                score *= pow(proba, count) * pow(scale, count)
+                # pow( total_words/ ncat, count) is here to avoid underflow.
+        return score
         
     def categorise( self, document ):
         ''' proper spelling '''
         return self.categorize( document )
 
+    def categorize_many( self, documents ):
+        ''' categorize a batch of documents.
+        The same as calling categorize() on each document, but when the
+        classifier is vectorized the whole batch is scored at once.
+
+            @see categorize()
+            @return list of arrays keys = category ids, values = scores
+            @param list of string documents
+        '''
+        if not self.vectorized:
+            return [self.categorize( document ) for document in documents]
+        
+        engine = self._getEngine()
+        tokenizer = self._getTokenizer()
+        instruments = self.instruments
+        if instruments.enabled:
+            start = instruments.clock()
+        ids = [tokenizer.tokenize_ids( self._cleanString( document ) ) for document in documents]
+        if instruments.enabled:
+            instruments.add( 'tokenize', instruments.clock() - start, len(documents) )
+            start = instruments.clock()
+        scores = engine.score_many_ids( ids )
+        if instruments.enabled:
+            instruments.add( 'score', instruments.clock() - start, len(documents) )
+        return [self._rescale( s ) for s in scores]
+
+    def classify_stream( self, documents, threshold = -0.01, chunk_size = 1000, reporter = None ):
+        ''' get the best match of each document of a stream.
+        Documents are pulled from the iterable a chunk at a time. The counts of
+        every token in a chunk are fetched in bulk before it is scored, and
+        only one chunk is held in memory whatever the size of the stream.
+        With a result cache, documents with the same tokens as one already
+        classified are not scored again (see bestMatch()).
+
+            @see bestMatch()
+            @return iterator of best matches, in the order of the documents (None for empty documents)
+            @param iterable of string documents
+            @param float threshold for returning a match
+            @param int number of documents in a chunk
+            @param ThroughputReporter to count the documents and tokens
+        '''
+        instruments = self.instruments
+        cache = self.results
+        for chunk in _chunks( documents, chunk_size ):
+            texts = [self._cleanString( document ) if document else None for document in chunk]
+            if self.vectorized:
+                self._getEngine()
+                tokenizer = self._getTokenizer()
+                if instruments.enabled:
+                    start = instruments.clock()
+                tokens = [tokenizer.tokenize_ids( text ) if text is not None else None for text in texts]
+                if instruments.enabled:
+                    instruments.add( 'tokenize', instruments.clock() - start, len(tokens) )
+            else:
+                tokens = [self._getTokens( text ) if text is not None else None for text in texts]
+            
+            # the documents to score by key: their tokens and the threshold with a
+            # result cache, so a document repeated in the chunk is scored once,
+            # or else their position
+            results = [None] * len(tokens)
+            todo = OrderedDict()
+            for i, t in enumerate( tokens ):
+                if t is None:
+                    continue
+                if cache is None:
+                    todo[i] = [i]
+                    continue
+                key = ( threshold, frozenset( t.iteritems() ) )
+                if key in todo:
+                    # scored once with the first, which counts as a hit
+                    todo[key].append( i )
+                    cache.hits += 1
+                    continue
+                match = cache.get( key, _missing )
+                if match is _missing:
+                    todo[key] = [i]
+                else:
+                    results[i] = match
+            if todo:
+                matches = self._bestOfMany( [tokens[positions[0]] for positions in todo.itervalues()], threshold )
+                for (key, positions), match in zip( todo.iteritems(), matches ):
+                    if cache is not None:
+                        cache[key] = match
+                    for i in positions:
+                        results[i] = match
+            
+            if reporter is not None:
+                reporter.update( len(chunk), sum( [sum( t.itervalues() ) for t in tokens if t] ) )
+            for result in results:
+                yield result
+
+    def _getEngine( self ):
+        ''' get the vectorized engine, loading the model into it if needed.
+            @return VectorizedEngine
+        '''
+        if self.engine is None:
+            from vectorizedengine import VectorizedEngine
+            self.engine = VectorizedEngine( self.nbs )
+            # tokenize straight to the engine's token ids
+            tokenizer = self._getTokenizer()
+            self.tokenizer = Tokenizer( tokenizer.ignore_list, tokenizer.include_list,
+                                        tokenizer.min_token_length, tokenizer.max_token_length,
+                                        vocabulary=self.engine.vocabulary, hash_buckets=self.hash_buckets )
+        return self.engine
+
     def train( self, docid, category_id, content ):
         ''' training against a document.
         Set a document as being in a specific category. The document becomes a reference
@@ -80,40 +472,486 @@ class NaiveBayesian:
         if doc!=None and len(doc)>0:
             return False
     
-        # standardise the strings
-        docid = re.sub('<[^>]*>', '', docid.strip())
-        docid = docid.replace(' ', '')
-        category_id = re.sub('<[^>]*>', '', category_id.strip())
-        category_id = category_id.replace(' ', '')
-        content = content.strip()
-        
-        if category_id =="":
+        document = self._prepareDocument( docid, category_id, content )
+        if document is None:
             return False
-        if content == "":
+        # and so is the standardised id, as in _selectDocuments()
+        if document[0] != docid and self.nbs.getReferenceIds( [document[0]] ):
             return False
+        docid, category_id, content = document
         
         # go through each word
         tokens = self._getTokens(content)
+        instruments = self.instruments
+        if instruments.enabled:
+            start = instruments.clock()
         for token, count in tokens.iteritems():
             self.nbs.updateWord( token, count, category_id )
-        self.nbs.saveReference( docid, category_id, content)
+        self.nbs.saveReference( docid, category_id, content, tokens )
+        if instruments.enabled:
+            instruments.add( 'store', instruments.clock() - start )
+        self._modelChanged()
         return True
 
+    def train_many( self, documents, batch_size = 1000 ):
+        ''' training against a set of documents.
+        The same as calling train() on each document, but the token counts of
+        each batch of documents are collected in memory and written with bulk
+        statements in a single transaction. After a set of training is done
+        the updateProbabilities() function must be run.
+
+            @see train()
+            @see updateProbabilities()
+            @return int number of documents trained
+            @param iterable of (document id, category id, content)
+            @param int number of documents written in each transaction
+        '''
+        return sum( self.train_stream( documents, batch_size ) )
+
+    def train_stream( self, documents, batch_size = 1000, reporter = None ):
+        ''' training against a stream of documents.
+        Documents are pulled from the iterable a batch at a time and each batch
+        is written in a single transaction, as in train_many(). Only one batch
+        is held in memory whatever the size of the stream.
+
+            @see train_many()
+            @return iterator of the number of documents trained in each batch
+            @param iterable of (document id, category id, content)
+            @param int number of documents written in each transaction
+            @param ThroughputReporter to count the documents and tokens
+        '''
+        for batch in _chunks( documents, batch_size ):
+            trained, tokens = self._trainBatch( batch )
+            if reporter is not None:
+                reporter.update( len(batch), tokens )
+            yield trained
+
+    def train_parallel( self, documents, workers, chunk_size = 10000, reporter = None ):
+        ''' training against a set of documents, tokenizing in worker processes.
+        Documents are checked for duplicate ids in this process, in order,
+        then shards of them are tokenized by the workers into token counts per
+        category. The counts are merged and written with the references in a
+        single bulk write, which gives the same model as calling train() on
+        each document. After a set of training is done the
+        updateProbabilities() function must be run.
+
+            @see train()
+            @see updateProbabilities()
+            @return int number of documents trained
+            @param iterable of (document id, category id, content)
+            @param int number of worker processes
+            @param int number of documents in each shard
+            @param ThroughputReporter to count the documents and tokens
+        '''
+        pool = multiprocessing.Pool( workers, _initTokenWorker, (self.__class__, self.hash_buckets) )
+        pending = collections.deque()
+        seen = set()
+        references = []
+        counts = {}
+        try:
+            for chunk in _chunks( documents, chunk_size ):
+                selected = self._selectDocuments( chunk, seen )
+                pending.append( (len(chunk), selected, pool.apply_async( _countTokens, (selected,) )) )
+                while pending and (len(pending) >= workers*2 or pending[0][2].ready()):
+                    self._mergeShard( counts, references, pending.popleft(), reporter )
+            while pending:
+                self._mergeShard( counts, references, pending.popleft(), reporter )
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        
+        wordcounts = {}
+        for category_id, tokens in counts.iteritems():
+            for token, count in tokens.iteritems():
+                wordcounts[(token, category_id)] = count
+        instruments = self.instruments
+        if instruments.enabled:
+            start = instruments.clock()
+        self.nbs.bulkUpdate( wordcounts, references )
+        if instruments.enabled:
+            instruments.add( 'store', instruments.clock() - start )
+        self._modelChanged()
+        return len(references)
+
+    def _mergeShard( self, counts, references, pending, reporter ):
+        ''' add the token counts of a shard tokenized by a worker to the totals,
+        and its documents with their tokens to the references.
+            @see train_parallel()
+            @param array keys = category ids, values = Counter of tokens
+            @param list of (document id, category id, content, tokens)
+            @param tuple (number of rows, documents of the shard, result of _countTokens())
+            @param ThroughputReporter to count the documents and tokens
+        '''
+        rows, selected, shard = pending
+        shard, documents_tokens = shard.get()
+        tokens = _mergeCounts( counts, shard )
+        for document, document_tokens in zip( selected, documents_tokens ):
+            references.append( document + (document_tokens,) )
+        if reporter is not None:
+            reporter.update( rows, tokens )
+
+    def _trainBatch( self, documents ):
+        ''' train against a batch of documents in one transaction.
+            @see train_many()
+            @return tuple (number of documents trained, number of tokens counted)
+            @param list of (document id, category id, content)
+        '''
+        references = []
+        wordcounts = {}
+        tokens = 0
+        for docid, category_id, content in self._selectDocuments( documents, set() ):
+            document_tokens = self._getTokens( content )
+            for token, count in document_tokens.iteritems():
+                key = ( token, category_id )
+                wordcounts[key] = wordcounts.get( key, 0 ) + count
+                tokens += count
+            references.append( (docid, category_id, content, document_tokens) )
+        
+        instruments = self.instruments
+        if instruments.enabled:
+            start = instruments.clock()
+        self.nbs.bulkUpdate( wordcounts, references )
+        if instruments.enabled:
+            instruments.add( 'store', instruments.clock() - start )
+        self._modelChanged()
+        return len(references), tokens
+
+    def _selectDocuments( self, documents, seen ):
+        ''' standardise a batch of documents and keep the ones that can be trained.
+        As in train(), documents whose id is already a reference are skipped,
+        and so are the ones whose id is in seen. The ids of the documents kept
+        are added to seen.
+
+            @return list of (document id, category id, content)
+            @param list of (document id, category id, content)
+            @param set ids of the documents kept so far
+        '''
+        prepared = []
+        for docid, category_id, content in documents:
+            document = self._prepareDocument( docid, category_id, content )
+            if document is not None:
+                prepared.append( (docid, document) )
+        
+        doc_ids = set( [raw_id for raw_id, document in prepared] )
+        doc_ids.update( [document[0] for raw_id, document in prepared] )
+        existing = self.nbs.getReferenceIds( doc_ids )
+        
+        selected = []
+        for raw_id, document in prepared:
+            docid = document[0]
+            if( raw_id in existing or raw_id in seen or
+                docid in existing or docid in seen ):
+                continue
+            seen.add( docid )
+            selected.append( document )
+        return selected
+
+    def _prepareDocument( self, docid, category_id, content ):
+        ''' standardise a document before training.
+            @return tuple (document id, category id, content) or None if it can't be used
+            @param string document id
+            @param string category id
+            @param string content of the document
+        '''
+        docid = re.sub('<[^>]*>', '', docid.strip())
+        docid = docid.replace(' ', '')
+        category_id = re.sub('<[^>]*>', '', category_id.strip())
+        category_id = category_id.replace(' ', '')
+        content = content.strip()
+        
+        if category_id =="":
+            return None
+        if content == "":
+            return None
+        return ( docid, category_id, content )
+
     def untrain( self, doc_id ):
         ''' untraining of a document.
         To remove just one document from the references.
 
             @see updateProbabilities()
-            @see untrain()
+            @see untrain_many()
             @return bool success
             @param string document id, must be unique
         '''
-        ref = self.nbs.getReference( doc_id )
-        tokens = self._getTokens( ref['content'] )
-        for token, count in tokens.iteritems():
-            self.nbs.removeWord( token, count, ref['category_id'] )
-        self.nbs.removeReference( doc_id )
-        return True
+        return self.untrain_many( [doc_id] ) > 0
+
+    def untrain_many( self, doc_ids ):
+        ''' untraining of a set of documents.
+        The references are read in one go, the token counts of all of them are
+        added up, and the counts and references are removed with bulk
+        statements in a single transaction. Ids that are not references are
+        skipped. After a set of untraining is done the updateProbabilities()
+        function must be run.
+
+            @see untrain()
+            @see updateProbabilities()
+            @return int number of documents untrained
+            @param iterable of document ids
+        '''
+        references = list( self.nbs.getReferenceTokens( set( doc_ids ) ) )
+        if not references:
+            return 0
+        
+        # the tokens saved with a reference are the ones it was trained with
+        wordcounts = {}
+        for doc_id, category_id, content, tokens in references:
+            if tokens is None:
+                tokens = self._getTokens( content )
+            for token, count in tokens.iteritems():
+                key = ( token, category_id )
+                wordcounts[key] = wordcounts.get( key, 0 ) + count
+        
+        instruments = self.instruments
+        if instruments.enabled:
+            start = instruments.clock()
+        self.nbs.bulkRemove( wordcounts, [reference[0] for reference in references] )
+        if instruments.enabled:
+            instruments.add( 'store', instruments.clock() - start )
+        self._modelChanged()
+        return len(references)
+
+    def rebuild_model( self, retokenize = False, workers = 1, chunk_size = 10000, reporter = None ):
+        ''' make the word frequencies and the totals of the categories again
+        from the references, for example after the ignore list or the token
+        lengths have changed.
+        The references are read in one pass, a chunk at a time, and the
+        tokens saved with each of them are counted. References without saved
+        tokens, or all of them with retokenize, are tokenized again (by worker
+        processes if there are several) and their new tokens are saved. The
+        counts then replace the old ones in a single transaction, and the
+        probabilities are updated.
+
+            @see train()
+            @return int number of references
+            @param bool whether to tokenize every reference again instead of using the saved tokens
+            @param int number of processes tokenizing the references
+            @param int number of references in each chunk
+            @param ThroughputReporter to count the references and tokens
+        '''
+        wordcounts = {}
+        totals = {}
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool( workers, _initTokenWorker, (self.__class__, self.hash_buckets) )
+        pending = collections.deque()
+        try:
+            for chunk in _chunks( self.nbs.getReferenceTokens(), chunk_size ):
+                saved = []
+                todo = []
+                for doc_id, category_id, content, tokens in chunk:
+                    if tokens is None or retokenize:
+                        todo.append( (doc_id, category_id, content) )
+                    else:
+                        saved.append( (doc_id, category_id, tokens) )
+                if pool is None:
+                    self._countReferences( wordcounts, totals, saved, self._tokenizeReferences( todo ), reporter )
+                    continue
+                pending.append( (saved, pool.apply_async( _tokenizeReferences, (todo,) )) )
+                while pending and (len(pending) >= workers*2 or pending[0][1].ready()):
+                    saved, tokenized = pending.popleft()
+                    self._countReferences( wordcounts, totals, saved, tokenized.get(), reporter )
+            while pending:
+                saved, tokenized = pending.popleft()
+                self._countReferences( wordcounts, totals, saved, tokenized.get(), reporter )
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        
+        instruments = self.instruments
+        if instruments.enabled:
+            start = instruments.clock()
+        self.nbs.replaceCounts( wordcounts, totals )
+        if instruments.enabled:
+            instruments.add( 'store', instruments.clock() - start )
+        self.updateProbabilities()
+        return sum( [doc_count for word_count, doc_count in totals.itervalues()] )
+
+    def _tokenizeReferences( self, references ):
+        ''' tokenize references in this process.
+            @see rebuild_model()
+            @return list of (reference id, category id, tokens)
+        '''
+        return [(doc_id, category_id, self._getTokens( content )) for doc_id, category_id, content in references]
+
+    def _countReferences( self, wordcounts, totals, saved, tokenized, reporter ):
+        ''' add the tokens of a chunk of references to the counts, and save
+        the tokens of the references tokenized again.
+            @see rebuild_model()
+            @param array keys = (token, category id), values = counts
+            @param array keys = category ids, values = (word count, document count)
+            @param list of (reference id, category id, tokens) with saved tokens
+            @param list of (reference id, category id, tokens) tokenized again
+            @param ThroughputReporter to count the references and tokens
+        '''
+        counted = 0
+        for doc_id, category_id, tokens in saved + tokenized:
+            words = 0
+            for token, count in tokens.iteritems():
+                key = ( token, category_id )
+                wordcounts[key] = wordcounts.get( key, 0 ) + count
+                words += count
+            word_count, doc_count = totals.get( category_id, (0, 0) )
+            totals[category_id] = ( word_count + words, doc_count + 1 )
+            counted += words
+        if tokenized:
+            self.nbs.saveReferenceTokens( [(doc_id, tokens) for doc_id, category_id, tokens in tokenized] )
+        if reporter is not None:
+            reporter.update( len(saved) + len(tokenized), counted )
+
+    def evaluate_folds( self, folds = 5, threshold = -0.01, retokenize = False, chunk_size = 1000, reporter = None ):
+        ''' cross-validate the classifier on the references of the model,
+        without training a model for each fold.
+        The token counts of every reference are added up once into a model
+        held in memory. Each fold then has the counts of its references taken
+        off that model, its references are classified with what is left, and
+        the counts are put back, which gives the matches a model trained on the
+        other folds would give. A reference is in fold i when its place in the
+        order of the ids, modulo folds, is i.
+
+        The references are read once to add up the counts and once for each
+        fold, which also counts the next fold, so only the counts of the model
+        and of two folds are held in memory. References without saved tokens,
+        or all of them with retokenize, are tokenized each time they are read
+        (see rebuild_model()). A vectorized classifier scores each fold with
+        the numpy engine.
+
+            @return array keys = 'documents', 'correct', 'accuracy', 'unmatched', 'seconds', 'folds' (list of array(keys = 'documents', 'correct', 'seconds')), 'confusion' (array keys = (category id, best match or None), values = number of references)
+            @param int number of folds
+            @param float threshold for returning a match
+            @param bool whether to tokenize every reference again instead of using the saved tokens
+            @param int number of references read and classified at a time
+            @param ThroughputReporter to count the references classified and their tokens
+        '''
+        if folds < 2:
+            raise ValueError( "cross-validation needs at least 2 folds" )
+        model = InMemoryNaiveBayesianStorage()
+        model.settings = dict( self.nbs.getSettings() )
+        evaluator = self.__class__( None, storage=model, vectorized=self.vectorized )
+
+        # the counts of every reference, and of the first fold
+        wordcounts = {}
+        totals = {}
+        fold_counts = ( {}, {} )
+        for chunk in _chunks( self._foldReferences( folds, retokenize ), chunk_size ):
+            self._countReferences( wordcounts, totals, [reference[1:] for reference in chunk], [], None )
+            self._countReferences( fold_counts[0], fold_counts[1], [reference[1:] for reference in chunk if reference[0] == 0], [], None )
+        model.bulkUpdate( wordcounts, [] )
+        for category_id, (word_count, doc_count) in totals.iteritems():
+            model.addcat( category_id )
+            if category_id in model.categories:
+                model.categories[category_id]['doc_count'] = doc_count
+        wordcounts = None
+
+        confusion = Counter()
+        results = []
+        for fold in xrange(folds):
+            start = time.time()
+            hidden = self._takeFold( model, fold_counts )
+            evaluator.updateProbabilities()
+
+            next_counts = ( {}, {} )
+            held = []
+            correct = 0
+            documents = 0
+            for chunk in _chunks( self._foldReferences( folds, retokenize ), chunk_size ):
+                if fold + 1 < folds:
+                    self._countReferences( next_counts[0], next_counts[1], [reference[1:] for reference in chunk if reference[0] == fold + 1], [], None )
+                held.extend( [reference[1:] for reference in chunk if reference[0] == fold] )
+                if len(held) >= chunk_size:
+                    correct += self._evaluateReferences( evaluator, held, threshold, confusion, reporter )
+                    documents += len(held)
+                    held = []
+            if held:
+                correct += self._evaluateReferences( evaluator, held, threshold, confusion, reporter )
+                documents += len(held)
+
+            self._restoreFold( model, fold_counts, hidden )
+            fold_counts = next_counts
+            results.append( { 'documents': documents, 'correct': correct, 'seconds': time.time() - start } )
+
+        documents = sum( [result['documents'] for result in results] )
+        correct = sum( [result['correct'] for result in results] )
+        return {
+            'documents': documents,
+            'correct': correct,
+            'accuracy': float(correct) / documents if documents else 0.0,
+            'unmatched': sum( [count for (category_id, matched), count in confusion.iteritems() if matched is None] ),
+            'seconds': sum( [result['seconds'] for result in results] ),
+            'folds': results,
+            'confusion': dict( confusion ),
+        }
+
+    def _foldReferences( self, folds, retokenize ):
+        ''' read every reference with its tokens and fold.
+            @see evaluate_folds()
+            @return iterator of (fold, reference id, category id, tokens)
+            @param int number of folds
+            @param bool whether to tokenize every reference again instead of using the saved tokens
+        '''
+        for i, (doc_id, category_id, content, tokens) in enumerate( self.nbs.getReferenceTokens() ):
+            if tokens is None or retokenize:
+                tokens = self._getTokens( content )
+            yield ( i % folds, doc_id, category_id, tokens )
+
+    def _takeFold( self, model, counts ):
+        ''' take the counts of a fold off a model held in memory, and leave out
+        the categories with no references left, as training would.
+            @see evaluate_folds()
+            @return array keys = category ids, values = data of the categories left out
+            @param InMemoryNaiveBayesianStorage model
+            @param tuple counts of the fold from _countReferences()
+        '''
+        wordcounts, totals = counts
+        model.bulkRemove( wordcounts, [] )
+        hidden = {}
+        for category_id, (word_count, doc_count) in totals.iteritems():
+            if category_id not in model.categories:
+                continue
+            model.categories[category_id]['doc_count'] -= doc_count
+            if model.categories[category_id]['doc_count'] == 0:
+                hidden[category_id] = model.categories.pop( category_id )
+        return hidden
+
+    def _restoreFold( self, model, counts, hidden ):
+        ''' put back the counts of a fold taken off by _takeFold().
+            @see evaluate_folds()
+        '''
+        wordcounts, totals = counts
+        model.categories.update( hidden )
+        model.bulkUpdate( wordcounts, [] )
+        for category_id, (word_count, doc_count) in totals.iteritems():
+            if category_id in model.categories:
+                model.categories[category_id]['doc_count'] += doc_count
+
+    def _evaluateReferences( self, evaluator, references, threshold, confusion, reporter ):
+        ''' classify references held out of a fold.
+            @see evaluate_folds()
+            @return int number of references given their own category
+            @param NaiveBayesian classifier of the model without the fold
+            @param list of (reference id, category id, tokens)
+            @param float threshold for returning a match
+            @param Counter keys = (category id, best match or None), values = number of references
+            @param ThroughputReporter to count the references classified and their tokens
+        '''
+        tokens = [t for doc_id, category_id, t in references]
+        if evaluator.vectorized:
+            matches = [evaluator._bestOf( evaluator._rescale( s ), threshold ) for s in evaluator._getEngine().score_many( tokens )]
+        else:
+            matches = evaluator._bestOfMany( tokens, threshold )
+        correct = 0
+        for (doc_id, category_id, t), match in zip( references, matches ):
+            matched = match[0] if match else None
+            confusion[(category_id, matched)] += 1
+            if matched == category_id:
+                correct += 1
+        if reporter is not None:
+            reporter.update( len(references), sum( [sum( t.itervalues() ) for t in tokens] ) )
+        return correct
 
     def _rescale( self, scores ):
         ''' rescale the results between 0 and 1.
@@ -123,6 +961,8 @@ class NaiveBayesian:
             @return array normalized scores (keys => category, values => scores)
             @param array scores (keys => category, values => scores)
         '''
+        if self.instruments.enabled:
+            start = self.instruments.clock()
         # Scale everything back to a reasonable area in 
         # logspace (near zero), un-loggify, and normalize
         total = 0.0
@@ -145,18 +985,43 @@ class NaiveBayesian:
         for cat in scores:
             scores[cat] = scores[cat]/total
             
+        if self.instruments.enabled:
+            self.instruments.add( 'rescale', self.instruments.clock() - start )
         return scores
     
 
-    def updateProbabilities(self):
+    def _modelChanged( self ):
+        ''' forget what was worked out from the model: the vectorized engine
+        and the cached results.
+        '''
+        self.engine = None
+        if self.results is not None:
+            self.results.clear()
+
+    def updateProbabilities(self, verify = False):
         ''' update the probabilities of the categories and word count.
         This function must be run after a set of training
 
             @see train()
             @see untrain()
+            @see verifyCategories()
             @return bool success
+            @param  bool whether to count the category totals again first
+        '''
+        self._modelChanged()
+        if not self.instruments.enabled:
+            return self.nbs.updateProbabilities( verify )
+        start = self.instruments.clock()
+        updated = self.nbs.updateProbabilities( verify )
+        self.instruments.add( 'update', self.instruments.clock() - start )
+        return updated
+
+    def verifyCategories( self ):
+        ''' count the category totals again and fix any drift.
+            @return array keys = category ids, values = array(keys = 'word_count', 'doc_count', values = (kept total, counted total)) for the categories that had drifted
         '''
-        return self.nbs.updateProbabilities()
+        self._modelChanged()
+        return self.nbs.verifyCategories()
 
     def getIgnoreList( self ):
         ''' Get the list of token to ignore.
@@ -183,37 +1048,27 @@ class NaiveBayesian:
             @return array tokens
             @param  string the string to get the tokens from
         '''
-    
-        rawtokens = []
-        tokens = {}
-        string = self._cleanString( string )
-        
-        if( len(self.ignore_list) == 0 ):
-            self.ignore_list = self.getIgnoreList()
-        if( len(self.include_list) == 0 ):
-            self.include_list = self.getIncludeList()
-            
-        rawtokens = re.split("[^-_A-Za-z0-9]+", string)
-        
-        # remove some tokens
-        for token in rawtokens:
-            token = token.strip()
-            
-            if (not(('' == token)                        or
-                  (len(token) < self.min_token_length) or
-                  (len(token) > self.max_token_length) or
-                  (re.match('[0-9]+$', token))   or
-                  (token in self.ignore_list)
-                )                                      or
-                  (token in self.include_list)
-                ):
-                if( tokens.has_key(token) ):
-                    tokens[token] += 1
-                else:
-                    tokens[token] = 1
-        
+        if not self.instruments.enabled:
+            return self._getTokenizer().tokenize( self._cleanString( string ) )
+        start = self.instruments.clock()
+        tokens = self._getTokenizer().tokenize( self._cleanString( string ) )
+        self.instruments.add( 'tokenize', self.instruments.clock() - start )
         return tokens
 
+    def _getTokenizer( self ):
+        ''' get the tokenizer, building it from the token lists and lengths if needed.
+            @return Tokenizer
+        '''
+        if self.tokenizer is None:
+            if( len(self.ignore_list) == 0 ):
+                self.ignore_list = self.getIgnoreList()
+            if( len(self.include_list) == 0 ):
+                self.include_list = self.getIncludeList()
+            self.tokenizer = Tokenizer( self.ignore_list, self.include_list,
+                                        self.min_token_length, self.max_token_length,
+                                        hash_buckets=self.hash_buckets )
+        return self.tokenizer
+
     def _cleanString( self, string ):
         ''' clean a string from the diacritics
 
@@ -237,6 +1092,7 @@ class NaiveBayesian:
             @param  string slug for category
             @param  string name of category
         '''
+        self._modelChanged()
         return self.nbs.addcat( cat, catname)
     
     
@@ -250,10 +1106,42 @@ class NaiveBayesian:
             @param  string slug for category
             @param  string name of category
         '''
+        self._modelChanged()
         return self.nbs.remcat( cat )
     
     def getCategories( self ):
         return self.nbs.getCategories()
+    
+    def cacheStats( self ):
+        return self.nbs.cacheStats()
+    
+    def resultCacheStats( self ):
+        ''' get the usage of the result cache (see bestMatch()).
+            @return array keys = 'size', 'maxsize', 'hits', 'misses', 'evictions', 'hit_rate', None if there is no result cache
+        '''
+        if self.results is None:
+            return None
+        return self.results.stats()
+    
+    def stats( self ):
+        ''' get the time spent in each stage (tokenize, lookup, score,
+        rescale, store and update) and in the SQL statements of each storage
+        method, with the usage of the word cache and the bloom filter.
+        Only kept if the classifier was made with instrument=True.
+
+            @see Instrumentation
+            @return array keys = 'seconds', 'stages', 'sql', 'cache', 'results', 'bloom', None if not instrumented
+        '''
+        stats = self.instruments.stats()
+        if stats is None:
+            return None
+        stats['cache'] = self.cacheStats()
+        stats['results'] = self.resultCacheStats()
+        stats['bloom'] = self.bloomStats()
+        return stats
+    
+    def bloomStats( self ):
+        return self.nbs.bloomStats()
         
         	
     def bestMatch( self, document, threshold = -0.01 ):
@@ -263,13 +1151,280 @@ class NaiveBayesian:
 
             The score of the match is stored in $this->last_score for reference
 
+            With a result cache (result_cache_size), the match is kept for the
+            tokens of the document and the threshold, so a document with the
+            same tokens as one already classified isn't scored again until the
+            model changes.
+
             @return string|bool best match category (no 
             @param string document
             @param float threshold for returning a match default is -0.01 (ie no threshold)
         '''
         document = self._cleanString( document )
         self.last_score = None
-        scores = self.categorize( document )
+        if self.results is None:
+            matches = self.topMatches( document, 1, threshold )
+            if matches:
+                return matches[0]
+            return False
+        
+        tokens = self._getKeyTokens( document )
+        key = ( threshold, frozenset( tokens.iteritems() ) )
+        match = self.results.get( key, _missing )
+        if match is _missing:
+            match = self._bestOfMany( [tokens], threshold )[0]
+            self.results[key] = match
+        return match
+
+    def _getKeyTokens( self, document ):
+        ''' get the tokens of a clean document the way the classifier scores
+        them: token ids of the vectorized engine, or tokens.
+            @return array keys = tokens or token ids, values = counts
+        '''
+        if self.vectorized:
+            self._getEngine()
+            return self._getTokenizer().tokenize_ids( document )
+        return self._getTokens( document )
+
+    def _bestOfMany( self, tokens, threshold ):
+        ''' get the best match of documents given as tokens from _getKeyTokens().
+        The counts of every token are fetched in one go.
+            @return list of (category, score) or False if no score reaches the threshold
+        '''
+        instruments = self.instruments
+        if self.vectorized:
+            if instruments.enabled:
+                start = instruments.clock()
+            scores = self._getEngine().score_many_ids( tokens )
+            if instruments.enabled:
+                instruments.add( 'score', instruments.clock() - start, len(tokens) )
+            return [self._bestOf( self._rescale( s ), threshold ) for s in scores]
+        words = set()
+        for t in tokens:
+            words.update( t )
+        if instruments.enabled:
+            start = instruments.clock()
+        counts = self.nbs.getWordCounts( words )
+        if instruments.enabled:
+            instruments.add( 'lookup', instruments.clock() - start )
+        return [self._bestOfTokens( t, threshold, counts ) for t in tokens]
+
+    def topMatches( self, document, k = 1, threshold = -0.01 ):
+        ''' get the k best matches for a doc.
+        The same as the first k categories from categorize() with a score
+        above the threshold, but categories that can't make the top k are
+        not scored in full (see _topOf()).
+
+            @return list of (category, score), best first
+            @param string document
+            @param int number of matches
+            @param float threshold for returning a match
+        '''
+        if self.vectorized:
+            scores = self.categorize( document )
+            return [(cat, scores[cat]) for cat in scores.keys()[:k] if scores[cat] >= threshold]
+        return self._topOf( self._getTokens( document ), k, threshold )
+
+    def _topOf( self, tokens, k, threshold, words = None ):
+        ''' get the k best matches of a document given as tokens.
+
+        An upper bound of the score in each category is worked out in log
+        space from the counts of the document's tokens, which only costs a
+        step for each (token, category) with a count. The categories are then
+        scored in full, highest bound first, until the next bound is below the
+        k-th best score: the rest can't make the top k. The scores of the top
+        k are rescaled as _rescale() does, which is exact as long as the
+        categories left out would all add the same amount to the total.
+        Otherwise, or if a score could overflow, every category is scored.
+
+            @see topMatches()
+            @return list of (category, score), best first
+            @param array tokens (keys = tokens, values = counts)
+            @param int number of matches
+            @param float threshold for returning a match
+            @param array counts of the tokens from getWordCounts(), fetched if not given
+        '''
+        categories = self.nbs.getCategories()
+        instruments = self.instruments
+        if words is None:
+            if instruments.enabled:
+                start = instruments.clock()
+            words = self.nbs.getWordCounts( tokens.keys() )
+            if instruments.enabled:
+                instruments.add( 'lookup', instruments.clock() - start )
+        if instruments.enabled:
+            start = instruments.clock()
+
+        total_words = 0
+        ncat = 0
+        # the categories in the order categorize() holds the scores in
+        order = dict.fromkeys( categories )
+        for category in categories:
+            total_words += categories[category]['word_count']
+            ncat += 1
+        if ncat == 0:
+            return []
+        scale = total_words/ncat
+
+        known = [(token, tokens[token]) for token in tokens if token in words]
+        length = sum( [count for token, count in known] )
+        pruned = []
+        exact = {}
+        upper = {}
+        if( k < ncat and ncat >= self.prune_min_categories and scale > 0 and length > 0 and
+            max( [count for token, count in known] )*math.log( scale ) < 700 ):
+            log_scale = math.log( scale )
+
+            # log of the factor of a token not in the category, and the bound so far
+            unseen = {}
+            upper = {}
+            # word counts of the categories that can be bound
+            totals = {}
+            log = math.log
+            for category in categories:
+                data = categories[category]
+                if data['probability'] <= 0 or data['word_count'] <= 0:
+                    upper[category] = float('inf')
+                    continue
+                totals[category] = data['word_count']
+                unseen[category] = log_scale - log( (data['word_count']+1)*20000.0 )
+                upper[category] = log( data['probability'] )
+            max_unseen = max( unseen.itervalues() ) if unseen else 0.0
+            magnitude = max( [abs(upper[category]) for category in unseen] or [0.0] ) + length
+            # log of the largest a score can get while it is worked out
+            peak = 0.0
+
+            rare = 0
+            common = 0.0
+            for token, count in known:
+                postings = words[token]
+                if len(postings) > self.prune_max_postings:
+                    # a token in many categories is bound by its best factor in any category
+                    highest = max( [float(word_count) / totals[category]
+                                    for category, word_count in postings.iteritems()
+                                    if word_count > 0 and category in totals] or [0.0] )
+                    factor = max_unseen
+                    if highest > 0:
+                        factor = max( factor, math.log( highest ) + log_scale )
+                    common += count*factor
+                    magnitude += count*abs(factor)
+                    peak += count*max( factor, 0.0 )
+                else:
+                    # a token in few categories is counted exactly
+                    rare += count
+                    factor = max_unseen
+                    for category, word_count in postings.iteritems():
+                        if word_count > 0 and category in totals:
+                            seen = log( float(word_count) / totals[category] ) + log_scale
+                            upper[category] += count*(seen - unseen[category])
+                            magnitude += count*(abs(seen) + abs(unseen[category]))
+                            factor = max( factor, seen )
+                    peak += count*max( factor, 0.0 )
+            magnitude += rare*max( [abs(value) for value in unseen.itervalues()] or [0.0] )
+
+            # allow for rounding, and give up if a score could overflow
+            margin = 1e-9*(magnitude+1)
+            if upper and peak + margin < 700:
+                for category in unseen:
+                    upper[category] += rare*unseen[category] + common + margin
+            else:
+                upper = {}
+
+        if upper:
+            ranked = sorted( upper, key=upper.get, reverse=True )
+            best = []
+            for i, category in enumerate(ranked):
+                if len(best) == k and 1e-300 <= best[0] < float('inf') and upper[category] < math.log( best[0] ):
+                    pruned = ranked[i:]
+                    break
+                score = self._scoreCategory( category, categories[category], tokens, words, scale )
+                exact[category] = score
+                if len(best) < k:
+                    heapq.heappush( best, score )
+                elif score > best[0]:
+                    heapq.heapreplace( best, score )
+
+        if pruned:
+            if instruments.enabled:
+                instruments.add( 'score', instruments.clock() - start )
+                start = instruments.clock()
+            matches = self._rescaleTop( [(category, exact[category]) for category in order if category in exact],
+                                        [math.exp( upper[category] ) for category in pruned], k )
+            if instruments.enabled:
+                instruments.add( 'rescale', instruments.clock() - start )
+                start = instruments.clock()
+            if matches is not None:
+                return [(category, score) for category, score in matches if score >= threshold]
+
+        # score every category
+        scores = {}
+        for category in order:
+            if category in exact:
+                scores[category] = exact[category]
+            else:
+                scores[category] = self._scoreCategory( category, categories[category], tokens, words, scale )
+        if instruments.enabled:
+            instruments.add( 'score', instruments.clock() - start )
+        scores = self._rescale( scores )
+        return [(cat, scores[cat]) for cat in scores.keys()[:k] if scores[cat] >= threshold]
+
+    def _rescaleTop( self, scores, bounds, k ):
+        ''' rescale the top k scores when only some of the categories were scored.
+        The same as the first k results of _rescale(), if the categories that
+        were not scored all add the same amount to its total.
+
+            @see _rescale()
+            @return list of (category, score), best first, None if they can't be worked out exactly
+            @param list of (category, score) of the scored categories, in the order categorize() holds them
+            @param list of upper bounds of the scores of the other categories
+            @param int number of matches
+        '''
+        scores = sorted( scores, key=lambda t: t[1], reverse=True )
+        top = 0.0
+        if scores[0][1] >= top:
+            top = scores[0][1]
+
+        # what each category that was not scored adds to the total, which
+        # grows with the score so it is the same for all if it is the same
+        # for a score of 0 and for the highest bound
+        highest = max( bounds )
+        rest = pow( math.exp( 0.0 - top ), 2 )
+        if pow( math.exp( max( highest, 0.0 ) - top ), 2 ) != rest:
+            return None
+
+        # the scores above every bound come first, and all the others add the same
+        total = 0.0
+        others = len(bounds)
+        for category, score in scores:
+            if score > highest:
+                total += pow( math.exp( score - top ), 2 )
+            elif pow( math.exp( score - top ), 2 ) == rest:
+                others += 1
+            else:
+                return None
+        for i in xrange(others):
+            total += rest
+
+        total = math.sqrt( total )
+        return [(category, math.exp( score - top )/total) for category, score in scores[:k]]
+
+    def _bestOfTokens( self, tokens, threshold, words ):
+        ''' get the best match of a document given as tokens.
+            @see bestMatch()
+            @return tuple (category, score) or False if no score reaches the threshold
+        '''
+        matches = self._topOf( tokens, 1, threshold, words )
+        if matches:
+            return matches[0]
+        return False
+
+    def _bestOf( self, scores, threshold ):
+        ''' get the best match from the scores of a document.
+            @see bestMatch()
+            @return tuple (category, score) or False if no score reaches the threshold
+            @param array scores from categorize()
+            @param float threshold for returning a match
+        '''
         options = 0
         best_match = False
         for cat in scores:
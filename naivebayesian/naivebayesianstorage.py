@@ -1,73 +1,288 @@
+import os
 import re
-import sqlite3
+import sys
+import zlib
+from lrucache import LRUCache
+from bloomfilter import BloomFilter
+from instrumentation import NullInstrumentation
+from backends import getBackend, ConnectionPool
+
+def packTokens( tokens ):
+    ''' encode the token counts of a reference compactly: the tokens, each
+    followed by ":count" if it is more than 1, separated by spaces and
+    compressed with zlib. Tokens never hold spaces (see Tokenizer).
+
+        @return string encoded counts
+        @param  array keys = tokens, values = counts
+    '''
+    text = u" ".join( [token if count == 1 else u"%s:%d" % (token, count) for token, count in sorted( tokens.iteritems() )] )
+    return zlib.compress( text.encode( 'utf-8' ) )
+
+def unpackTokens( data ):
+    ''' decode token counts encoded by packTokens().
+        @return array keys = tokens, values = counts
+        @param  string encoded counts
+    '''
+    tokens = {}
+    for item in zlib.decompress( str(data) ).decode( 'utf-8' ).split():
+        token, sep, count = item.rpartition( ':' )
+        if sep:
+            tokens[token] = int(count)
+        else:
+            tokens[item] = 1
+    return tokens
 
 class NaiveBayesianStorage:
     ''' Access to the storage of the data for the filter.
 
     To avoid dependency with respect to any database, this class handle all the
     access to the data storage. You can provide your own class as long as
-    all the methods are available. The current one rely on a MySQL database.
+    all the methods are available. The current one relies on an SQL database,
+    sqlite or MySQL, reached through a backend (see backends.py).
+    InMemoryNaiveBayesianStorage holds the whole model in memory instead, and
+    CompiledStorage reads a compiled model.
 
     methods:
         - array getCategories()
         - bool  wordExists(string $word)
         - array getWord(string $word, string $categoryid)
+        - array getWordCounts(list $words)
+        - iter  getWordFreqs()
+        - array getSettings()
 
-    '''
-
-    def __init__(self, dbname, user=None, pwd=None, server=None, use_sqlite=True, reset = False):
-        if use_sqlite:
-            self.con = sqlite3.connect( dbname )
-            self.dbtype = "sqlite"
-        else:
-            import MySQLdb as mdb
-            self.con = mdb.connect( server, user, pwd, dbname)
-            self.dbtype = "mysql"
-        self.category_cache = {}
-        self.word_cache = {}
-        if( self.con ):
-            if(reset):
-                self.resetTables()
-            self.createTables()
-                
-    def get_db_cursor(self):
-        '''
-        Get a database cursor
-        '''
-        if self.dbtype=="mysql":
-            cur = self.con.cursor(mdb.cursors.DictCursor)
-        else:
-            self.con.row_factory = sqlite3.Row
-            cur = self.con.cursor()
-        return cur
+    Two layouts of the tables are supported. In the v1 layout the word
+    frequencies are keyed on the word and category strings. In the v2 layout
+    (sqlite only) the words and categories are given integer ids, and the word
+    frequencies are a WITHOUT ROWID table keyed on the ids, which makes much
+    smaller and faster models. The layout of an existing model is detected when
+    it is opened; bayesian_migrate.py converts a model from one to the other.
 
-    def createTables( self ):
-        ''' Create the tables needed.
-            @return bool successs
-        '''
-        sql = []
+    '''
 
-        sql.append("""CREATE TABLE IF NOT EXISTS `categories` (
+    # max number of words or ids fetched by a single query
+    lookup_chunk_size = 500
+    # number of references read by each query of a scan of them all
+    scan_chunk_size = 10000
+    # room left in the bloom filter for words trained after it is built
+    bloom_headroom = 1.25
+
+    # the statements that depend on the layout of the tables
+    layouts = {
+        "v1": {
+            'tables': [
+                """CREATE TABLE IF NOT EXISTS `categories` (
                   category_id varchar(250) NOT NULL default '',
                   probability double NOT NULL default '0',
                   word_count bigint(20) NOT NULL default '0',
+                  doc_count bigint(20) NOT NULL default '0',
                   `description` varchar(255) DEFAULT NULL,
                   PRIMARY KEY  (category_id)
-                )""")
-
-        sql.append("""CREATE TABLE IF NOT EXISTS `references` (
+                )""",
+                """CREATE TABLE IF NOT EXISTS `references` (
                   `id` varchar(250) NOT NULL DEFAULT '',
                   `category_id` varchar(250) NOT NULL DEFAULT '',
                   `content` text NOT NULL,
+                  `tokens` blob DEFAULT NULL,
                   PRIMARY KEY (`id`)
-                )""")
-
-        sql.append("""CREATE TABLE IF NOT EXISTS `wordfreqs` (
+                )""",
+                """CREATE TABLE IF NOT EXISTS `wordfreqs` (
                   `word` varchar(250) NOT NULL DEFAULT '',
                   `category_id` varchar(250) NOT NULL DEFAULT '',
                   `count` bigint(20) NOT NULL DEFAULT '0',
                   PRIMARY KEY (`word`,`category_id`)
-                )""")
+                )""",
+                """CREATE TABLE IF NOT EXISTS `settings` (
+                  `name` varchar(250) NOT NULL DEFAULT '',
+                  `value` varchar(250) DEFAULT NULL,
+                  PRIMARY KEY (`name`)
+                )""",
+            ],
+            'word_counts': "SELECT word, category_id, count FROM wordfreqs WHERE word IN (%s)",
+            'word_freqs': "SELECT word, category_id, count FROM wordfreqs",
+            'vocabulary_size': "SELECT COUNT(DISTINCT word) AS words FROM wordfreqs",
+            'vocabulary': "SELECT DISTINCT word FROM wordfreqs",
+            'add_word': None,
+            'replace_freq': "REPLACE INTO wordfreqs (count, word, category_id) VALUES (?,?,?)",
+            'insert_freq': "INSERT OR IGNORE INTO wordfreqs (word, category_id, count) VALUES (?,?,0)",
+            'insert_count': "INSERT INTO wordfreqs (count, word, category_id) VALUES (?,?,?)",
+            'freq_key': "word, category_id",
+            'add_freq': "UPDATE wordfreqs SET count = count + ? WHERE word = ? AND category_id = ?",
+            'remove_freq': "UPDATE wordfreqs SET count = count - ? WHERE word = ? AND category_id = ?",
+            'delete_freq': "DELETE FROM wordfreqs WHERE word = ? AND category_id = ?",
+            'delete_category_freqs': "DELETE FROM wordfreqs WHERE category_id = ?",
+            'category_totals': "SELECT category_id, SUM(count) AS total FROM wordfreqs GROUP BY category_id",
+        },
+        "v2": {
+            'tables': [
+                """CREATE TABLE IF NOT EXISTS `categories` (
+                  cat_id INTEGER PRIMARY KEY,
+                  category_id varchar(250) NOT NULL UNIQUE,
+                  probability double NOT NULL default '0',
+                  word_count bigint(20) NOT NULL default '0',
+                  doc_count bigint(20) NOT NULL default '0',
+                  `description` varchar(255) DEFAULT NULL
+                )""",
+                """CREATE TABLE IF NOT EXISTS `references` (
+                  `id` varchar(250) NOT NULL DEFAULT '',
+                  `category_id` varchar(250) NOT NULL DEFAULT '',
+                  `content` text NOT NULL,
+                  `tokens` blob DEFAULT NULL,
+                  PRIMARY KEY (`id`)
+                )""",
+                """CREATE TABLE IF NOT EXISTS `vocabulary` (
+                  word_id INTEGER PRIMARY KEY,
+                  word varchar(250) NOT NULL UNIQUE
+                )""",
+                """CREATE TABLE IF NOT EXISTS `wordfreqs` (
+                  word_id INTEGER NOT NULL,
+                  cat_id INTEGER NOT NULL,
+                  `count` bigint(20) NOT NULL DEFAULT '0',
+                  PRIMARY KEY (word_id, cat_id)
+                ) WITHOUT ROWID""",
+                "CREATE INDEX IF NOT EXISTS wordfreqs_category ON wordfreqs (cat_id)",
+                "CREATE INDEX IF NOT EXISTS references_category ON `references` (category_id)",
+                """CREATE TABLE IF NOT EXISTS `settings` (
+                  `name` varchar(250) NOT NULL DEFAULT '',
+                  `value` varchar(250) DEFAULT NULL,
+                  PRIMARY KEY (`name`)
+                )""",
+            ],
+            'word_counts': """SELECT v.word AS word, c.category_id AS category_id, f.count AS count
+                FROM vocabulary v JOIN wordfreqs f ON f.word_id = v.word_id JOIN categories c ON c.cat_id = f.cat_id
+                WHERE v.word IN (%s)""",
+            'word_freqs': """SELECT v.word AS word, c.category_id AS category_id, f.count AS count
+                FROM wordfreqs f JOIN vocabulary v ON v.word_id = f.word_id JOIN categories c ON c.cat_id = f.cat_id""",
+            'vocabulary_size': "SELECT COUNT(*) AS words FROM vocabulary",
+            'vocabulary': "SELECT word FROM vocabulary",
+            'add_word': "INSERT OR IGNORE INTO vocabulary (word) VALUES (?)",
+            'replace_freq': """REPLACE INTO wordfreqs (word_id, cat_id, count)
+                SELECT v.word_id, c.cat_id, ? FROM vocabulary v, categories c WHERE v.word = ? AND c.category_id = ?""",
+            'insert_freq': """INSERT OR IGNORE INTO wordfreqs (word_id, cat_id, count)
+                SELECT v.word_id, c.cat_id, 0 FROM vocabulary v, categories c WHERE v.word = ? AND c.category_id = ?""",
+            'insert_count': """INSERT INTO wordfreqs (word_id, cat_id, count)
+                SELECT v.word_id, c.cat_id, ? FROM vocabulary v, categories c WHERE v.word = ? AND c.category_id = ?""",
+            'freq_key': "word_id, cat_id",
+            'add_freq': """UPDATE wordfreqs SET count = count + ?
+                WHERE word_id = (SELECT word_id FROM vocabulary WHERE word = ?)
+                AND cat_id = (SELECT cat_id FROM categories WHERE category_id = ?)""",
+            'remove_freq': """UPDATE wordfreqs SET count = count - ?
+                WHERE word_id = (SELECT word_id FROM vocabulary WHERE word = ?)
+                AND cat_id = (SELECT cat_id FROM categories WHERE category_id = ?)""",
+            'delete_freq': """DELETE FROM wordfreqs
+                WHERE word_id = (SELECT word_id FROM vocabulary WHERE word = ?)
+                AND cat_id = (SELECT cat_id FROM categories WHERE category_id = ?)""",
+            'delete_category_freqs': "DELETE FROM wordfreqs WHERE cat_id = (SELECT cat_id FROM categories WHERE category_id = ?)",
+            'category_totals': """SELECT c.category_id AS category_id, SUM(f.count) AS total
+                FROM wordfreqs f JOIN categories c ON c.cat_id = f.cat_id GROUP BY f.cat_id""",
+        },
+    }
+
+    # pragmas used when serving a model read only (see Backend.configure())
+    read_only_profile = {
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+        'query_only': 1,
+    }
+    # counters of the statements run (see Instrumentation), set by the classifier
+    instruments = NullInstrumentation()
+
+    def __init__(self, dbname, user=None, pwd=None, server=None, use_sqlite=True, reset = False, cache_size = 100000,
+                 bloom_filter = False, bloom_error_rate = 0.01, bloom_max_bytes = None, layout = None,
+                 read_only = False, profile = None, backend = None, pool_size = 1):
+        self.read_only = read_only
+        # the database, by the name of a registered backend (see backends.py)
+        if backend is None:
+            backend = "sqlite" if use_sqlite else "mysql"
+        self.backend = getBackend( backend )( dbname, user=user, pwd=pwd, server=server,
+                                              read_only=read_only, shared=pool_size > 1 )
+        self.dbtype = self.backend.name
+        if read_only:
+            profile = dict( self.read_only_profile, **(profile or {}) )
+        # the connections of the threads using the model
+        self.pool = ConnectionPool( self.backend, pool_size, profile )
+        self.dbname = dbname
+        self.category_cache = {}
+        # counts of the most recently used words, {} for unknown words
+        self.word_cache = LRUCache( cache_size )
+        if( self.con ):
+            if(reset and not read_only):
+                self.resetTables()
+            self.layout = self.detectLayout( layout )
+            self.sql = self.layouts[self.layout]
+            if not read_only:
+                self.createTables()
+
+        # bloom filter of the vocabulary, saved next to an sqlite model
+        self.bloom = None
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom_max_bytes = bloom_max_bytes
+        self.bloom_file = None
+        if self.dbtype=="sqlite" and dbname!=":memory:":
+            self.bloom_file = dbname + ".bloom"
+        if bloom_filter:
+            self.loadBloomFilter()
+
+    @property
+    def con( self ):
+        ''' the connection of the current thread (see ConnectionPool) '''
+        return self.pool.connection()
+
+    def get_db_cursor(self):
+        '''
+        Get a database cursor
+        '''
+        return self.instruments.cursor( self.backend.cursor( self.con ) )
+
+    def commit( self ):
+        ''' commit the current transaction, counted as a statement of the
+        method committing it when instrumented.
+        '''
+        if not self.instruments.enabled:
+            return self.con.commit()
+        start = self.instruments.clock()
+        self.con.commit()
+        self.instruments.addStatement( sys._getframe(1).f_code.co_name, self.instruments.clock() - start )
+
+    def release( self ):
+        ''' give the connection of the current thread back to the pool, for
+        a thread that is done with the model.
+        '''
+        self.pool.release()
+
+    def close( self ):
+        ''' close every connection to the model '''
+        self.pool.close()
+
+    def detectLayout( self, layout = None ):
+        ''' find the layout of the tables of the model.
+        A new model gets the layout asked for, v1 by default.
+
+            @return string layout ("v1" or "v2")
+            @param  string layout asked for, None to use the one of the model
+        '''
+        if layout is not None and layout not in self.layouts:
+            raise ValueError( "unknown layout %s" % layout )
+        if layout is not None and layout not in self.backend.layouts:
+            raise ValueError( "the %s layout can't be used with %s" % (layout, self.backend.name) )
+
+        tables = self.backend.tables( self.get_db_cursor() )
+        if 'vocabulary' in tables:
+            found = "v2"
+        elif 'wordfreqs' in tables:
+            found = "v1"
+        else:
+            return layout or "v1"
+
+        if layout is not None and layout != found:
+            raise ValueError( "%s uses the %s layout, not %s (see bayesian_migrate.py)" % (self.dbname, found, layout) )
+        return found
+
+    def createTables( self ):
+        ''' Create the tables needed.
+            @return bool successs
+        '''
+        sql = self.sql['tables']
 
         successCount = 0
 
@@ -77,7 +292,18 @@ class NaiveBayesianStorage:
             if( cur.execute( s ) ):
                 successCount += 1
 
-        if(successCount==3):
+        # models made before the document counts were kept get the column,
+        # and their totals are counted once
+        cur = self.get_db_cursor()
+        cur.execute( "SELECT * FROM categories LIMIT 0" )
+        if 'doc_count' not in [column[0] for column in cur.description]:
+            cur.execute( "ALTER TABLE categories ADD COLUMN doc_count bigint(20) NOT NULL default '0'" )
+            self.verifyCategories()
+        # and before the tokens of the references were kept
+        if not self.hasReferenceTokens():
+            cur.execute( "ALTER TABLE `references` ADD COLUMN `tokens` blob DEFAULT NULL" )
+
+        if(successCount==len(sql)):
             return True
 
         return False
@@ -91,6 +317,8 @@ class NaiveBayesianStorage:
         sql.append("""DROP TABLE IF EXISTS `categories`""")
         sql.append("""DROP TABLE IF EXISTS `references`""")
         sql.append("""DROP TABLE IF EXISTS `wordfreqs`""")
+        sql.append("""DROP TABLE IF EXISTS `vocabulary`""")
+        sql.append("""DROP TABLE IF EXISTS `settings`""")
 
         successCount = 0
 
@@ -100,14 +328,91 @@ class NaiveBayesianStorage:
             if( cur.execute( s ) ):
                 successCount += 1
 
-        if(successCount==3):
+        if(successCount==len(sql)):
             return True
 
         return False
 
+    def copyModel( self, source, source_layout ):
+        ''' copy all the data of another sqlite model into this one, which
+        should be empty. The data are copied by sqlite itself, so this is the
+        quick way to move a model from one layout to the other.
+
+            @return bool success
+            @param  string file name of the model to copy
+            @param  string layout of the model to copy
+        '''
+        if self.dbtype!="sqlite":
+            raise ValueError( "only sqlite models can be copied" )
+        cur = self.get_db_cursor()
+        cur.execute( "ATTACH DATABASE ? AS source", (source,) )
+        try:
+            # models made before the document counts were kept have them counted once copied
+            cur.execute( "SELECT * FROM source.categories LIMIT 0" )
+            doc_counts = 'doc_count' in [column[0] for column in cur.description]
+            cur.execute( """INSERT OR IGNORE INTO categories (category_id, probability, word_count, doc_count, description)
+                SELECT category_id, probability, word_count, %s, description FROM source.categories""" % ( "doc_count" if doc_counts else "0" ) )
+            cur.execute( "SELECT * FROM source.`references` LIMIT 0" )
+            tokens = "tokens" if 'tokens' in [column[0] for column in cur.description] else "NULL"
+            cur.execute( """INSERT INTO `references` (id, category_id, content, tokens)
+                SELECT id, category_id, content, %s FROM source.`references`""" % tokens )
+
+            if source_layout == "v2":
+                freqs = """SELECT v.word AS word, c.category_id AS category_id, f.count AS count
+                    FROM source.wordfreqs f JOIN source.vocabulary v ON v.word_id = f.word_id
+                    JOIN source.categories c ON c.cat_id = f.cat_id"""
+            else:
+                freqs = "SELECT word, category_id, count FROM source.wordfreqs"
+
+            if self.layout == "v2":
+                cur.execute( "INSERT OR IGNORE INTO categories (category_id, description) SELECT DISTINCT category_id, category_id FROM (%s)" % freqs )
+                cur.execute( "INSERT OR IGNORE INTO vocabulary (word) SELECT DISTINCT word FROM (%s) ORDER BY word" % freqs )
+                cur.execute( """INSERT INTO wordfreqs (word_id, cat_id, count)
+                    SELECT v.word_id, c.cat_id, f.count FROM (%s) f
+                    JOIN vocabulary v ON v.word = f.word JOIN categories c ON c.category_id = f.category_id""" % freqs )
+            else:
+                cur.execute( "INSERT INTO wordfreqs (word, category_id, count) SELECT word, category_id, count FROM (%s)" % freqs )
+
+            cur.execute( "SELECT name FROM source.sqlite_master WHERE type = 'table' AND name = 'settings'" )
+            if cur.fetchone():
+                cur.execute( "INSERT OR REPLACE INTO settings (name, value) SELECT name, value FROM source.settings" )
+            self.commit()
+        finally:
+            cur.execute( "DETACH DATABASE source" )
+        self.category_cache = {}
+        self.word_cache.clear()
+        if not doc_counts:
+            self.verifyCategories()
+        return True
+
+    def getSettings( self ):
+        ''' get the settings the model was made with, such as the number of
+        buckets tokens are hashed into.
+
+            @return array keys = names, values = values (strings)
+        '''
+        cur = self.get_db_cursor()
+        try:
+            cur.execute( "SELECT name, value FROM settings" )
+        except self.backend.errors:
+            # a model made before settings were kept, opened read only
+            return {}
+        return dict( [(row['name'], row['value']) for row in cur.fetchall()] )
+
+    def saveSetting( self, name, value ):
+        ''' save a setting of the model.
+            @return bool success
+            @param  string name
+            @param  string value
+        '''
+        cur = self.get_db_cursor()
+        cur.execute( "REPLACE INTO settings (name, value) VALUES (?,?)", (name, value) )
+        self.commit()
+        return True
+
     def getCategories( self ):
         ''' get the list of categories with basic data.
-            @return array key = category ids, values = array(keys = 'probability', 'word_count', 'description')
+            @return array key = category ids, values = array(keys = 'probability', 'word_count', 'doc_count', 'description')
         '''
         if self.category_cache:
             return self.category_cache
@@ -122,6 +427,7 @@ class NaiveBayesianStorage:
                 self.category_cache[row['category_id']] = {
                         'probability': row['probability'],
                         'word_count': row['word_count'],
+                        'doc_count': row['doc_count'] if 'doc_count' in row.keys() else None,
                         'description': row['description']
                     }
 
@@ -132,14 +438,7 @@ class NaiveBayesianStorage:
             @return bool
             @param string word
         '''
-        if word in self.word_cache:
-            return True
-        else:
-            cur = self.get_db_cursor()
-            sql = "SELECT * FROM wordfreqs WHERE word=?"
-            cur.execute( sql, (word,) )
-            results = cur.fetchall()
-            return len(results)>0
+        return word in self.getWordCounts( [word] )
 
     def getWord( self, word, category_id):
         ''' get details of a word in a category.
@@ -147,22 +446,126 @@ class NaiveBayesianStorage:
             @param  string word
             @param  string category id
         '''
-        if self.word_cache.get(word, {}).has_key(category_id):
-            return self.word_cache[word][category_id]
-        else:
-            self.word_cache[word] = {}
+        counts = self.getWordCounts( [word] )
+        return {'count': counts.get(word, {}).get(category_id, 0)}
+
+    def getWordCounts( self, words ):
+        ''' get the counts of a set of words in every category.
+        Words that are not in the cache are fetched with one query for each
+        chunk of lookup_chunk_size words, and added to the cache. Words that
+        aren't in the vocabulary are cached too, so they are only queried once,
+        and if there is a bloom filter most of them are never queried at all.
+
+            @return array keys = known words, values = array(keys = category ids, values = counts)
+            @param  list words
+        '''
+        counts = {}
+        missing = []
+        for word in set(words):
+            if self.bloom is not None and word not in self.bloom:
+                continue
+            cached = self.word_cache.get( word )
+            if cached is None:
+                missing.append( word )
+            elif cached:
+                counts[word] = cached
 
         cur = self.get_db_cursor()
-        sql = "SELECT * FROM wordfreqs WHERE word=? AND category_id=?"
-        rs = cur.execute( sql, (word,category_id) )
-        word_count = 0
-        row = cur.fetchone()
-        if(row):
-            word_count = row['count']
-            self.word_cache[word][category_id] = {'count': word_count}
-            return self.word_cache[word][category_id]
-            
-        return {'count':word_count}
+        for i in range(0, len(missing), self.lookup_chunk_size):
+            chunk = missing[i:i+self.lookup_chunk_size]
+            # pad the chunk to a power of two so only a few statements are
+            # used, and sqlite can reuse them without preparing them again
+            size = 1
+            while size < len(chunk):
+                size *= 2
+            chunk = chunk + [None]*(min(size, self.lookup_chunk_size)-len(chunk))
+            sql = self.sql['word_counts'] % ",".join( ["?"]*len(chunk) )
+            cur.execute( sql, chunk )
+            for row in cur.fetchall():
+                counts.setdefault( row['word'], {} )[row['category_id']] = row['count']
+
+        for word in missing:
+            self.word_cache[word] = counts.get( word, {} )
+        return counts
+
+    def cacheStats( self ):
+        ''' get the usage of the word cache.
+            @return array keys = 'size', 'maxsize', 'hits', 'misses', 'evictions', 'hit_rate'
+        '''
+        return self.word_cache.stats()
+
+    def loadBloomFilter( self ):
+        ''' load the bloom filter of the vocabulary.
+        The filter saved next to the model is used unless it is missing or
+        older than the model, in which case it is built again, and saved
+        unless the model is read only.
+
+            @return bool success
+        '''
+        if( self.bloom_file and os.path.exists( self.bloom_file ) and
+            os.path.getmtime( self.bloom_file ) >= os.path.getmtime( self.dbname ) ):
+            self.bloom = BloomFilter.load( self.bloom_file )
+            return True
+        self.buildBloomFilter()
+        self.saveBloomFilter()
+        return True
+
+    def buildBloomFilter( self ):
+        ''' build the bloom filter from every word in the vocabulary.
+            @return BloomFilter
+        '''
+        cur = self.get_db_cursor()
+        cur.execute( self.sql['vocabulary_size'] )
+        words = cur.fetchone()['words']
+        bloom = BloomFilter( words*self.bloom_headroom, self.bloom_error_rate, self.bloom_max_bytes )
+        cur.execute( self.sql['vocabulary'] )
+        for row in cur:
+            bloom.add( row['word'] )
+        self.bloom = bloom
+        return bloom
+
+    def updateBloomFilter( self ):
+        ''' bring the saved bloom filter up to date after training.
+        Trained words are added to the filter as they come, so it is only
+        built again once it holds more words than it was sized for.
+
+            @return bool success
+        '''
+        if self.bloom is None:
+            return False
+        if self.bloom.count > self.bloom.capacity:
+            self.buildBloomFilter()
+        return self.saveBloomFilter()
+
+    def saveBloomFilter( self ):
+        ''' save the bloom filter next to the model, unless it is read only.
+            @return bool success
+        '''
+        if self.bloom is None or not self.bloom_file or self.read_only:
+            return False
+        self.bloom.save( self.bloom_file )
+        return True
+
+    def bloomStats( self ):
+        ''' get the size and accuracy of the bloom filter.
+            @return array (see BloomFilter.stats()), None if there isn't one
+        '''
+        if self.bloom is None:
+            return None
+        return self.bloom.stats()
+
+    def getWordFreqs( self, ordered = False ):
+        ''' get every row of the word frequencies.
+            @return iterator of (word, category id, count)
+            @param  bool whether to get the rows in the order of the words
+        '''
+        cur = self.get_db_cursor()
+        sql = self.sql['word_freqs']
+        if ordered:
+            sql += " ORDER BY word, category_id"
+        cur.execute( sql )
+        for row in cur:
+            yield ( row['word'], row['category_id'], row['count'] )
 
     def updateWord( self, word, count, category_id, catname = None):
         ''' update a word in a category.
@@ -180,18 +583,74 @@ class NaiveBayesianStorage:
 
         # add the category if it's not already there
         self.addcat( category_id, catname )
+        if self.sql['add_word']:
+            cur.execute( self.sql['add_word'], (word,) )
 
         if (0 == oldWord['count']):
-            sql = "REPLACE INTO wordfreqs (word, category_id, count) VALUES (?,?,?)"
-            values = ( word, category_id, str(count) )
-            self.word_cache[word][category_id] = {'count': count}
+            sql = self.sql['replace_freq']
         else:
-            sql = "UPDATE wordfreqs SET count = count + ? WHERE category_id = ? AND word = ?"
-            values = ( str(count), category_id, word )
-            self.word_cache[word][category_id]['count'] += count
+            sql = self.sql['add_freq']
+        values = ( str(count), word, category_id )
+        if word in self.word_cache:
+            self.word_cache[word][category_id] = oldWord['count'] + count
+        if self.bloom is not None:
+            self.bloom.add( word )
 
         cur.execute( sql, values )
-        self.con.commit()
+        cur.execute( "UPDATE categories SET word_count = word_count + ? WHERE category_id = ?", (count, category_id) )
+        self.commit()
+
+    def bulkUpdate( self, wordcounts, references ):
+        ''' update many words and save many references in a single transaction.
+        The bulk version of updateWord() and saveReference().
+
+            @return bool success
+            @param  array keys = (word, category id), values = count to add
+            @param  list of (reference id, category id, content) or (reference id, category id, content, tokens)
+        '''
+        cur = self.get_db_cursor()
+
+        # add the categories that are not already there
+        categories = set( [category_id for word, category_id in wordcounts] )
+        for category_id in categories:
+            self.addcat( category_id )
+
+        if self.sql['add_word']:
+            words = set( [word for word, category_id in wordcounts if word!=""] )
+            cur.executemany( self.sql['add_word'], [(word,) for word in words] )
+        counts = [(count, word, category_id) for (word, category_id), count in wordcounts.iteritems() if word!=""]
+        # a database with upserts adds the counts in one statement per word,
+        # others insert the missing words first
+        sql = self.backend.upsert( self.sql['insert_count'], self.sql['freq_key'], "count" )
+        if sql is None:
+            cur.executemany( self.sql['insert_freq'], [(word, category_id) for count, word, category_id in counts] )
+            sql = self.sql['add_freq']
+        cur.executemany( sql, counts )
+
+        sql = "INSERT INTO `references` (id, category_id, content, tokens) VALUES (?,?,?,?)"
+        cur.executemany( sql, [reference[:3] + (self.encodeTokens( reference[3] if len(reference) > 3 else None ),)
+                               for reference in references] )
+
+        # keep the totals of the categories
+        word_totals = {}
+        for (word, category_id), count in wordcounts.iteritems():
+            if word!="":
+                word_totals[category_id] = word_totals.get( category_id, 0 ) + count
+        doc_totals = {}
+        for reference in references:
+            doc_totals[reference[1]] = doc_totals.get( reference[1], 0 ) + 1
+        sql = "UPDATE categories SET word_count = word_count + ? WHERE category_id = ?"
+        cur.executemany( sql, [(count, category_id) for category_id, count in word_totals.iteritems()] )
+        sql = "UPDATE categories SET doc_count = doc_count + ? WHERE category_id = ?"
+        cur.executemany( sql, [(count, category_id) for category_id, count in doc_totals.iteritems()] )
+        self.commit()
+
+        for (word, category_id), count in wordcounts.iteritems():
+            if word in self.word_cache:
+                self.word_cache[word][category_id] = self.word_cache[word].get( category_id, 0 ) + count
+            if self.bloom is not None:
+                self.bloom.add( word )
+        return True
 
     def removeWord( self, word, count, category_id ):
         ''' remove a word from a category.
@@ -207,59 +666,148 @@ class NaiveBayesianStorage:
         cur = self.get_db_cursor()
 
         if (0 != oldWord['count'] and 0 >= (oldWord['count']-count)):
-            sql = "DELETE FROM wordfreqs WHERE word = ? AND category_id = ?"
+            sql = self.sql['delete_freq']
             values = ( word, category_id )
-            self.word_cache[word][category_id] = {'count': 0}
+            self.word_cache.pop( word, None )
         else:
-            sql = "UPDATE wordfreqs SET count -= ? WHERE category_id = ? AND word = ?"
-            values = ( count, category_id, word )
-            self.word_cache[word][category_id]['count'] -= count
+            sql = self.sql['remove_freq']
+            values = ( count, word, category_id )
+            if word in self.word_cache:
+                self.word_cache[word][category_id] = oldWord['count'] - count
 
         cur.execute( sql, values )
+        removed = min( count, oldWord['count'] )
+        cur.execute( "UPDATE categories SET word_count = word_count - ? WHERE category_id = ?", (removed, category_id) )
+
+    def bulkRemove( self, wordcounts, doc_ids ):
+        ''' remove many words and references in a single transaction.
+        The bulk version of removeWord() and removeReference(): the counts of
+        every word are read in one go, and the rows to lower and to delete are
+        each written with one bulk statement.
 
-    def updateProbabilities( self ):
-        ''' update the probabilities of the categories and word count.
+            @return bool success
+            @param  array keys = (word, category id), values = count to remove
+            @param  list reference ids
+        '''
+        cur = self.get_db_cursor()
+        # the counts are the ones held by the word cache, which is kept up to
+        # date by changing them as the rows are
+        old = self.getWordCounts( set( [word for word, category_id in wordcounts if word!=""] ) )
+
+        lower = []
+        delete = []
+        word_totals = {}
+        for (word, category_id), count in wordcounts.iteritems():
+            counts = old.get( word )
+            if not counts or not counts.get( category_id ):
+                continue
+            if counts[category_id] - count <= 0:
+                delete.append( (word, category_id) )
+                removed = counts[category_id]
+                del counts[category_id]
+            else:
+                lower.append( (count, word, category_id) )
+                removed = count
+                counts[category_id] -= count
+            word_totals[category_id] = word_totals.get( category_id, 0 ) + removed
+        cur.executemany( self.sql['delete_freq'], delete )
+        cur.executemany( self.sql['remove_freq'], lower )
+        sql = "UPDATE categories SET word_count = word_count - ? WHERE category_id = ?"
+        cur.executemany( sql, [(count, category_id) for category_id, count in word_totals.iteritems()] )
+
+        sql = "UPDATE categories SET doc_count = doc_count - 1 WHERE category_id = (SELECT category_id FROM `references` WHERE id = ?)"
+        cur.executemany( sql, [(doc_id,) for doc_id in doc_ids] )
+        cur.executemany( "DELETE FROM `references` WHERE id = ?", [(doc_id,) for doc_id in doc_ids] )
+        self.commit()
+        return True
+
+    def updateProbabilities( self, verify = False ):
+        ''' update the probabilities of the categories.
         This function must be run after a set of training
 
+        The word count of each category is kept up to date by the training, so
+        only the categories are read. With verify the totals are first counted
+        again from the word frequencies and references.
+
             @return bool sucess
+            @param  bool whether to count the totals again
         '''
-        # first update the word count of each category
+        if verify:
+            self.verifyCategories()
+
         cur = self.get_db_cursor()
-        sql = "SELECT category_id, SUM(count) AS total FROM wordfreqs WHERE 1 GROUP BY category_id"
+        sql = "SELECT category_id, word_count FROM categories"
         rs = cur.execute( sql )
         rows = cur.fetchall()
-        
-        print rows
 
         total_words = 0
 
         for row in rows:
-            total_words += row['total']
+            total_words += row['word_count']
 
         if (total_words == 0):
-            sql = "UPDATE categories SET word_count=0, probability=0 WHERE 1"
-            return True
-
-        for row in rows:
-            proba = float(row['total']) / float(total_words)
-            row_sql = "UPDATE categories SET word_count = ?, probability= ? WHERE category_id = ?"
-            row_query = cur.execute( row_sql, (row["total"],proba, row["category_id"]) )
-            self.con.commit()
+            sql = "UPDATE categories SET probability=0"
+            cur.execute( sql )
+        else:
+            sql = "UPDATE categories SET probability = ? WHERE category_id = ?"
+            cur.executemany( sql, [(float(row['word_count']) / float(total_words), row['category_id']) for row in rows] )
+        self.commit()
+        self.category_cache = {}
 
+        self.updateBloomFilter()
         return True
 
-    def saveReference( self, doc_id, category_id, content):
+    def verifyCategories( self ):
+        ''' count the word and document totals of every category from the
+        word frequencies and references, and fix the ones that have drifted.
+
+            @return array keys = category ids, values = array(keys = 'word_count', 'doc_count', values = (kept total, counted total)) for the categories that had drifted
+        '''
+        cur = self.get_db_cursor()
+        cur.execute( "SELECT category_id, word_count, doc_count FROM categories" )
+        kept = {}
+        for row in cur.fetchall():
+            kept[row['category_id']] = ( row['word_count'], row['doc_count'] )
+
+        cur.execute( self.sql['category_totals'] )
+        word_totals = {}
+        for row in cur.fetchall():
+            word_totals[row['category_id']] = row['total']
+
+        cur.execute( "SELECT category_id, COUNT(*) AS total FROM `references` GROUP BY category_id" )
+        doc_totals = {}
+        for row in cur.fetchall():
+            doc_totals[row['category_id']] = row['total']
+
+        drift = {}
+        for category_id, (word_count, doc_count) in kept.iteritems():
+            counted = ( word_totals.get( category_id, 0 ), doc_totals.get( category_id, 0 ) )
+            if counted != (word_count, doc_count):
+                drift[category_id] = {
+                        'word_count': (word_count, counted[0]),
+                        'doc_count': (doc_count, counted[1])
+                    }
+
+        sql = "UPDATE categories SET word_count = ?, doc_count = ? WHERE category_id = ?"
+        cur.executemany( sql, [(totals['word_count'][1], totals['doc_count'][1], category_id) for category_id, totals in drift.iteritems()] )
+        self.commit()
+        self.category_cache = {}
+        return drift
+
+    def saveReference( self, doc_id, category_id, content, tokens = None):
         ''' save a reference in the database.
 
             @return bool success
             @param  string reference if, must be unique
             @param  string category id
             @param  string content of the reference
+            @param  array token counts of the content, kept so it needn't be tokenized again
         '''
-        sql = "INSERT INTO `references` (id, category_id, content) VALUES (?,?,?)"
+        sql = "INSERT INTO `references` (id, category_id, content, tokens) VALUES (?,?,?,?)"
         cur = self.get_db_cursor()
-        cur.execute( sql, (doc_id,category_id, content) )
-        self.con.commit()
+        cur.execute( sql, (doc_id,category_id, content, self.encodeTokens( tokens )) )
+        cur.execute( "UPDATE categories SET doc_count = doc_count + 1 WHERE category_id = ?", (category_id,) )
+        self.commit()
 
     def getReference( self, doc_id):
         ''' get a reference from the database.
@@ -276,6 +824,125 @@ class NaiveBayesianStorage:
 
         return cur.fetchone()
 
+    def getReferences( self ):
+        ''' get every reference.
+            @return iterator of (reference id, category id, content)
+        '''
+        cur = self.get_db_cursor()
+        cur.execute( "SELECT id, category_id, content FROM `references`" )
+        for row in cur:
+            yield ( row['id'], row['category_id'], row['content'] )
+
+    def getReferenceIds( self, doc_ids ):
+        ''' find which of a set of ids are already references.
+            @return set ids found in the references
+            @param  list ids
+        '''
+        doc_ids = list(doc_ids)
+        found = set()
+        cur = self.get_db_cursor()
+        for i in range(0, len(doc_ids), self.lookup_chunk_size):
+            chunk = doc_ids[i:i+self.lookup_chunk_size]
+            sql = "SELECT id FROM `references` WHERE id IN (%s)" % ",".join( ["?"]*len(chunk) )
+            cur.execute( sql, chunk )
+            for row in cur.fetchall():
+                found.add( row['id'] )
+        return found
+
+    def hasReferenceTokens( self ):
+        ''' see if the references table has the column of their tokens.
+            @return bool
+        '''
+        cur = self.get_db_cursor()
+        cur.execute( "SELECT * FROM `references` LIMIT 0" )
+        return 'tokens' in [column[0] for column in cur.description]
+
+    def encodeTokens( self, tokens ):
+        ''' encode token counts to be saved with a reference (see packTokens()).
+            @return the value of the tokens column, None if there are no tokens
+        '''
+        if tokens is None:
+            return None
+        return self.backend.binary( packTokens( tokens ) )
+
+    def getReferenceTokens( self, doc_ids = None ):
+        ''' get references with the token counts saved with them.
+        Every reference is read a chunk at a time, in the order of the ids, so
+        no query is left open while they are used.
+
+            @return iterator of (reference id, category id, content, tokens), tokens = array or None if they weren't saved
+            @param  list ids of the references, every reference by default
+        '''
+        columns = "id, category_id, content, %s AS tokens" % ( "tokens" if self.hasReferenceTokens() else "NULL" )
+        cur = self.get_db_cursor()
+        if doc_ids is not None:
+            doc_ids = list(doc_ids)
+            for i in range(0, len(doc_ids), self.lookup_chunk_size):
+                chunk = doc_ids[i:i+self.lookup_chunk_size]
+                sql = "SELECT %s FROM `references` WHERE id IN (%s)" % ( columns, ",".join( ["?"]*len(chunk) ) )
+                cur.execute( sql, chunk )
+                for row in cur.fetchall():
+                    yield self.referenceTokens( row )
+            return
+
+        cur.execute( "SELECT %s FROM `references` ORDER BY id LIMIT ?" % columns, (self.scan_chunk_size,) )
+        rows = cur.fetchall()
+        while rows:
+            for row in rows:
+                yield self.referenceTokens( row )
+            if len(rows) < self.scan_chunk_size:
+                break
+            cur.execute( "SELECT %s FROM `references` WHERE id > ? ORDER BY id LIMIT ?" % columns, (rows[-1]['id'], self.scan_chunk_size) )
+            rows = cur.fetchall()
+
+    def referenceTokens( self, row ):
+        ''' read a row of getReferenceTokens().
+            @return tuple (reference id, category id, content, tokens)
+        '''
+        tokens = unpackTokens( row['tokens'] ) if row['tokens'] is not None else None
+        return ( row['id'], row['category_id'], row['content'], tokens )
+
+    def saveReferenceTokens( self, tokens ):
+        ''' save the token counts of references. They are written in the
+        current transaction, which is committed by the next method that writes.
+
+            @return bool success
+            @param  list of (reference id, tokens)
+        '''
+        cur = self.get_db_cursor()
+        sql = "UPDATE `references` SET tokens = ? WHERE id = ?"
+        cur.executemany( sql, [(self.encodeTokens( counts ), doc_id) for doc_id, counts in tokens] )
+        return True
+
+    def replaceCounts( self, wordcounts, totals ):
+        ''' replace every word frequency and the totals of the categories, in
+        a single transaction.
+
+            @return bool success
+            @param  array keys = (word, category id), values = count
+            @param  array keys = category ids, values = (word count, document count)
+        '''
+        cur = self.get_db_cursor()
+        cur.execute( "DELETE FROM wordfreqs" )
+        if self.layout == "v2":
+            cur.execute( "DELETE FROM vocabulary" )
+        for category_id in totals:
+            self.addcat( category_id )
+        if self.sql['add_word']:
+            words = set( [word for word, category_id in wordcounts if word!=""] )
+            cur.executemany( self.sql['add_word'], [(word,) for word in sorted( words )] )
+        self.backend.bulkLoad( cur, self.sql['insert_count'], [(count, word, category_id) for (word, category_id), count in wordcounts.iteritems()
+                                                               if word!="" and count > 0] )
+        cur.execute( "UPDATE categories SET word_count = 0, doc_count = 0" )
+        sql = "UPDATE categories SET word_count = ?, doc_count = ? WHERE category_id = ?"
+        cur.executemany( sql, [(word_count, doc_count, category_id) for category_id, (word_count, doc_count) in totals.iteritems()] )
+        self.commit()
+        self.category_cache = {}
+        self.word_cache.clear()
+        if self.bloom is not None:
+            self.buildBloomFilter()
+        return True
+
     def removeReference( self, doc_id):
         ''' remove a reference from the database
 
@@ -283,9 +950,11 @@ class NaiveBayesianStorage:
             @param  string reference id
         '''
         cur = self.get_db_cursor()
+        sql = "UPDATE categories SET doc_count = doc_count - 1 WHERE category_id = (SELECT category_id FROM `references` WHERE id = ?)"
+        cur.execute( sql, (doc_id,) )
         sql = "DELETE FROM `references` WHERE id = ?"
         rs = cur.execute( sql, (doc_id,) )
-        self.con.commit()
+        self.commit()
 
     def addcat( self, cat = False, catname = False):
         ''' add a category to the database
@@ -313,10 +982,7 @@ class NaiveBayesianStorage:
             return False
 
         cur = self.get_db_cursor()
-        if self.dbtype=="mysql":
-            sql = "INSERT IGNORE INTO categories (category_id, description) VALUES (?,?)"
-        else:
-            sql = "INSERT OR IGNORE INTO categories (category_id, description) VALUES (?,?)"
+        sql = "INSERT OR IGNORE INTO categories (category_id, description) VALUES (?,?)"
         cur.execute( sql, (cat, catname) )
 
         return True
@@ -340,10 +1006,13 @@ class NaiveBayesianStorage:
         if(len(cat)==0):
             return False
 
+        # the rows of the category go in one transaction, committed with the
+        # probabilities of the categories left
         cur = self.get_db_cursor()
-        cur.execute("DELETE FROM categories WHERE category_id= ?", (cat,) )
+        cur.execute( self.sql['delete_category_freqs'], (cat,) )
         cur.execute("DELETE FROM `references` WHERE category_id= ?", (cat,) )
-        cur.execute("DELETE FROM wordfreqs  WHERE category_id= ?", (cat,) )
+        cur.execute("DELETE FROM categories WHERE category_id= ?", (cat,) )
+        self.word_cache.clear()
         self.updateProbabilities()
 
         return True
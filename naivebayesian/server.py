@@ -0,0 +1,283 @@
+import os
+import json
+import stat
+import Queue
+import threading
+import SocketServer
+from timeit import default_timer
+from naivebayesian import NaiveBayesian
+from client import parseAddress
+
+class _Request:
+    ''' texts waiting to be classified, and their results once they are '''
+
+    def __init__(self, texts, threshold, scores):
+        self.texts = texts
+        self.threshold = threshold
+        self.scores = scores
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+class Batcher( threading.Thread ):
+    ''' A thread keeping a model open and classifying the requests sent to it
+    in batches.
+
+    The first request waiting starts a batch, and the batch takes the other
+    requests that come in until it holds max_batch texts or max_wait seconds
+    have passed. The counts of the words of a whole batch are then fetched in
+    one go (see NaiveBayesian.classify_stream()). A server counts the clients
+    connected (see connect()), and a batch stops waiting once it has a request
+    from each, as no other request can come. The model is opened in the
+    thread, as a sqlite connection can only be used by the thread that opened it.
+
+        @param string database of the model
+        @param array options of the NaiveBayesian
+        @param int most texts in a batch
+        @param float most seconds a request waits for others to join its batch
+    '''
+
+    def __init__(self, database, options = None, max_batch = 64, max_wait = 0.002):
+        threading.Thread.__init__( self )
+        self.daemon = True
+        self.database = database
+        self.options = options or {}
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue.Queue()
+        self.opened = threading.Event()
+        self.error = None
+        self.nb = None
+        # number of clients that can send requests, None if not counted
+        self.clients = None
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+
+    def open( self ):
+        ''' start the thread and wait for the model to be opened.
+            @return Batcher
+        '''
+        self.start()
+        self.opened.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def classify( self, texts, threshold = -0.01, scores = False ):
+        ''' classify texts in the next batch, waiting for the results.
+            @return list of best matches (tuple or False), or of scores (list of (category, score)) if scores is set
+            @param list of string texts
+            @param float threshold for returning a match
+            @param bool whether to return the score in each category
+        '''
+        request = _Request( texts, threshold, scores )
+        self.queue.put( request )
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def connect( self ):
+        ''' count a client that can send requests '''
+        with self.lock:
+            self.clients = (self.clients or 0) + 1
+
+    def disconnect( self ):
+        ''' count a client that has gone '''
+        with self.lock:
+            self.clients -= 1
+
+    def stop( self ):
+        ''' stop the thread once the requests waiting are classified '''
+        self.queue.put( None )
+
+    def stats( self ):
+        ''' get the number of requests, batches and texts classified.
+            @return array keys = 'requests', 'batches', 'texts'
+        '''
+        return { 'requests': self.requests, 'batches': self.batches, 'texts': self.texts }
+
+    def run( self ):
+        try:
+            self.nb = NaiveBayesian( self.database, **self.options )
+            if self.nb.vectorized:
+                self.nb._getEngine()
+        except Exception as e:
+            self.error = e
+        self.opened.set()
+        if self.error is not None:
+            return
+
+        running = True
+        while running:
+            request = self.queue.get()
+            if request is None:
+                break
+            batch = [request]
+            size = len(request.texts)
+            deadline = default_timer() + self.max_wait
+            while size < self.max_batch and (self.clients is None or len(batch) < self.clients):
+                remaining = deadline - default_timer()
+                try:
+                    if remaining > 0:
+                        request = self.queue.get( timeout=remaining )
+                    else:
+                        request = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                batch.append( request )
+                size += len(request.texts)
+            self.classifyBatch( batch )
+
+    def classifyBatch( self, batch ):
+        ''' classify a batch of requests and wake up the threads waiting for them.
+            @param list of _Request
+        '''
+        self.batches += 1
+        # the requests asking for the same results are classified together
+        groups = {}
+        for request in batch:
+            groups.setdefault( (request.threshold, request.scores), [] ).append( request )
+        for (threshold, scores), requests in groups.iteritems():
+            texts = []
+            for request in requests:
+                texts.extend( request.texts )
+            try:
+                if scores:
+                    results = [s.items() for s in self.nb.categorize_many( texts )]
+                else:
+                    results = [match or False for match in self.nb.classify_stream( texts, threshold, chunk_size=len(texts) or 1 )]
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+                    request.done.set()
+                continue
+            self.requests += len(requests)
+            self.texts += len(texts)
+            for request in requests:
+                request.results = results[:len(request.texts)]
+                results = results[len(request.texts):]
+                request.done.set()
+
+
+class ClassifierHandler( SocketServer.StreamRequestHandler ):
+    ''' Answers the requests of a connection, one line of JSON each.
+
+    A request has the texts to classify, and optionally the model (by name),
+    the threshold and whether to return the score in each category:
+
+        {"texts": ["..."], "model": "default", "threshold": -0.01, "scores": false}
+
+    and its response has the best match of each text ([category, score] or
+    false), or the scores of each text as [category, score] best first:
+
+        {"matches": [["category", 0.5]]}   {"scores": [[["category", 0.5], ...]]}
+
+    {"stats": true} gets the number of requests, batches and texts classified
+    by each model. Errors are returned as {"error": "..."}. An "id" in a
+    request is returned in its response.
+    '''
+
+    def setup( self ):
+        self.disable_nagle_algorithm = isinstance( self.server, TCPClassifierServer )
+        SocketServer.StreamRequestHandler.setup( self )
+        for batcher in self.server.batchers.itervalues():
+            batcher.connect()
+
+    def finish( self ):
+        for batcher in self.server.batchers.itervalues():
+            batcher.disconnect()
+        SocketServer.StreamRequestHandler.finish( self )
+
+    def handle( self ):
+        for line in iter( self.rfile.readline, '' ):
+            line = line.strip()
+            if not line:
+                continue
+            request = None
+            try:
+                request = json.loads( line )
+                if not isinstance( request, dict ):
+                    raise ValueError( "a request must be a JSON object" )
+                response = self.server.answer( request )
+            except Exception as e:
+                response = { 'error': str(e) or e.__class__.__name__ }
+                if isinstance( request, dict ) and 'id' in request:
+                    response['id'] = request['id']
+            self.wfile.write( json.dumps( response ) + "\n" )
+
+
+class _ClassifierServer:
+    ''' The requests of a classifier server are answered by the batchers of its models '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def answer( self, request ):
+        ''' answer a request.
+            @see ClassifierHandler
+            @return array response
+            @param array request
+        '''
+        if request.get( 'stats' ):
+            return { 'stats': dict( [(name, batcher.stats()) for name, batcher in self.batchers.iteritems()] ) }
+        name = request.get( 'model', self.default_model )
+        batcher = self.batchers.get( name )
+        if batcher is None:
+            raise ValueError( "no model called %s" % name )
+        if 'texts' in request:
+            texts = request['texts']
+        elif 'text' in request:
+            texts = [request['text']]
+        else:
+            raise ValueError( "a request needs texts" )
+        if not isinstance( texts, list ) or not all( [isinstance( text, basestring ) for text in texts] ):
+            raise ValueError( "the texts must be a list of strings" )
+        threshold = float( request.get( 'threshold', -0.01 ) )
+        scores = bool( request.get( 'scores', False ) )
+
+        results = batcher.classify( texts, threshold, scores )
+        response = { 'scores' if scores else 'matches': results }
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def close( self ):
+        ''' stop the batchers, and remove the socket file of a Unix socket '''
+        self.server_close()
+        for batcher in self.batchers.itervalues():
+            batcher.stop()
+        if isinstance( self.server_address, basestring ) and os.path.exists( self.server_address ):
+            os.remove( self.server_address )
+
+class TCPClassifierServer( _ClassifierServer, SocketServer.ThreadingMixIn, SocketServer.TCPServer ):
+    pass
+
+class UnixClassifierServer( _ClassifierServer, SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+    pass
+
+def makeServer( address, batchers, default_model = None ):
+    ''' make a server answering requests on an address with a thread for each connection.
+        @return TCPClassifierServer or UnixClassifierServer
+        @param string "host:port" or the path of a Unix socket
+        @param array keys = model names, values = Batcher (opened)
+        @param string name of the model used when a request doesn't give one (default the only or first one)
+    '''
+    address = parseAddress( address )
+    if isinstance( address, tuple ):
+        server = TCPClassifierServer( address, ClassifierHandler )
+    else:
+        # a socket file left by a server that wasn't closed
+        if os.path.exists( address ):
+            if not stat.S_ISSOCK( os.stat( address ).st_mode ):
+                raise IOError( "%s is not a socket" % address )
+            os.remove( address )
+        server = UnixClassifierServer( address, ClassifierHandler )
+    server.batchers = batchers
+    server.default_model = default_model or sorted( batchers )[0]
+    return server
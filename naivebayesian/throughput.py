@@ -0,0 +1,46 @@
+import sys
+import time
+
+class ThroughputReporter:
+    ''' Keep count of the rows and tokens processed and report the rate.
+
+    update() is called as rows are processed, and every `interval` seconds a
+    line with the rows/s and tokens/s is written to the stream (stderr by
+    default). With no interval it only counts.
+    '''
+
+    def __init__(self, label = "rows", interval = 10.0, stream = None):
+        self.label = label
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.rows = 0
+        self.tokens = 0
+        self.start = time.time()
+        self.last_report = self.start
+
+    def update( self, rows, tokens = 0 ):
+        ''' count rows and tokens, reporting if the interval has passed.
+            @param int rows processed
+            @param int tokens processed
+        '''
+        self.rows += rows
+        self.tokens += tokens
+        if self.interval:
+            now = time.time()
+            if now - self.last_report >= self.interval:
+                self.last_report = now
+                self.report()
+
+    def rates( self ):
+        ''' get the rates since the start.
+            @return tuple (rows per second, tokens per second)
+        '''
+        elapsed = max( time.time() - self.start, 1e-9 )
+        return ( self.rows / elapsed, self.tokens / elapsed )
+
+    def report( self ):
+        ''' write the counts and rates to the stream '''
+        rows_rate, tokens_rate = self.rates()
+        self.stream.write( "%d %s, %.0f %s/s, %.0f tokens/s, %.0fs elapsed\n" % (
+            self.rows, self.label, rows_rate, self.label, tokens_rate, time.time() - self.start ) )
+        self.stream.flush()
@@ -0,0 +1,87 @@
+import re
+import zlib
+
+class Tokenizer:
+    ''' Split cleaned strings into counted tokens.
+
+    A token is kept if it is in the include list, or if it has the right
+    length, is not a number and is not in the ignore list. The patterns are
+    compiled once and the lists are held as frozensets, so a string is
+    tokenized in a single pass.
+
+    If a vocabulary (keys = tokens, values = integer ids) is given,
+    tokenize_ids() gives the counts of the known tokens by id.
+
+    If a number of hash buckets is given, each token is replaced by its
+    bucket (see bucket()), so a model never holds more than that many words
+    however many different tokens it is trained on. Tokens that fall in the
+    same bucket are counted together.
+    '''
+
+    token_pattern = re.compile( "[-_A-Za-z0-9]+" )
+
+    def __init__(self, ignore_list = (), include_list = (), min_token_length = 3, max_token_length = 15, vocabulary = None,
+                 hash_buckets = None):
+        self.ignore_list = frozenset( ignore_list )
+        self.include_list = frozenset( include_list )
+        self.min_token_length = min_token_length
+        self.max_token_length = max_token_length
+        self.vocabulary = vocabulary
+        self.hash_buckets = hash_buckets
+
+    def tokenize( self, string ):
+        ''' get the tokens from a cleaned string.
+            @return array keys = tokens, values = counts
+            @param  string the string to get the tokens from
+        '''
+        tokens = {}
+        ignore_list = self.ignore_list
+        include_list = self.include_list
+        min_length = self.min_token_length
+        max_length = self.max_token_length
+        for token in self.token_pattern.findall( string ):
+            if( (min_length <= len(token) <= max_length and
+                 token not in ignore_list and
+                 not token.isdigit()) or
+                token in include_list ):
+                tokens[token] = tokens.get( token, 0 ) + 1
+        if self.hash_buckets:
+            return self.hashTokens( tokens )
+        return tokens
+
+    def bucket( self, token ):
+        ''' get the bucket of a token when tokens are hashed.
+        The crc32 of the token is used, so a token is in the same bucket
+        whatever the platform or process. Buckets are written "#<number>",
+        which can't be mistaken for a token.
+
+            @return string bucket
+            @param  string token
+        '''
+        if isinstance(token, unicode):
+            token = token.encode('utf-8')
+        return "#%d" % ( (zlib.crc32( token ) & 0xffffffff) % self.hash_buckets )
+
+    def hashTokens( self, tokens ):
+        ''' replace counted tokens by their buckets.
+            @return array keys = buckets, values = counts
+            @param  array keys = tokens, values = counts
+        '''
+        buckets = {}
+        for token, count in tokens.iteritems():
+            bucket = self.bucket( token )
+            buckets[bucket] = buckets.get( bucket, 0 ) + count
+        return buckets
+
+    def tokenize_ids( self, string ):
+        ''' get the ids of the known tokens from a cleaned string.
+            @return array keys = token ids, values = counts
+            @param  string the string to get the tokens from
+        '''
+        ids = {}
+        vocabulary = self.vocabulary
+        for token, count in self.tokenize( string ).iteritems():
+            token_id = vocabulary.get( token )
+            if token_id is not None:
+                ids[token_id] = ids.get( token_id, 0 ) + count
+        return ids
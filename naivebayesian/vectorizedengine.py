@@ -0,0 +1,148 @@
+import math
+
+class VectorizedEngine:
+    ''' Vectorized scoring of documents against a trained model.
+
+    The word frequencies held by a storage object are loaded once into a
+    token-index x category matrix, and documents are then scored with a few
+    array operations in log space instead of a loop over every category and
+    every token. Scores are the same as the ones NaiveBayesian.categorize()
+    computes before rescaling.
+
+    numpy is required. If scipy is installed, models too big to be held as a
+    dense matrix are held as a sparse one and batches are scored with a single
+    sparse product.
+    '''
+
+    # largest number of cells (words x categories) held in a dense matrix
+    dense_limit = 20000000
+
+    def __init__(self, nbs, dense_limit = None):
+        import numpy
+        self.np = numpy
+        try:
+            import scipy.sparse
+            self.sparse = scipy.sparse
+        except ImportError:
+            self.sparse = None
+
+        self.nbs = nbs
+        if dense_limit is not None:
+            self.dense_limit = dense_limit
+        self.load()
+
+    def load( self ):
+        ''' load the categories and word frequencies from the storage.
+
+        For every category c the score of a document is
+            log(probability[c]) + n * base[c] + sum( count[t] * delta[t, c] )
+        where n is the number of known tokens in the document, base[c] is the
+        log likelihood of a token not seen in the category and delta[t, c] is
+        the difference made by the token t having been seen in the category.
+
+            @return bool success
+        '''
+        np = self.np
+        categories = self.nbs.getCategories()
+        self.categories = list(categories)
+        cat_index = dict( (cat, i) for i, cat in enumerate(self.categories) )
+        ncat = len(self.categories)
+
+        total_words = 0
+        for cat in self.categories:
+            total_words += categories[cat]['word_count']
+
+        word_counts = np.array( [categories[cat]['word_count'] for cat in self.categories], dtype=float )
+        probability = np.array( [categories[cat]['probability'] for cat in self.categories], dtype=float )
+
+        with np.errstate(divide='ignore'):
+            # small probability for a word not in the category
+            log_small = -np.log( (word_counts+1)*20000 )
+            if ncat > 0:
+                # the same scaling categorize() uses to avoid underflow
+                log_scale = np.log( float(total_words/ncat) )
+            else:
+                log_scale = 0.0
+            self.log_prior = np.log( probability )
+        self.base = log_small + log_scale
+
+        self.vocabulary = {}
+        rows = []
+        cols = []
+        values = []
+        for word, category_id, count in self.nbs.getWordFreqs():
+            index = self.vocabulary.setdefault( word, len(self.vocabulary) )
+            cat = cat_index.get( category_id )
+            if cat is None or count <= 0 or word_counts[cat] <= 0:
+                continue
+            rows.append( index )
+            cols.append( cat )
+            values.append( math.log( float(count) / word_counts[cat] ) - log_small[cat] )
+
+        shape = ( len(self.vocabulary), ncat )
+        if self.sparse is not None and shape[0]*shape[1] > self.dense_limit:
+            self.delta = self.sparse.csr_matrix( (values, (rows, cols)), shape=shape )
+        else:
+            self.delta = np.zeros( shape )
+            self.delta[rows, cols] = values
+        return True
+
+    def score( self, tokens ):
+        ''' score a document given as tokens.
+            @return dict keys = category ids, values = scores
+            @param  dict tokens (keys = token, values = count)
+        '''
+        return self.score_many( [tokens] )[0]
+
+    def score_many( self, documents ):
+        ''' score a batch of documents given as tokens.
+            @return list of dict (keys = category ids, values = scores)
+            @param  list of dict tokens (keys = token, values = count)
+        '''
+        ids = []
+        for tokens in documents:
+            token_ids = {}
+            for token, count in tokens.iteritems():
+                index = self.vocabulary.get( token )
+                if index is not None:
+                    token_ids[index] = count
+            ids.append( token_ids )
+        return self.score_many_ids( ids )
+
+    def score_many_ids( self, documents ):
+        ''' score a batch of documents given as token ids from the vocabulary.
+            @see Tokenizer.tokenize_ids()
+            @return list of dict (keys = category ids, values = scores)
+            @param  list of dict token ids (keys = index in vocabulary, values = count)
+        '''
+        np = self.np
+        if len(self.categories) == 0:
+            return [{} for tokens in documents]
+
+        known = np.array( [sum( tokens.itervalues() ) for tokens in documents], dtype=float )
+        if self.sparse is not None:
+            rows = []
+            cols = []
+            values = []
+            for i, tokens in enumerate(documents):
+                for index, count in tokens.iteritems():
+                    rows.append( i )
+                    cols.append( index )
+                    values.append( count )
+            matrix = self.sparse.csr_matrix( (values, (rows, cols)), shape=(len(documents), len(self.vocabulary)) )
+            seen = matrix.dot( self.delta )
+            if self.sparse.issparse( seen ):
+                seen = seen.toarray()
+        else:
+            seen = np.zeros( (len(documents), len(self.categories)) )
+            for i, tokens in enumerate(documents):
+                if tokens:
+                    indexes = list( tokens.iterkeys() )
+                    counts = np.array( list( tokens.itervalues() ), dtype=float )
+                    seen[i] = np.dot( counts, self.delta[indexes] )
+
+        with np.errstate(invalid='ignore', over='ignore'):
+            unseen = np.where( known[:, None] > 0, known[:, None] * self.base, 0.0 )
+            scores = np.exp( self.log_prior + unseen + seen )
+
+        return [dict( zip(self.categories, row.tolist()) ) for row in scores]
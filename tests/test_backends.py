@@ -0,0 +1,183 @@
+''' Tests of the backends, on sqlite and on a stand-in for a database with
+another dialect.
+
+    > python -m unittest discover tests
+'''
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from naivebayesian import backends
+from naivebayesian.backends import SqliteBackend, ConnectionPool, TranslatingCursor, registerBackend
+from naivebayesian.naivebayesian import NaiveBayesian
+
+documents = [
+    ( "d1", "fruit", u"apple banana cherry apple" ),
+    ( "d2", "fruit", u"banana mango apple pear" ),
+    ( "d3", "veg", u"carrot potato onion carrot" ),
+    ( "d4", "veg", u"potato leek onion spinach" ),
+]
+
+class StandInCursor:
+    ''' A cursor taking statements written like MySQL's, with %s placeholders,
+    INSERT IGNORE and ON DUPLICATE KEY UPDATE, and running them on sqlite. '''
+
+    def __init__(self, cursor, statements):
+        self.cursor = cursor
+        self.statements = statements
+
+    def sqlite( self, sql ):
+        self.statements.append( sql )
+        sql = sql.replace( "INSERT IGNORE", "INSERT OR IGNORE" ).replace( "%s", "?" )
+        return re.sub( r"ON DUPLICATE KEY UPDATE (\w+) = \w+ \+ VALUES\(\w+\)", r"ON CONFLICT DO UPDATE SET \1 = \1 + excluded.\1", sql )
+
+    def execute( self, sql, *args ):
+        return self.cursor.execute( self.sqlite( sql ), *args )
+
+    def executemany( self, sql, *args ):
+        return self.cursor.executemany( self.sqlite( sql ), *args )
+
+    def __iter__( self ):
+        return iter( self.cursor )
+
+    def __getattr__( self, name ):
+        return getattr( self.cursor, name )
+
+class StandInConnection:
+    ''' An sqlite connection whose cursors are StandInCursors '''
+
+    def __init__(self, con, statements):
+        self.con = con
+        self.statements = statements
+
+    def cursor( self ):
+        return StandInCursor( self.con.cursor(), self.statements )
+
+    def __getattr__( self, name ):
+        return getattr( self.con, name )
+
+class StandInBackend( SqliteBackend ):
+    ''' A database with the format paramstyle and MySQL's upserts, held by sqlite '''
+
+    name = "standin"
+    paramstyle = 'format'
+    insert_ignore = "INSERT IGNORE"
+    layouts = ( "v1", )
+    # every statement the database was given
+    received = []
+
+    def connect( self ):
+        return StandInConnection( SqliteBackend.connect( self ), self.received )
+
+    def upsert( self, sql, key, column ):
+        return "%s ON DUPLICATE KEY UPDATE %s = %s + VALUES(%s)" % ( sql, column, column, column )
+
+
+class StandInBackendTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        registerBackend( "standin", StandInBackend )
+        StandInBackend.received[:] = []
+
+    def tearDown( self ):
+        del backends.backends["standin"]
+        shutil.rmtree( self.directory )
+
+    def trainModel( self, name, backend ):
+        nb = NaiveBayesian( os.path.join( self.directory, name ), backend=backend )
+        nb.train_many( documents )
+        nb.train( "d5", "veg", u"cabbage carrot leek" )
+        nb.untrain( "d2" )
+        nb.updateProbabilities()
+        return nb
+
+    def test_translated_statements( self ):
+        nb = self.trainModel( "standin.db", "standin" )
+        self.assertTrue( isinstance( nb.nbs.get_db_cursor(), TranslatingCursor ) )
+        statements = StandInBackend.received
+        self.assertTrue( [sql for sql in statements if "%s" in sql] )
+        self.assertTrue( [sql for sql in statements if sql.startswith( "INSERT IGNORE" )] )
+        self.assertTrue( [sql for sql in statements if "ON DUPLICATE KEY UPDATE" in sql] )
+        self.assertEqual( [sql for sql in statements if "?" in sql or "INSERT OR IGNORE" in sql], [] )
+
+    def test_same_model_as_sqlite( self ):
+        nb = self.trainModel( "standin.db", "standin" )
+        expected = self.trainModel( "sqlite.db", "sqlite" )
+        self.assertEqual( nb.nbs.getCategories(), expected.nbs.getCategories() )
+        self.assertEqual( sorted( nb.nbs.getWordFreqs() ), sorted( expected.nbs.getWordFreqs() ) )
+        for query in ( u"apple carrot", u"leek onion", u"mango" ):
+            self.assertEqual( nb.categorize( query ), expected.categorize( query ) )
+            self.assertEqual( nb.bestMatch( query ), expected.bestMatch( query ) )
+
+
+class ConnectionPoolTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.backend = SqliteBackend( os.path.join( self.directory, "model.db" ), shared=True )
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def inThread( self, function ):
+        ''' call a function in another thread.
+            @return tuple (result, exception raised)
+        '''
+        outcome = [None, None]
+        def run():
+            try:
+                outcome[0] = function()
+            except Exception, e:
+                outcome[1] = e
+        thread = threading.Thread( target=run )
+        thread.start()
+        thread.join()
+        return tuple( outcome )
+
+    def test_connection_per_thread( self ):
+        pool = ConnectionPool( self.backend, 4 )
+        con = pool.connection()
+        self.assertTrue( pool.connection() is con )
+        other, error = self.inThread( pool.connection )
+        self.assertEqual( error, None )
+        self.assertFalse( other is con )
+        self.assertEqual( len(pool.opened), 2 )
+        pool.close()
+
+    def test_released_connection_is_reused( self ):
+        pool = ConnectionPool( self.backend, 1 )
+        def useAndRelease():
+            con = pool.connection()
+            pool.release()
+            return con
+        con, error = self.inThread( useAndRelease )
+        self.assertTrue( pool.connection() is con )
+        pool.close()
+
+    def test_exhausted_pool_of_one( self ):
+        pool = ConnectionPool( self.backend, 1 )
+        pool.connection()
+        other, error = self.inThread( pool.connection )
+        self.assertTrue( isinstance( error, RuntimeError ) )
+        self.assertTrue( "exhausted" in str(error) )
+        pool.close()
+
+    def test_exhausted_pool_waits( self ):
+        pool = ConnectionPool( self.backend, 2 )
+        pool.timeout = 0.1
+        pool.connection()
+        self.inThread( pool.connection )
+        other, error = self.inThread( pool.connection )
+        self.assertTrue( isinstance( error, RuntimeError ) )
+        self.assertEqual( len(pool.opened), 2 )
+        pool.close()
+
+    def test_memory_model_is_not_shared( self ):
+        self.assertRaises( ValueError, SqliteBackend, ":memory:", shared=True )
+
+
+if __name__ == '__main__':
+    unittest.main()
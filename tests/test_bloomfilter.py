@@ -0,0 +1,77 @@
+''' Tests of the bloom filter saved next to a model.
+
+    > python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.bloomfilter import BloomFilter
+
+documents = [
+    ( "d1", "fruit", u"apple banana cherry apple" ),
+    ( "d2", "veg", u"carrot potato onion carrot" ),
+]
+
+class BloomFilterTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join( self.directory, "model.db" )
+        self.bloom_file = self.filename + ".bloom"
+        nb = NaiveBayesian( self.filename )
+        nb.train_many( documents )
+        nb.updateProbabilities()
+        nb.nbs.close()
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def test_read_only_model( self ):
+        # a missing filter is built in memory only
+        nb = NaiveBayesian( self.filename, read_only=True, bloom_filter=True )
+        self.assertTrue( u"apple" in nb.nbs.bloom )
+        self.assertFalse( os.path.exists( self.bloom_file ) )
+        self.assertEqual( nb.bestMatch( u"carrot onion" )[0], "veg" )
+        nb.nbs.close()
+
+        # and so is one older than the model
+        BloomFilter( 10, 0.01 ).save( self.bloom_file )
+        stale = time.time() - 60
+        os.utime( self.bloom_file, (stale, stale) )
+        with open(self.bloom_file, 'rb') as f:
+            saved = f.read()
+        nb = NaiveBayesian( self.filename, read_only=True, bloom_filter=True )
+        self.assertTrue( u"apple" in nb.nbs.bloom )
+        with open(self.bloom_file, 'rb') as f:
+            self.assertEqual( f.read(), saved )
+        nb.nbs.close()
+
+    def test_saved_with_model( self ):
+        nb = NaiveBayesian( self.filename, bloom_filter=True )
+        self.assertTrue( os.path.exists( self.bloom_file ) )
+        nb.train( "d3", "nuts", u"walnut pecan" )
+        nb.updateProbabilities()
+        nb.nbs.close()
+        self.assertTrue( u"walnut" in BloomFilter.load( self.bloom_file ) )
+        self.assertEqual( sorted( os.listdir( self.directory ) ), ["model.db", "model.db.bloom"] )
+
+    def test_save_replaces_file( self ):
+        bloom = BloomFilter( 100, 0.01 )
+        bloom.add( u"apple" )
+        bloom.save( self.bloom_file )
+        with open(self.bloom_file, 'rb') as f:
+            saved = f.read()
+        # a process reading the filter while it is saved again reads it whole
+        with open(self.bloom_file, 'rb') as f:
+            bloom.add( u"pear" )
+            bloom.save( self.bloom_file )
+            self.assertEqual( f.read(), saved )
+        self.assertTrue( u"pear" in BloomFilter.load( self.bloom_file ) )
+        self.assertEqual( sorted( os.listdir( self.directory ) ), ["model.db", "model.db.bloom"] )
+
+
+if __name__ == '__main__':
+    unittest.main()
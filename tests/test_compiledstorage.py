@@ -0,0 +1,78 @@
+''' Tests of compiled models against the databases they are compiled from.
+
+    > python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.compiledstorage import CompiledStorage
+
+documents = [
+    ( "d1", "fruit", u"apple banana cherry apple" ),
+    ( "d2", "fruit", u"banana mango apple pear" ),
+    ( "d3", "fruit", u"cherry grape melon" ),
+    ( "d4", "veg", u"carrot potato onion carrot" ),
+    ( "d5", "veg", u"potato leek onion spinach" ),
+    ( "d6", "veg", u"cabbage carrot leek" ),
+    ( "d7", "veg", u"spinach kale melon" ),
+]
+
+queries = [
+    u"apple banana",
+    u"melon kale",
+    u"carrot melon grape",
+    u"spinach cherry",
+    u"melon",
+]
+
+class CompiledStorageTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def trainModel( self, layout ):
+        nb = NaiveBayesian( os.path.join( self.directory, "model-%s.db" % layout ), layout=layout )
+        nb.train_many( documents )
+        nb.updateProbabilities()
+        return nb
+
+    def compileModel( self, nb ):
+        filename = nb.nbs.dbname + ".nbm"
+        CompiledStorage.compile( nb.nbs, filename )
+        return NaiveBayesian( filename )
+
+    def assertSameScores( self, nb, compiled ):
+        for query in queries:
+            expected = nb.categorize( query )
+            scores = compiled.categorize( query )
+            self.assertEqual( sorted( scores ), sorted( expected ), query )
+            for category in expected:
+                self.assertAlmostEqual( scores[category], expected[category], 12, "%s in %s" % (query, category) )
+
+    def test_scores_after_untrain( self ):
+        for layout in ( "v1", "v2" ):
+            nb = self.trainModel( layout )
+            nb.untrain( "d3" )
+            nb.untrain_many( [ "d7" ] )
+            # models untrained before rows were deleted once their counts were
+            # used up keep rows with no count left: melon is one of them
+            cur = nb.nbs.get_db_cursor()
+            cur.execute( nb.nbs.sql['replace_freq'], ( 0, u"melon", "fruit" ) )
+            nb.nbs.commit()
+            nb.nbs.word_cache.clear()
+            nb.updateProbabilities()
+            self.assertEqual( nb.nbs.getWordCounts( [u"melon"] ), { u"melon": { "fruit": 0 } } )
+
+            compiled = self.compileModel( nb )
+            self.assertEqual( compiled.nbs.getWordCounts( [u"melon"] ), { u"melon": { "fruit": 0 } } )
+            self.assertSameScores( nb, compiled )
+            compiled.nbs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
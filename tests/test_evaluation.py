@@ -0,0 +1,101 @@
+''' Tests of cross-validation without retraining, against models retrained
+for each fold.
+
+    > python -m unittest discover tests
+'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.inmemorynaivebayesianstorage import InMemoryNaiveBayesianStorage
+
+def words( rng, count ):
+    return [u"".join( [rng.choice( u"abcdefghijklmnopqrstuvwxyz" ) for i in xrange(5)] ) for j in xrange(count)]
+
+class EvaluationTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        rng = random.Random( 11 )
+        # categories sharing some of their words, so some references are missed,
+        # and one with so few references that it is left out of some folds
+        common = words( rng, 15 )
+        sizes = { "alpha": 9, "beta": 8, "gamma": 7, "delta": 1 }
+        self.documents = []
+        for category_id, size in sorted( sizes.iteritems() ):
+            own = words( rng, 10 )
+            for d in xrange(size):
+                content = [rng.choice( own ) for i in xrange(rng.randint( 2, 6 ))] + [rng.choice( common ) for i in xrange(rng.randint( 2, 6 ))]
+                self.documents.append( ( "%s-%02d" % (category_id, d), category_id, u" ".join( content ) ) )
+        rng.shuffle( self.documents )
+        self.nb = NaiveBayesian( os.path.join( self.directory, "model.db" ) )
+        self.nb.train_many( self.documents )
+        self.nb.updateProbabilities()
+
+    def tearDown( self ):
+        self.nb.nbs.close()
+        shutil.rmtree( self.directory )
+
+    def retrained( self, folds ):
+        ''' cross-validate by training a model for each fold.
+            @return tuple (list of the number of references given their own category in each fold, confusion)
+        '''
+        # a reference is in fold i when its place in the order of the ids, modulo folds, is i
+        ordered = sorted( self.documents )
+        correct = []
+        confusion = Counter()
+        for fold in xrange(folds):
+            nb = NaiveBayesian( None, storage=InMemoryNaiveBayesianStorage() )
+            nb.train_many( [document for i, document in enumerate( ordered ) if i % folds != fold] )
+            nb.updateProbabilities()
+            right = 0
+            for doc_id, category_id, content in [document for i, document in enumerate( ordered ) if i % folds == fold]:
+                match = nb.bestMatch( content )
+                matched = match[0] if match else None
+                confusion[(category_id, matched)] += 1
+                if matched == category_id:
+                    right += 1
+            correct.append( right )
+        return correct, dict( confusion )
+
+    def test_same_as_retraining( self ):
+        for folds in ( 2, 3, 5, len(self.documents) ):
+            correct, confusion = self.retrained( folds )
+            for chunk_size in ( 1, 4, 1000 ):
+                results = self.nb.evaluate_folds( folds, chunk_size=chunk_size )
+                self.assertEqual( [fold['correct'] for fold in results['folds']], correct, "%d folds" % folds )
+                self.assertEqual( results['confusion'], confusion, "%d folds" % folds )
+                self.assertEqual( results['documents'], len(self.documents) )
+            self.assertTrue( sum( correct ) < len(self.documents) )
+
+    def test_fold_restored( self ):
+        model = InMemoryNaiveBayesianStorage()
+        model.loadDatabase( self.nb.nbs )
+        model.updateProbabilities()
+        expected = model.copy()
+        references = list( self.nb._foldReferences( 3, False ) )
+        left_out = []
+        for fold in xrange(3):
+            counts = ( {}, {} )
+            self.nb._countReferences( counts[0], counts[1], [reference[1:] for reference in references if reference[0] == fold], [], None )
+            hidden = self.nb._takeFold( model, counts )
+            left_out.extend( hidden )
+            self.assertNotEqual( model.words, expected.words )
+            self.nb._restoreFold( model, counts, hidden )
+            model.updateProbabilities()
+            self.assertEqual( model.words, expected.words )
+            self.assertEqual( model.categories, expected.categories )
+        self.assertEqual( left_out, ["delta"] )
+
+    def test_model_unchanged( self ):
+        before = ( self.nb.nbs.getCategories(), sorted( self.nb.nbs.getWordFreqs() ), sorted( self.nb.nbs.getReferenceTokens() ) )
+        self.nb.evaluate_folds( 3 )
+        after = ( self.nb.nbs.getCategories(), sorted( self.nb.nbs.getWordFreqs() ), sorted( self.nb.nbs.getReferenceTokens() ) )
+        self.assertEqual( after, before )
+
+
+if __name__ == '__main__':
+    unittest.main()
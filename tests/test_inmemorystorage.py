@@ -0,0 +1,80 @@
+''' Tests of models loaded into memory and written back.
+
+    > python -m unittest discover tests
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from naivebayesian.naivebayesian import NaiveBayesian
+from naivebayesian.inmemorynaivebayesianstorage import InMemoryNaiveBayesianStorage
+
+documents = [
+    ( "d1", "fruit", u"apple banana cherry apple" ),
+    ( "d2", "fruit", u"banana mango apple pear" ),
+    ( "d3", "veg", u"carrot potato onion carrot" ),
+]
+
+def referenceRows( filename ):
+    ''' read every column of the references of a database '''
+    con = sqlite3.connect( filename )
+    try:
+        return con.execute( "SELECT id, category_id, content, tokens FROM `references` ORDER BY id" ).fetchall()
+    finally:
+        con.close()
+
+class InMemoryStorageTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join( self.directory, "model.db" )
+        nb = NaiveBayesian( self.filename )
+        nb.train_many( documents )
+        nb.updateProbabilities()
+        nb.nbs.close()
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def test_save_keeps_references( self ):
+        rows = referenceRows( self.filename )
+        self.assertEqual( len(rows), 3 )
+        self.assertEqual( [row for row in rows if row[3] is None], [] )
+
+        nbs = InMemoryNaiveBayesianStorage( self.filename )
+        copy = os.path.join( self.directory, "copy.db" )
+        nbs.saveDatabase( copy )
+        self.assertEqual( referenceRows( copy ), rows )
+        nbs.save()
+        self.assertEqual( referenceRows( self.filename ), rows )
+
+    def test_trained_in_memory( self ):
+        nb = NaiveBayesian( self.filename, storage="memory" )
+        nb.train( "d4", "veg", u"leek onion spinach" )
+        nb.nbs.save()
+        rows = referenceRows( self.filename )
+        self.assertEqual( [row[0] for row in rows], ["d1", "d2", "d3", "d4"] )
+        self.assertEqual( [row for row in rows if row[3] is None], [] )
+
+        # references untrained in memory take off the tokens they were trained with
+        nb = NaiveBayesian( self.filename, storage="memory" )
+        self.assertEqual( dict( [(doc_id, tokens) for doc_id, category_id, content, tokens in nb.nbs.getReferenceTokens()] )["d4"],
+                          { u"leek": 1, u"onion": 1, u"spinach": 1 } )
+        nb.ignore_list = [u"onion"]
+        nb.untrain( "d4" )
+        self.assertEqual( nb.nbs.getWord( u"onion", "veg" ), {'count': 1} )
+
+    def test_snapshot_keeps_tokens( self ):
+        nbs = InMemoryNaiveBayesianStorage( self.filename )
+        snapshot = os.path.join( self.directory, "model.nbs" )
+        nbs.saveSnapshot( snapshot )
+        loaded = InMemoryNaiveBayesianStorage( snapshot )
+        self.assertEqual( list( loaded.getReferenceTokens() ), list( nbs.getReferenceTokens() ) )
+        copy = os.path.join( self.directory, "copy.db" )
+        loaded.saveDatabase( copy )
+        self.assertEqual( referenceRows( copy ), referenceRows( self.filename ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+''' Tests of the best matches of models with many categories, where only the
+categories that can make the top k are scored in full.
+
+    > python -m unittest discover tests
+'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from naivebayesian.naivebayesian import NaiveBayesian
+
+def words( rng, count ):
+    return [u"".join( [rng.choice( u"abcdefghijklmnopqrstuvwxyz" ) for i in xrange(5)] ) for j in xrange(count)]
+
+class TopMatchesTest( unittest.TestCase ):
+
+    categories = 70
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        rng = random.Random( 7 )
+        # the categories of a group have the same words in other proportions,
+        # so their scores are close
+        groups = [words( rng, 8 ) for g in xrange(self.categories/5 + 1)]
+        common = words( rng, 20 )
+        documents = []
+        for c in xrange(self.categories):
+            own = [word for word in groups[c/5] for i in xrange(rng.randint( 1, 4 ))]
+            for d in xrange(3):
+                content = [rng.choice( own ) for i in xrange(12)] + [rng.choice( common ) for i in xrange(3)]
+                documents.append( ( "c%02d-%d" % (c, d), "c%02d" % c, u" ".join( content ) ) )
+        self.queries = [u" ".join( [rng.choice( rng.choice( groups ) + common ) for i in xrange(rng.randint( 1, 12 ))] ) for q in xrange(30)]
+        self.queries.extend( [u" ".join( [rng.choice( group ) for i in xrange(6)] ) for group in groups] )
+        self.queries.append( u" ".join( common[:6] ) )
+
+        self.nb = NaiveBayesian( os.path.join( self.directory, "model.db" ) )
+        self.nb.train_many( documents )
+        self.nb.updateProbabilities()
+        # count the categories scored in full
+        self.scored = 0
+        score = self.nb._scoreCategory
+        def counted( *args ):
+            self.scored += 1
+            return score( *args )
+        self.nb._scoreCategory = counted
+
+    def tearDown( self ):
+        self.nb.nbs.close()
+        shutil.rmtree( self.directory )
+
+    def assertSameTop( self, query, k ):
+        expected = self.nb.categorize( query ).items()
+        self.scored = 0
+        matches = self.nb.topMatches( query, k )
+        self.assertEqual( len(matches), k, query )
+        for (category, score), (first, best) in zip( matches, expected ):
+            self.assertAlmostEqual( score, best, 12, query )
+            # a tie may go either way
+            self.assertAlmostEqual( dict( expected )[category], score, 12, "%s in %s" % (query, category) )
+        return self.scored < self.categories
+
+    def test_pruned_top_matches( self ):
+        self.assertTrue( self.categories > self.nb.prune_min_categories )
+        for k in ( 1, 3, 10 ):
+            pruned = [query for query in self.queries if self.assertSameTop( query, k )]
+            self.assertTrue( pruned, "no category was left out of the top %d" % k )
+
+    def test_common_tokens( self ):
+        # the words of a group are counted exactly, and the common ones are
+        # only bound by their best factor in any category
+        self.nb.prune_max_postings = 5
+        for k in ( 1, 5 ):
+            pruned = [query for query in self.queries if self.assertSameTop( query, k )]
+            self.assertTrue( pruned, "no category was left out of the top %d" % k )
+
+    def test_best_match( self ):
+        for query in self.queries:
+            expected = self.nb.categorize( query ).items()
+            match = self.nb.bestMatch( query )
+            self.assertAlmostEqual( match[1], expected[0][1], 12, query )
+            self.assertAlmostEqual( dict( expected )[match[0]], match[1], 12, query )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+''' Tests of the ways of training a model, which must all give the same model.
+
+    > python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from naivebayesian.naivebayesian import NaiveBayesian
+
+documents = [
+    ( "d1", "fruit", u"apple banana cherry apple" ),
+    ( "d2", "fruit", u"banana mango apple pear" ),
+    ( "d3", "veg", u"carrot potato onion carrot" ),
+    # the same id again, in another category
+    ( "d1", "veg", u"leek onion spinach" ),
+    # ids and categories that are the same once their tags and spaces are taken off
+    ( "<b>d2</b>", "veg", u"cabbage carrot leek" ),
+    ( "d 4", "<i>veg</i>", u"potato leek onion spinach" ),
+    ( "d4", "fruit", u"melon grape" ),
+    ( " <p>d5</p> ", "fruit", u"cherry grape melon pear" ),
+    # nothing to train
+    ( "d6", "", u"apple pear" ),
+    ( "d7", "veg", u"   " ),
+    # already a reference of the model
+    ( "d0", "veg", u"kale spinach" ),
+    ( "d8", "nuts", u"almond walnut cashew pecan almond" ),
+    ( "d5", "nuts", u"walnut pecan" ),
+    ( "d9", "nuts", u"cashew hazelnut" ),
+]
+
+class TrainingTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+
+    def newModel( self, name ):
+        nb = NaiveBayesian( os.path.join( self.directory, name ) )
+        nb.train( "d0", "fruit", u"kiwi lemon lime" )
+        return nb
+
+    def model( self, nb ):
+        ''' everything a model holds.
+            @return tuple (categories, word frequencies, references with their tokens)
+        '''
+        nb.updateProbabilities()
+        return ( nb.nbs.getCategories(), sorted( nb.nbs.getWordFreqs() ), sorted( nb.nbs.getReferenceTokens() ) )
+
+    def test_same_model( self ):
+        serial = self.newModel( "serial.db" )
+        trained = [serial.train( *document ) for document in documents]
+        self.assertEqual( trained.count( True ), 7 )
+        expected = self.model( serial )
+        self.assertEqual( [reference[0] for reference in expected[2]], ["d0", "d1", "d2", "d3", "d4", "d5", "d8", "d9"] )
+
+        for batch_size in ( 1, 4, 1000 ):
+            nb = self.newModel( "many-%d.db" % batch_size )
+            self.assertEqual( nb.train_many( documents, batch_size ), 7 )
+            self.assertEqual( self.model( nb ), expected, "batches of %d" % batch_size )
+
+        for chunk_size in ( 1, 4, 1000 ):
+            nb = self.newModel( "parallel-%d.db" % chunk_size )
+            self.assertEqual( nb.train_parallel( documents, 2, chunk_size ), 7 )
+            self.assertEqual( self.model( nb ), expected, "shards of %d" % chunk_size )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+''' Tests of the numpy engine against the classifier's own scoring.
+
+    > python -m unittest discover tests
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from naivebayesian.naivebayesian import NaiveBayesian
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+documents = [
+    ( "d1", "fruit", u"apple banana cherry apple" ),
+    ( "d2", "fruit", u"banana mango apple pear" ),
+    ( "d3", "veg", u"carrot potato onion carrot" ),
+    ( "d4", "veg", u"potato leek onion spinach" ),
+    ( "d5", "nuts", u"almond walnut cashew pecan" ),
+    # two categories trained alike, which score the same
+    ( "d6", "herbs", u"basil thyme parsley" ),
+    ( "d7", "spices", u"basil thyme parsley" ),
+]
+
+queries = [
+    u"apple banana",
+    u"carrot onion mango",
+    u"walnut apple walnut",
+    u"basil thyme",
+    u"nothing known here",
+    u"",
+]
+
+@unittest.skipIf( numpy is None, "numpy is not installed" )
+class VectorizedEngineTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        filename = os.path.join( self.directory, "model.db" )
+        nb = NaiveBayesian( filename )
+        nb.train_many( documents )
+        nb.updateProbabilities()
+        nb.nbs.close()
+        self.nb = NaiveBayesian( filename, read_only=True )
+        self.vectorized = NaiveBayesian( filename, read_only=True, vectorized=True )
+
+    def tearDown( self ):
+        self.nb.nbs.close()
+        self.vectorized.nbs.close()
+        shutil.rmtree( self.directory )
+
+    def assertSameScores( self, scores, expected, query ):
+        self.assertEqual( sorted( scores ), sorted( expected ), query )
+        for category in expected:
+            self.assertAlmostEqual( scores[category], expected[category], 9, "%s in %s" % (query, category) )
+        # the categories come best first, in any order among equal scores
+        values = scores.values()
+        for first, second in zip( values, values[1:] ):
+            self.assertTrue( first >= second - 1e-9, query )
+
+    def test_categorize( self ):
+        for query in queries:
+            self.assertSameScores( self.vectorized.categorize( query ), self.nb.categorize( query ), query )
+        for query, scores in zip( queries, self.vectorized.categorize_many( queries ) ):
+            self.assertSameScores( scores, self.nb.categorize( query ), query )
+
+    def test_best_match( self ):
+        for query in queries:
+            expected = self.nb.categorize( query )
+            best = max( expected.values() )
+            match = self.vectorized.bestMatch( query )
+            self.assertNotEqual( match, False, query )
+            self.assertAlmostEqual( match[1], best, 9, query )
+            # a tie may go either way
+            self.assertTrue( match[0] in [category for category in expected if abs(expected[category] - best) < 1e-9], query )
+            self.assertAlmostEqual( self.nb.bestMatch( query )[1], best, 9, query )
+
+    def test_threshold( self ):
+        for query in queries:
+            self.assertEqual( self.vectorized.bestMatch( query, 1.1 ), False )
+            self.assertEqual( self.nb.bestMatch( query, 1.1 ), False )
+
+
+if __name__ == '__main__':
+    unittest.main()